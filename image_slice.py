@@ -1,6 +1,24 @@
+import time
+# when the module import begins, for --profile-startup.
+_MODULE_IMPORT_STARTED = time.perf_counter()
+
 import os
-import argparse
-from PIL import Image
+import io
+import sys
+import bisect
+import threading
+import functools
+import collections
+import importlib
+import json
+import base64
+
+# PIL is imported here, not lazily on the first use: a lazily loaded module is not thread-safe, two threads using it
+# for the first time at once (the crop, pipeline, upload and encode threads) may see it half loaded.
+# The heavy modules only a few features need (numpy, http.server, tarfile, ...) are imported by those functions.
+_PIL_IMPORT_STARTED = time.perf_counter()
+from PIL import Image, ImageOps, ImageChops
+_PIL_IMPORTED = time.perf_counter()
 
 
 # return a list, in which contains the calculated width/height of each slice.
@@ -78,41 +96,408 @@ def _calculate_slices_size(image_height_or_width, slice_count, step_size, ratio)
         # make sure it's a ratio slice, other 2 arguments should be 0, or it's a invalid invoke.
         assert slice_count == 0
         assert step_size == 0
-        # parse the ratio string
-        ratio_list = ratio.split(':')
-        ratio_list = [int(i) for i in ratio_list]
-        # make sure it's a valid ratio. split by ':', the output should be a list.
-        # for example, '3:2', will be ['3','2']
-        assert ratio_list
-
-        # calculation begins
-        # how many parts in this ratio expression
-        parts_count = len(ratio_list)
-        ratio_sum = 0
-        # sum all the ratio numbers
-        for ratio_number in ratio_list:
-            ratio_sum += ratio_number
-        # calculate the base size
-        base_size = int(image_height_or_width // ratio_sum)
-        remainder = image_height_or_width - base_size * ratio_sum
-
-        # distribute the remainder to all the parts.
-        remainder_each = int(remainder // parts_count)
-        remainder_of_remainder = remainder - remainder_each * parts_count
-
-        # final distribute
-        for part in range(parts_count):
-            each_ratio_size = ratio_list[part] * base_size + remainder_each
-            if remainder_of_remainder > 0:
-                each_ratio_size += 1
-                remainder_of_remainder -= 1
-            slices_size.append(each_ratio_size)
+        # parse the ratio string, the ratio string is validated there.
+        # for example, '3:2', will be (3, 2)
+        slices_size = _distribute_by_ratio(image_height_or_width, _parse_ratio_string(ratio))
 
     # make sure the list is not empty
     assert slices_size
     return slices_size
 
 
+# helper function to open the incoming 'image' argument, which is either a path string or a PIL image.
+def _open_image(image):
+    """Opens a path string, bytes or a file object by PIL, or returns the PIL image as it is.
+
+    A file object which cannot seek, like stdin or a socket, is read into memory first, PIL has to seek.
+
+    Raises:
+        TypeError: If 'image' is not a string, bytes, a file object nor a PIL Image object.
+        IOError: If 'image' is a string, bytes or a file object, but PIL cannot open it.
+
+    """
+    if isinstance(image, str):
+        # the decoded image cache, if it's enabled and has it.
+        if _IMAGE_CACHE['enabled']:
+            return _open_image_cached(image)
+        # The input is a string, so it should be a path, check if it's a path, then open it.
+        try:
+            img = Image.open(image)
+        except IOError:
+            raise IOError('PIL open file error, please check if the image path provided is a valid image file.')
+        # too big for the memory, decode it into a memory-mapped file, see enable_out_of_core().
+        if _exceeds_memory_ceiling(img):
+            return _map_image(img, _band_bytes(), _OUT_OF_CORE['temp_dir'])
+        return img
+    if isinstance(image, (Image.Image, MappedImage)):
+        # incoming object is a PIL image, or a image opened out-of-core, do nothing.
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = io.BytesIO(image)
+    if hasattr(image, 'read'):
+        # a file object, read it into memory if it cannot seek, like a pipe.
+        if not (hasattr(image, 'seekable') and image.seekable()):
+            image = io.BytesIO(image.read())
+        try:
+            img = Image.open(image)
+        except IOError:
+            raise IOError('PIL open error, please check if the data provided is a valid image.')
+        if _exceeds_memory_ceiling(img):
+            return _map_image(img, _band_bytes(), _OUT_OF_CORE['temp_dir'])
+        return img
+    raise TypeError("Incoming argument 'image' is not a string, bytes, a file object or a PIL Image, "
+                    "please check the function arguments.")
+
+
+# the decoded image cache, shared by all the functions which accept a path, see enable_image_cache().
+_IMAGE_CACHE = {
+    'enabled': False,
+    'max_bytes': 0,
+    'bytes': 0,
+    # key -> (image, bytes), in the least recently used first order.
+    'entries': collections.OrderedDict(),
+    'hits': 0,
+    'misses': 0,
+    'evictions': 0,
+    'lock': threading.Lock(),
+}
+
+# the bytes PIL uses to store a pixel of a mode, 4 for the modes not listed (RGB is stored in 4 bytes too).
+_MODE_BYTES_PER_PIXEL = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'I;16L': 2, 'I;16B': 2, 'I;16N': 2}
+
+
+# helper function to tell how much memory a decoded image of a mode and a size takes.
+def _image_memory_bytes(mode, size):
+    """Returns the bytes of the pixel data of a decoded PIL image of 'mode' and 'size' (width, height)."""
+    return size[0] * size[1] * _MODE_BYTES_PER_PIXEL.get(mode, 4)
+
+
+# helper function to open a path by the decoded image cache.
+def _open_image_cached(path):
+    """Returns the decoded image of 'path' from the cache, or opens, decodes and caches it."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise IOError('PIL open file error, please check if the image path provided is a valid image file.')
+    # a file changed since it's cached has another key, the old one is evicted by the LRU in time.
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    cache = _IMAGE_CACHE
+    with cache['lock']:
+        entry = cache['entries'].get(key)
+        if entry:
+            cache['entries'].move_to_end(key)
+            cache['hits'] += 1
+            return entry[0]
+        cache['misses'] += 1
+    try:
+        img = Image.open(path)
+        # too big for the memory, it's not cached either, see enable_out_of_core().
+        if _exceeds_memory_ceiling(img):
+            return _map_image(img, _band_bytes(), _OUT_OF_CORE['temp_dir'])
+        img.load()
+    except IOError:
+        raise IOError('PIL open file error, please check if the image path provided is a valid image file.')
+    image_bytes = _image_memory_bytes(img.mode, img.size)
+    with cache['lock']:
+        # a image bigger than the whole budget is not cached, it would evict everything for nothing.
+        if image_bytes <= cache['max_bytes'] and key not in cache['entries']:
+            cache['entries'][key] = (img, image_bytes)
+            cache['bytes'] += image_bytes
+            while cache['bytes'] > cache['max_bytes']:
+                _, (_, evicted_bytes) = cache['entries'].popitem(last=False)
+                cache['bytes'] -= evicted_bytes
+                cache['evictions'] += 1
+    return img
+
+
+# helper function to map a offset planned on the full size to a reduced image.
+def _scale_offset(offset, plan_length, image_length):
+    """Maps a offset (in px) on a length of 'plan_length' to the same position on a length of 'image_length'."""
+    if plan_length == image_length:
+        return offset
+    # rounded integer division, so the slices always meet each other without gap or overlap.
+    return (offset * image_length + plan_length // 2) // plan_length
+
+
+# Public API: Compiled slice specs
+
+# A compiled slice spec of one direction, the method and the param are parsed and validated once by
+# compile_slice_spec(), so they are not parsed again for every image, or every strip of a grid.
+#   method: 'equal', 'step' or 'ratio'.
+#   count: the number of slices for 'equal', otherwise 0.
+#   step: the size of each slice in pixels for 'step', otherwise 0.
+#   ratio: a tuple of the ratio numbers for 'ratio', like (3, 2, 1), otherwise a empty tuple.
+SliceSpec = collections.namedtuple('SliceSpec', ['method', 'count', 'step', 'ratio'])
+
+
+def compile_slice_spec(method, param):
+    """Compiles a slice method and it's param to a SliceSpec, it's validated once here.
+
+    For example:
+        compile_slice_spec('equal', 3)  returns SliceSpec('equal', 3, 0, ())
+        compile_slice_spec('ratio', '3:2:1')  returns SliceSpec('ratio', 0, 0, (3, 2, 1))
+
+    A SliceSpec is immutable and hashable, the same method and param always compile to the same SliceSpec,
+    so the offsets planned from it can be cached, see _plan_offsets().
+
+    Args:
+        method:
+            a string, 'equal', 'step' or 'ratio'.
+        param:
+            a int for 'equal' (the number of slices) and 'step' (the size of each slice in pixels),
+            a ratio string like '3:2:1' for 'ratio'.
+
+    Returns:
+        A SliceSpec.
+
+    Raises:
+        TypeError:
+            If 'param' is not the required type of the method.
+        ValueError:
+            If 'method' is unknown, or 'param' is not valid: not greater than 0, or a invalid ratio string.
+
+    """
+    if method in ['equal', 'step']:
+        # bool is a int too, but a True is not a slice count.
+        if not isinstance(param, int) or isinstance(param, bool):
+            raise TypeError("When the slice method is '" + method + "', the param should be a int.")
+        if not param > 0:
+            raise ValueError("When the slice method is '" + method + "', the param should be greater than 0.")
+        if method == 'equal':
+            return SliceSpec('equal', param, 0, ())
+        return SliceSpec('step', 0, param, ())
+    elif method == 'ratio':
+        if not isinstance(param, str):
+            raise TypeError("When the slice method is 'ratio', the param should be a ratio string, like '3:2:1'.")
+        return SliceSpec('ratio', 0, 0, _parse_ratio_string(param))
+    else:
+        raise ValueError("The slice method should either be one of the 3 values: equal, step, ratio .")
+
+
+# helper function to parse a ratio string, like '3:2:1', it's cached, the same ratio string is parsed only once.
+@functools.lru_cache(maxsize=256)
+def _parse_ratio_string(ratio_string):
+    """Parses a ratio string like '3:2:1' to a tuple of int like (3, 2, 1), raises a ValueError if it's not valid."""
+    ratio_list = ratio_string.split(':')
+    # We do not assert, but try and raise a exception,
+    # because exception can provide more error message than a assertion, here is input check, not a assert.
+    # the list elements should not be empty, so we can exclude the cases like: '1:3:' which will be '1','3',''
+    if not all(ratio_list):
+        raise ValueError("Ratio string '" + ratio_string + "' is not a valid ratio, check if it's a typo."
+                         + "The ratio numbers should be separated by only one ':' in between, not multiple. "
+                         + "Also check if there are any leading or following ':' in your ratio string. "
+                         + "It should be something like '3:2:1', not something strange.")
+    # nor the ratio elements be a non-integer.
+    ratio_error_non_int = [s for s in ratio_list if not s.isdigit()]
+    if ratio_error_non_int:
+        raise ValueError("Ratio string '" + ratio_string + "' is not a valid ratio, '"
+                         + str(ratio_error_non_int) +
+                         "' is not a number, a ratio should consist of pure numbers.")
+    # nor the ratio elements be a ZERO or negative.
+    if [s for s in ratio_list if int(s) <= 0]:
+        raise ValueError("Ratio string '" + ratio_string +
+                         "' has at least one '0' as a ratio number, "
+                         "a valid ratio should not contain any 0 or negative, because it's meaningless. "
+                         "Check if it's a typo.")
+    return tuple(int(s) for s in ratio_list)
+
+
+@functools.lru_cache(maxsize=256)
+def parse_grid_string(grid_string):
+    """Parses a grid string like '3x2' or '3*2' to (horizontal_count, vertical_count), like (3, 2).
+
+    Raises:
+        ValueError: If the grid string is not 2 numbers greater than 0 separated by 'x' or '*'.
+
+    """
+    # a valid grid string should be either 3x2 or 3*2, use x or * for separator.
+    if 'x' in grid_string:
+        grid_values = grid_string.split('x')
+    elif '*' in grid_string:
+        grid_values = grid_string.split('*')
+    else:
+        raise ValueError('Grid String invalid. '
+                         'A valid grid string should be either "3x2" or "3*2", use "x" or "*" for separator.')
+    # there should not be any empty element, nor a 0,
+    # this check eliminates the case of multiple 'x' or leading or trailing 'x'.
+    # The length of the list should be 2.
+    if len(grid_values) != 2 or not all(s.isdigit() and int(s) != 0 for s in grid_values):
+        raise ValueError('Grid String invalid. A valid grid string should be 2 numbers separated by '
+                         'either "x" or "*" as separator, like "3x2" or "3*2", check if it\'s a typo.')
+    return int(grid_values[0]), int(grid_values[1])
+
+
+# helper function to distribute a length to the parts of a ratio, the remainder is distributed to the leading parts.
+def _distribute_by_ratio(length, ratio_list):
+    """Returns a list of int, the sizes of the parts when 'length' is sliced to the ratio in 'ratio_list'."""
+    # how many parts in this ratio expression
+    parts_count = len(ratio_list)
+    # sum all the ratio numbers, calculate the base size
+    base_size = int(length // sum(ratio_list))
+    remainder = length - base_size * sum(ratio_list)
+
+    # distribute the remainder to all the parts.
+    remainder_each = int(remainder // parts_count)
+    remainder_of_remainder = remainder - remainder_each * parts_count
+
+    # final distribute
+    sizes = []
+    for ratio_number in ratio_list:
+        each_ratio_size = ratio_number * base_size + remainder_each
+        if remainder_of_remainder > 0:
+            each_ratio_size += 1
+            remainder_of_remainder -= 1
+        sizes.append(each_ratio_size)
+    return sizes
+
+
+# helper function to plan the offsets of the slices of a compiled spec, it's cached for the same length and spec,
+# so a batch of same size images plans them only once.
+@functools.lru_cache(maxsize=1024)
+def _plan_offsets(length, spec, direction):
+    """Returns a tuple of the offsets of the slice edges, from 0 to 'length', like (0, 167, 334, 500).
+
+    Args:
+        length: the width (horizontal) or the height (vertical) the slices are planned on, a positive int.
+        spec: a SliceSpec.
+        direction: 'horizontal' or 'vertical', for the error message.
+
+    Raises:
+        ValueError: In equal slice, if the number of slices is greater than 'length',
+            in ratio slice, if some slices would be 0px.
+
+    """
+    if spec.method == 'equal':
+        # the expected number of slices should not be greater than the image width/height (in pixels)
+        if spec.count > length:
+            raise ValueError('In equal slice, the expected number of ' + direction + ' slices is greater than image '
+                             + ('height' if direction == 'vertical' else 'width') +
+                             '(in pixels), it\'s impossible to slice like this, check your input.')
+        sizes = _calculate_slices_size(length, slice_count=spec.count, step_size=0, ratio='')
+    elif spec.method == 'step':
+        sizes = _calculate_slices_size(length, slice_count=0, step_size=spec.step, ratio='')
+    else:
+        sizes = _distribute_by_ratio(length, spec.ratio)
+        # a ratio of more parts than pixels plans some slices of 0px.
+        if not all(sizes):
+            raise ValueError('In ratio slice, the ratio ' + ':'.join(str(number) for number in spec.ratio)
+                             + ' slices the image ' + ('height' if direction == 'vertical' else 'width') + ' ('
+                             + str(length) + 'px) into some slices of 0px, it\'s impossible to slice like this, '
+                             'check your input.')
+    # make sure it's not empty.
+    assert sizes
+    offsets = [0]
+    for size in sizes:
+        offsets.append(offsets[-1] + size)
+    return tuple(offsets)
+
+
+# helper function to map the planned column and row offsets to the crop boxes of a grid on the image.
+def _grid_boxes(img_size, column_offsets, row_offsets, plan_width, plan_height, scale=1.0):
+    """Returns a list of rows, each row is a list of the crop boxes (left, upper, right, bottom) on the image.
+
+    The offsets are planned on 'plan_width' x 'plan_height', they are mapped to the (maybe reduced) image of
+    'img_size', it's the same if it's not reduced.
+
+    Raises:
+        ValueError: If the image is reduced so much that some slices would be less than 1px.
+
+    """
+    img_width, img_height = img_size
+    lefts = [_scale_offset(offset, plan_width, img_width) for offset in column_offsets]
+    uppers = [_scale_offset(offset, plan_height, img_height) for offset in row_offsets]
+    if any(right <= left for left, right in zip(lefts, lefts[1:])):
+        raise ValueError('Scale ' + str(scale) + ' is too small, some slices would be less than 1px wide.')
+    if any(bottom <= upper for upper, bottom in zip(uppers, uppers[1:])):
+        raise ValueError('Scale ' + str(scale) + ' is too small, some slices would be less than 1px high.')
+    return [[(left, upper, right, bottom) for left, right in zip(lefts, lefts[1:])]
+            for upper, bottom in zip(uppers, uppers[1:])]
+
+
+# helper function to crop a grid of slices from a image, by the planned column and row offsets.
+def _crop_grid(img, column_offsets, row_offsets, plan_width, plan_height, scale=1.0, workers=None, crop_method=None):
+    """Crops the slices between the planned offsets, returns a list of rows, each row is a list of PIL Image.
+
+    With more than 1 'workers', the grid is cropped by threads, see _crop_boxes_threaded().
+    'workers' and 'crop_method' of None are the ones of the tuning profile, see tune(), 1 and 'pillow' without one.
+
+    """
+    if workers is None:
+        workers = _tuned('crop_workers', 1)
+    if crop_method is None:
+        crop_method = _tuned('crop_method', 'pillow')
+    box_rows = _grid_boxes(img.size, column_offsets, row_offsets, plan_width, plan_height, scale)
+    if workers == 1 and crop_method == 'pillow':
+        grid_slices = [[img.crop(box) for box in row] for row in box_rows]
+    else:
+        tiles = iter(_crop_boxes_threaded(img, [box for row in box_rows for box in row], workers, crop_method))
+        grid_slices = [[next(tiles) for _ in row] for row in box_rows]
+    # every slice knows where it's from, it's box on the full size image, see slice_box().
+    for plan_row, row in zip(_grid_boxes((plan_width, plan_height), column_offsets, row_offsets, plan_width,
+                                         plan_height), grid_slices):
+        for plan_box, image_slice in zip(plan_row, row):
+            image_slice.info['slice_box'] = plan_box
+    return grid_slices
+
+
+def slice_box(image_slice):
+    """Returns the box (left, upper, right, bottom) a slice covers on the full size source image, or None.
+
+    Every slice the slice functions return remembers it (in it's 'info'), for a scaled preview it's still the box
+    on the full size image, so a slice can be mapped back to it's source, see TileManifest.
+
+    """
+    return image_slice.info.get('slice_box')
+
+
+# The modes a NumPy array of a image keeps, so the tiles are the same as PIL's crop.
+_NUMPY_CROP_MODES = ('L', 'LA', 'RGB', 'RGBA', 'CMYK', 'I', 'F', 'I;16')
+
+
+# helper function to crop boxes of a image on threads, each thread crops a band of the boxes.
+def _crop_boxes_threaded(img, boxes, workers=0, crop_method='pillow'):
+    """Crops 'boxes' (in the row-major order) of 'img' on 'workers' threads, returns the tiles in the same order.
+
+    The boxes are split into 'workers' continuous bands, a band of rows of a grid, each thread crops it's own.
+    The image is decoded once before, so the threads only copy the pixels, in C, which does not hold the GIL:
+    PIL's crop, or with 'numpy' as 'crop_method', a slice of a NumPy array of the image copied to a new image.
+
+    """
+    import concurrent.futures
+
+    if crop_method not in ['pillow', 'numpy']:
+        raise ValueError("'crop_method' should either be 'pillow' or 'numpy'.")
+    workers = min(workers or os.cpu_count() or 1, len(boxes)) or 1
+    # decode it once, here, not by the first of the threads which crops it.
+    img.load()
+    crop = img.crop
+    if crop_method == 'numpy' and isinstance(img, Image.Image) and img.mode in _NUMPY_CROP_MODES:
+        numpy = _import_numpy('the numpy crop method')
+        pixels = numpy.asarray(img)
+        mode = img.mode
+        info = img.info
+
+        def crop(box):
+            tile = Image.fromarray(numpy.ascontiguousarray(pixels[box[1]:box[3], box[0]:box[2]]), mode)
+            tile.info = dict(info)
+            return tile
+
+    if workers == 1:
+        return [crop(box) for box in boxes]
+    bands = [boxes[len(boxes) * index // workers:len(boxes) * (index + 1) // workers] for index in range(workers)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return [tile for band in executor.map(lambda band: [crop(box) for box in band], bands) for tile in band]
+
+
+# helper function to import NumPy, a optional dependency, only the features which need it import it.
+def _import_numpy(feature):
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('NumPy is needed for ' + feature + ', install it by \'pip install numpy\'.')
+    return numpy
+
+
 def _slice_image_one_direction(
         image,
         slice_vertical_yn=False,
@@ -125,7 +510,10 @@ def _slice_image_one_direction(
         step_vertical=0,
         ratio_slice_yn=False,
         ratio_horizontal='',
-        ratio_vertical=''):
+        ratio_vertical='',
+        scale=1.0,
+        trim=False,
+        trim_tolerance=0):
     """The main function to do the slice
 
     This function should not be called directly, use proxy API functions instead, unless you have a reason to.
@@ -147,6 +535,11 @@ def _slice_image_one_direction(
             tells the program to what ratio the slices should be, horizontally.
         ratio_vertical: A ratio string, multiple numbers separated by ':' , like this: 3:2:1.
             tells the program to what ratio the slices should be, vertically.
+        scale: A number in (0, 1], the image is reduced to this scale once before it's sliced, see reduce_image().
+            The slices are planned on the full size image, then scaled to match, so a 100px step at scale 0.25
+            produces the same slices as full size, just 25px each.
+        trim: True to slice only the content inside the empty borders of the image, see content_box().
+        trim_tolerance: how much a border pixel may differ from the background, see content_box().
 
     Returns:
         A list of PIL Image objects.
@@ -234,151 +627,44 @@ def _slice_image_one_direction(
         assert ratio_horizontal or ratio_vertical
         # they cannot both be True.
         assert not (ratio_vertical and ratio_horizontal)
-        # if it's horizontal, check if the ratio string is a proper ratio string.
-        if ratio_horizontal:
-            temp_ratio_list = ratio_horizontal.split(':')
-            print(temp_ratio_list)
-            # We do not assert, but try and raise a exception,
-            # because exception can provide more error message than a assertion, here is input check, not a assert.
-            # the list elements should not be empty, so we can exclude the cases like: '1:3:' which will be '1','3',''
-            if not all(temp_ratio_list):
-                raise ValueError("Ratio string '" + ratio_horizontal + "' is not a valid ratio, check if it's a typo."
-                                 + "The ratio numbers should be separated by only one ':' in between, not multiple. "
-                                 + "Also check if there are any leading or following ':' in your ratio string. "
-                                 + "It should be something like '3:2:1', not something strange.")
-            # nor the ratio elements be a non-integer.
-            temp_ratio_error_non_int = [s for s in temp_ratio_list if not s.isdigit()]
-            if temp_ratio_error_non_int:
-                raise ValueError("Ratio string '" + ratio_horizontal + "' is not a valid ratio, '"
-                                 + str(temp_ratio_error_non_int) +
-                                 "' is not a number, a ratio should consist of pure numbers.")
-            # nor the ratio elements be a ZERO or negative.
-            temp_ratio_error_zero = [int(s) for s in temp_ratio_list if int(s) <= 0]
-            if temp_ratio_error_zero:
-                raise ValueError("Ratio string '" + ratio_horizontal +
-                                 "' has at least one '0' as a ratio number, "
-                                 "a valid ratio should not contain any 0 or negative because it's meaningless. "
-                                 "Check if it's a typo.")
-        # if it's vertical, check the vertical ratio string, make sure it's a valid ratio.
-        elif ratio_vertical:
-            temp_ratio_list = ratio_vertical.split(':')
-            # We do not assert, but try and raise a exception,
-            # because exception can provide more error message than a assertion, here is input check, not a assert.
-            # the list elements should not be empty, so we can exclude the cases like: '1:3:' which will be '1','3',''
-            if not all(temp_ratio_list):
-                raise ValueError("Ratio string '" + ratio_vertical + "' is not a valid ratio, check if it's a typo."
-                                 + "The ratio numbers should be separated by only one ':' in between, not multiple. "
-                                 + "Also check if there are any leading or following ':' in your ratio string. "
-                                 + "It should be something like '3:2:1', not something strange.")
-            # nor the ratio elements be a non-integer.
-            temp_ratio_error_non_int = [s for s in temp_ratio_list if not s.isdigit()]
-            if temp_ratio_error_non_int:
-                raise ValueError("Ratio string '" + ratio_vertical + "' is not a valid ratio, '"
-                                 + str(temp_ratio_error_non_int) +
-                                 "' is not a number, a ratio should consist of pure numbers.")
-            # nor the ratio elements be a ZERO or negative.
-            temp_ratio_error_zero = [int(s) for s in temp_ratio_list if int(s) <= 0]
-            if temp_ratio_error_zero:
-                raise ValueError("Ratio string '" + ratio_vertical +
-                                 "' has at least one '0' as a ratio number, "
-                                 "a valid ratio should not contain any 0 or negative, because it's meaningless. "
-                                 "Check if it's a typo.")
-        else:
-            # This should never be reached.
-            raise ValueError("Neither ratio_vertical nor ratio_horizontal is provided, "
-                             "previous assertion fails, it's impossible, check the code.")
+
+    # Compile the method and the param of the direction to a spec, a ratio string is parsed and validated here, once.
+    # A invalid ratio string raises a ValueError, see compile_slice_spec().
+    if equal_slice_yn:
+        spec = compile_slice_spec('equal', slice_count_vertical if slice_vertical_yn else slice_count_horizontal)
+    elif step_slice_yn:
+        spec = compile_slice_spec('step', step_vertical if slice_vertical_yn else step_horizontal)
+    else:
+        spec = compile_slice_spec('ratio', ratio_vertical if slice_vertical_yn else ratio_horizontal)
 
     # prepare the image object. #
 
     # Check if image is a Image or a string, if string, try to open it, if image, do nothing.
-    if isinstance(image, str):
-        # The input is a string, so it should be a path, check if it's a path, then open it.
-        try:
-            img = Image.open(image)
-        except IOError:
-            raise IOError('PIL open file error, please check if the image path provided is a valid image file.')
-    else:
-        if isinstance(image, Image.Image):
-            # incoming object is a PIL image, do nothing.
-            img = image
-        else:
-            raise TypeError(
-                "Incoming argument 'image' is not a string or a PIL Image, please check the function arguments.")
+    img = _open_image(image)
 
     # assert internal variable img is a instance of PIL Image.
-    assert isinstance(img, Image.Image)
+    assert isinstance(img, (Image.Image, MappedImage))
 
-    # Get the metadata of the image, the height, the width.
-    img_width, img_height = img.size
+    # Scaled slice, the slices are planned on the full size, so remember it before the image is reduced.
+    # The width/height the slices are planned on, the same with the image unless it's reduced.
+    plan_width, plan_height = img.size
 
-    # Slice the image
+    # Reduced first, a JPEG is decoded in a reduced size, then a trimmed one's content box is found on it,
+    # and mapped to the full size, see _plan_content_offsets().
+    reduced = _reduce_image(img, scale, img is not image)
+    column_offsets, row_offsets = _plan_content_offsets(img, None if slice_vertical_yn else spec,
+                                                        spec if slice_vertical_yn else None, trim, trim_tolerance,
+                                                        (plan_width, plan_height))
+    img = reduced
 
-    output_slices = []
-
-    # vertical case
+    # Slice the image, the offsets of the slices are planned on the full size, then the slices are cropped.
     if slice_vertical_yn:
-        # now it's vertical slice
-        # calculate the sizes of each slice.
-        # see if it's equal slice or step slice.
-        if equal_slice_yn:
-            # the expected number of slices should not be greater than the image width/height (in pixels)
-            if slice_count_vertical > img_height:
-                raise ValueError('In equal slice, the expected number of vertical slices is greater than image height'
-                                 '(in pixels), it\'s impossible to slice like this, check your input.')
-            slices_heights = _calculate_slices_size(img_height, slice_count=slice_count_vertical, step_size=0, ratio='')
-        elif step_slice_yn:
-            slices_heights = _calculate_slices_size(img_height, slice_count=0, step_size=step_vertical, ratio='')
-        elif ratio_slice_yn:
-            slices_heights = _calculate_slices_size(img_height, slice_count=0, step_size=0, ratio=ratio_vertical)
-        else:
-            # This exception should never be raised.
-            raise ValueError('slice mode error, not equal, not step, not ratio, things went very wrong, check it out.')
-        # make sure it's not empty.
-        assert slices_heights
-        # the bounding box variables for crop
-        upper = 0
-        left = 0
-        right = img_width
-        bottom = 0
-        for slice_height in slices_heights:
-            bottom += slice_height
-            bbox = (left, upper, right, bottom)
-            image_slice = img.crop(bbox)
-            output_slices.append(image_slice)
-            upper += slice_height
-
-    # horizontal case
+        output_slices = [row[0] for row in _crop_grid(img, column_offsets, row_offsets, plan_width, plan_height,
+                                                      scale)]
     else:
-        # now it's horizontal slice
         # make sure it's horizontal slice.
         assert slice_horizontal_yn
-        # see if it's equal slice or step slice
-        if equal_slice_yn:
-            # the expected number of slices should not be greater than the image width/height (in pixels)
-            if slice_count_horizontal > img_width:
-                raise ValueError('In equal slice, the expected number of horizontal slices is greater than image width'
-                                 '(in pixels), it\'s impossible to slice like this, check your input.')
-            slices_widths = _calculate_slices_size(img_width, slice_count=slice_count_horizontal, step_size=0, ratio='')
-        elif step_slice_yn:
-            slices_widths = _calculate_slices_size(img_width, slice_count=0, step_size=step_horizontal, ratio='')
-        elif ratio_slice_yn:
-            slices_widths = _calculate_slices_size(img_width, slice_count=0, step_size=0, ratio=ratio_horizontal)
-        else:
-            # This exception should never be raised.
-            raise ValueError('slice mode error, not equal, not step, not ratio, things went very wrong, check it out.')
-        # make sure it's not empty
-        assert slices_widths
-        # the bounding box variables for crop
-        upper = 0
-        left = 0
-        right = 0
-        bottom = img_height
-        for slice_width in slices_widths:
-            right += slice_width
-            bbox = (left, upper, right, bottom)
-            image_slice = img.crop(bbox)
-            output_slices.append(image_slice)
-            left += slice_width
+        output_slices = _crop_grid(img, column_offsets, row_offsets, plan_width, plan_height, scale)[0]
 
     # return the result list.
     # make sure it's not empty.
@@ -393,7 +679,7 @@ def _slice_image_one_direction(
 
 # Public API: Proxy functions to make it easier to use, add more error proof.
 
-def slice_horizontal_in_equal(image, horizontal_count):
+def slice_horizontal_in_equal(image, horizontal_count, scale=1.0):
     """Slices a image horizontally into equal parts.
 
     Slice a given image provided in the 'image' parameter, into 'horizontal_count' equal parts, horizontally.
@@ -412,6 +698,9 @@ def slice_horizontal_in_equal(image, horizontal_count):
             a string to the image path, or a PIL Image object.
         horizontal_count:
             a int, how many slices you want to produce.
+        scale:
+            optional, a number in (0, 1], slice a reduced preview of the image at this scale, see reduce_image().
+            The slices are planned on the full size image, so they cover the same areas, only smaller.
 
     Returns:
         A List of PIL image objects:
@@ -429,10 +718,10 @@ def slice_horizontal_in_equal(image, horizontal_count):
     """
     # slice horizontal
     return _slice_image_one_direction(image, slice_horizontal_yn=True, equal_slice_yn=True,
-                                      slice_count_horizontal=horizontal_count)
+                                      slice_count_horizontal=horizontal_count, scale=scale)
 
 
-def slice_vertical_in_equal(image, vertical_count):
+def slice_vertical_in_equal(image, vertical_count, scale=1.0):
     """Slices a image horizontally into equal parts.
 
     Slice a given image provided in the 'image' parameter, into 'vertical_count' equal parts, vertically.
@@ -451,6 +740,9 @@ def slice_vertical_in_equal(image, vertical_count):
             a string to the image path, or a PIL Image object.
         vertical_count:
             a int, how many slices you want to produce.
+        scale:
+            optional, a number in (0, 1], slice a reduced preview of the image at this scale, see reduce_image().
+            The slices are planned on the full size image, so they cover the same areas, only smaller.
 
     Returns:
         A List of PIL image objects:
@@ -468,10 +760,10 @@ def slice_vertical_in_equal(image, vertical_count):
     """
     # slice vertical
     return _slice_image_one_direction(image, slice_vertical_yn=True, equal_slice_yn=True,
-                                      slice_count_vertical=vertical_count)
+                                      slice_count_vertical=vertical_count, scale=scale)
 
 
-def slice_horizontal_by_step(image, step_horizontal):
+def slice_horizontal_by_step(image, step_horizontal, scale=1.0):
     """Slices a image horizontally every N pixels.
 
     Slice a given image provided by the 'image' parameter, every 'step_horizontal' px.
@@ -488,6 +780,9 @@ def slice_horizontal_by_step(image, step_horizontal):
             a string to the image path, or a PIL Image object.
         step_horizontal:
             a int, the exact number of pixels you want in each slices.
+        scale:
+            optional, a number in (0, 1], slice a reduced preview of the image at this scale, see reduce_image().
+            The slices are planned on the full size image, so they cover the same areas, only smaller.
 
     Returns:
         A List of PIL image objects:
@@ -503,10 +798,10 @@ def slice_horizontal_by_step(image, step_horizontal):
 
     """
     return _slice_image_one_direction(image, slice_horizontal_yn=True, step_slice_yn=True,
-                                      step_horizontal=step_horizontal)
+                                      step_horizontal=step_horizontal, scale=scale)
 
 
-def slice_vertical_by_step(image, step_vertical):
+def slice_vertical_by_step(image, step_vertical, scale=1.0):
     """Slices a image vertically every N pixels.
 
     Slice a given image provided by the 'image' parameter, every 'step_horizontal' px.
@@ -523,6 +818,9 @@ def slice_vertical_by_step(image, step_vertical):
             a string to the image path, or a PIL Image object.
         step_vertical:
             a int, the specific number of pixels you want each slice be.
+        scale:
+            optional, a number in (0, 1], slice a reduced preview of the image at this scale, see reduce_image().
+            The slices are planned on the full size image, so they cover the same areas, only smaller.
 
     Returns:
         A List of PIL image objects:
@@ -538,10 +836,10 @@ def slice_vertical_by_step(image, step_vertical):
 
     """
     return _slice_image_one_direction(image, slice_vertical_yn=True, step_slice_yn=True,
-                                      step_vertical=step_vertical)
+                                      step_vertical=step_vertical, scale=scale)
 
 
-def slice_horizontal_by_ratio(image, ratio_string):
+def slice_horizontal_by_ratio(image, ratio_string, scale=1.0):
     """Slices a image horizontally by a given ratio.
 
     Slice a given image provided by the 'image' parameter,
@@ -568,6 +866,9 @@ def slice_horizontal_by_ratio(image, ratio_string):
             a string to the image path, or a PIL Image object.
         ratio_string:
             a string, in a form of several positive integers separated by ':', like this 3:2:1
+        scale:
+            optional, a number in (0, 1], slice a reduced preview of the image at this scale, see reduce_image().
+            The slices are planned on the full size image, so they cover the same areas, only smaller.
 
     Returns:
         A List of PIL image objects:
@@ -582,13 +883,14 @@ def slice_horizontal_by_ratio(image, ratio_string):
         ValueError:
             If 'ratio_string' is not in the valid form. It should something be like this: 3:2:1
             No trailing or leading ':'s, no 0s, no negatives, no decimals.
+            If the ratio has more parts than the image has pixels, so some slices would be 0px.
 
     """
     return _slice_image_one_direction(image, slice_horizontal_yn=True, ratio_slice_yn=True,
-                                      ratio_horizontal=ratio_string)
+                                      ratio_horizontal=ratio_string, scale=scale)
 
 
-def slice_vertical_by_ratio(image, ratio_string):
+def slice_vertical_by_ratio(image, ratio_string, scale=1.0):
     """Slices a image vertically by a given ratio.
 
     Slice a given image provided by the 'image' parameter, to a given ratio provided in the 'ratio_string', vertically.
@@ -613,6 +915,9 @@ def slice_vertical_by_ratio(image, ratio_string):
             a string to the image path, or a PIL Image object.
         ratio_string:
             a string, in a form of several positive integers separated by ':', like this 3:2:1
+        scale:
+            optional, a number in (0, 1], slice a reduced preview of the image at this scale, see reduce_image().
+            The slices are planned on the full size image, so they cover the same areas, only smaller.
 
     Returns:
         A List of PIL image objects:
@@ -627,14 +932,42 @@ def slice_vertical_by_ratio(image, ratio_string):
         ValueError:
             If 'ratio_string' is not in the valid form. It should something be like this: 3:2:1
             No trailing or leading ':'s, no 0s, no negatives, no decimals.
+            If the ratio has more parts than the image has pixels, so some slices would be 0px.
 
     """
     return _slice_image_one_direction(image, slice_vertical_yn=True, ratio_slice_yn=True,
-                                      ratio_vertical=ratio_string)
+                                      ratio_vertical=ratio_string, scale=scale)
+
+
+# helper function to translate a grid direction's mode and param to the arguments of _slice_image_one_direction.
+def _one_direction_arguments(direction, mode, param):
+    """Returns the keyword arguments of _slice_image_one_direction for a direction, a mode and it's param.
+
+    For example: _one_direction_arguments('vertical', 'step', 100)
+        returns {'slice_vertical_yn': True, 'step_slice_yn': True, 'step_vertical': 100}
+
+    """
+    assert direction in ['horizontal', 'vertical']
+    arguments = {'slice_' + direction + '_yn': True}
+    if mode == 'equal':
+        arguments['equal_slice_yn'] = True
+        arguments['slice_count_' + direction] = param
+    elif mode == 'step':
+        arguments['step_slice_yn'] = True
+        arguments['step_' + direction] = param
+    elif mode == 'ratio':
+        arguments['ratio_slice_yn'] = True
+        arguments['ratio_' + direction] = param
+    else:
+        # this should never be reached.
+        raise ValueError(
+            direction + ' slice mode in grid slice unknown, something went very wrong, check the code, fire a issue.')
+    return arguments
 
 
 # Grid slice is a little different, to make it simple, we slice twice, first horizontal, second vertical.
-def slice_to_grid(image, horizontal_mode, horizontal_param, vertical_mode, vertical_param):
+def slice_to_grid(image, horizontal_mode, horizontal_param, vertical_mode, vertical_param, scale=1.0, workers=None,
+                  crop_method=None, trim=False, trim_tolerance=0):
     """Slices a given image to a grid
 
     Slice a given image to a given grid. 'Grid' here means slice it both vertically and horizontally.
@@ -688,6 +1021,26 @@ def slice_to_grid(image, horizontal_mode, horizontal_param, vertical_mode, verti
                 it's the number of pixels you would like each of the slices to have.
             If 'vertical_mode' is 'ratio', it should be a string, which means 'vertical_ratio',
                 it's the ratio you want the image to be sliced to in vertical.
+        scale:
+            optional, a number in (0, 1], slice a reduced preview of the image at this scale, see reduce_image().
+            The image is reduced once, the grid is planned on the full size image and scaled to match,
+            so a thumbnail grid has the same rows and columns as the full size one.
+        workers:
+            optional, a int, crop the tiles on this many threads, each crops a band of rows of the grid.
+            The pixels are copied in C, without the GIL, so it scales with the CPU cores. 0 means the number of CPUs.
+            See benchmark_grid_threads() for how it scales on a machine.
+            If omitted, the number of the tuning profile of the machine, see tune(), or 1 without a profile.
+        crop_method:
+            optional, 'pillow' (PIL's crop) or 'numpy' (slices of a NumPy array of the image, NumPy is needed),
+            how the threads copy the tiles. If omitted, the one of the tuning profile, or 'pillow'.
+        trim:
+            optional, True to slice only the content inside the empty borders of the image, see content_box().
+            The grid is planned on the content box, the borders are not cropped, encoded nor written.
+            The boxes of the slices (see slice_box()) are still on the whole image.
+            With a 'scale', a JPEG file is still decoded in the reduced size, the content box is found on it,
+            accurate to a pixel of the reduced image.
+        trim_tolerance:
+            optional, a int, how much a border pixel may differ from the background, see content_box().
 
 
     Returns:
@@ -745,53 +1098,26 @@ def slice_to_grid(image, horizontal_mode, horizontal_param, vertical_mode, verti
         if not vertical_param > 0:
             raise ValueError('When \'vertical_mode\' is \'equal\' or \'step\','
                              ' the \'vertical_param\' should be greater than 0.')
-    else:
-        # ratio mode, the param should be a string. other cases is already excluded by previous assert statement
-        assert isinstance(vertical_param, str)
-    if horizontal_mode in ['equal', 'step']:
-        # equal mode, step mode, should be int
-        assert isinstance(horizontal_param, int)
-    else:
-        # ratio mode, should be string.
-        assert isinstance(horizontal_param, str)
-
-    # begin vertical slice
-    if vertical_mode == 'equal':
-        vertical_slices = slice_vertical_in_equal(image, vertical_param)
-    elif vertical_mode == 'step':
-        vertical_slices = slice_vertical_by_step(image, vertical_param)
-    elif vertical_mode == 'ratio':
-        vertical_slices = slice_vertical_by_ratio(image, vertical_param)
-    else:
-        # this should never be reached.
-        raise ValueError(
-            'vertical slice mode in grid slice unknown, something went very wrong, check the code, fire a issue.')
 
-    # make sure the output list is not empty
-    assert vertical_slices
+    # compile both directions once, the params are validated here, not again for every strip of the grid.
+    horizontal_spec = compile_slice_spec(horizontal_mode, horizontal_param)
+    vertical_spec = compile_slice_spec(vertical_mode, vertical_param)
+
+    # prepare the image object, open it once.
+    img = _open_image(image)
+    assert isinstance(img, (Image.Image, MappedImage))
+
+    # scaled grid, reduce the image once here, both directions are planned on the full size.
+    plan_width, plan_height = img.size
+    reduced = _reduce_image(img, scale, img is not image)
+
+    # plan the column and row offsets once, on the full size (content box), then crop every tile directly.
+    column_offsets, row_offsets = _plan_content_offsets(img, horizontal_spec, vertical_spec, trim, trim_tolerance,
+                                                        (plan_width, plan_height))
+    img = reduced
 
     # output grid slices, it's supposed to be a list of list
-    grid_slices = []
-
-    # begin vertical slices, for each image in horizontal slices, slice it vertically.
-    for vertical_slice in vertical_slices:
-        # it should be a PIL image
-        assert isinstance(vertical_slice, Image.Image)
-
-        if horizontal_mode == 'equal':
-            horizontal_sub_slices = slice_horizontal_in_equal(vertical_slice, horizontal_param)
-        elif horizontal_mode == 'step':
-            horizontal_sub_slices = slice_horizontal_by_step(vertical_slice, horizontal_param)
-        elif horizontal_mode == 'ratio':
-            horizontal_sub_slices = slice_horizontal_by_ratio(vertical_slice, horizontal_param)
-        else:
-            # this should never be reached.
-            raise ValueError(
-                'horizontal slice mode in grid slice unknown, something went very wrong, check the code, fire a issue.')
-        # make sure it's not empty
-        assert horizontal_sub_slices
-        # append it to the output list
-        grid_slices.append(horizontal_sub_slices)
+    grid_slices = _crop_grid(img, column_offsets, row_offsets, plan_width, plan_height, scale, workers, crop_method)
 
     # make sure it's not empty
     assert grid_slices
@@ -799,10 +1125,618 @@ def slice_to_grid(image, horizontal_mode, horizontal_param, vertical_mode, verti
     return grid_slices
 
 
+# Public API: Tile index
+
+class TileIndex(object):
+    """A index of a slice plan, it looks up the tiles covering a point or a region of the source in O(log n).
+
+    The tiles of a plan are the cells between the column offsets and the row offsets, so the tile of a point is
+    found by a binary search over the offsets of each direction, no tile is scanned.
+    The coordinates are on the full size source. The rows and columns are 0-based, the same as the indexes of
+    the output of slice_to_grid(), output[row][col]. A horizontal or vertical slice is a grid of 1 row or 1 column.
+    A trimmed plan covers only the content box of the source, 'box', a point in the borders is in no tile.
+
+    For example:
+        spec = {'mode': 'grid', 'horizontal_mode': 'step', 'horizontal_param': 256,
+                'vertical_mode': 'step', 'vertical_param': 256}
+        index = plan_tile_index('photo.jpg', spec)
+        row, col, x, y = index.locate(1000, 750)
+        region = index.extract_region(slice_by_spec('photo.jpg', spec), (900, 700, 1400, 1000))
+
+    """
+
+    def __init__(self, column_offsets, row_offsets):
+        """'column_offsets' and 'row_offsets' are the increasing offsets of the tile edges, from 0 to the size.
+
+        A trimmed plan starts from the left and the top of the content box instead of 0.
+
+        """
+        self.column_offsets = tuple(column_offsets)
+        self.row_offsets = tuple(row_offsets)
+        for offsets in (self.column_offsets, self.row_offsets):
+            if len(offsets) < 2 or offsets[0] < 0 or any(a >= b for a, b in zip(offsets, offsets[1:])):
+                raise ValueError('The offsets of a tile index should increase from 0 to the image size, '
+                                 'like (0, 256, 512, 600).')
+        self.size = (self.column_offsets[-1], self.row_offsets[-1])
+        # the box the tiles cover, the whole image unless it's trimmed.
+        self.box = (self.column_offsets[0], self.row_offsets[0]) + self.size
+        self.columns = len(self.column_offsets) - 1
+        self.rows = len(self.row_offsets) - 1
+
+    def __len__(self):
+        return self.rows * self.columns
+
+    def tile_box(self, row, col):
+        """Returns the box (left, upper, right, bottom) of the tile at 'row' and 'col' on the source."""
+        return (self.column_offsets[col], self.row_offsets[row],
+                self.column_offsets[col + 1], self.row_offsets[row + 1])
+
+    def locate(self, x, y):
+        """Returns (row, col, x in the tile, y in the tile) of the tile which covers the point (x, y).
+
+        Raises:
+            ValueError: If the point is outside the tiles, outside the source or in it's trimmed borders.
+
+        """
+        if not (self.box[0] <= x < self.box[2] and self.box[1] <= y < self.box[3]):
+            raise ValueError('Point (' + str(x) + ', ' + str(y) + ') is outside the tiles, in the box '
+                             + str(self.box) + '.')
+        col = bisect.bisect_right(self.column_offsets, x) - 1
+        row = bisect.bisect_right(self.row_offsets, y) - 1
+        return row, col, x - self.column_offsets[col], y - self.row_offsets[row]
+
+    def tiles_in_region(self, box):
+        """Returns the tiles covering the region 'box' (left, upper, right, bottom), in rows, from left to right.
+
+        Each is (row, col, box of the covered part in the tile, (x, y) of the covered part in the region).
+
+        Raises:
+            ValueError: If 'box' is empty or not inside the tiles.
+
+        """
+        left, upper, right, bottom = box
+        if not (self.box[0] <= left < right <= self.box[2] and self.box[1] <= upper < bottom <= self.box[3]):
+            raise ValueError('Region ' + str(tuple(box)) + ' is empty or not inside the tiles, in the box '
+                             + str(self.box) + '.')
+        first_col = bisect.bisect_right(self.column_offsets, left) - 1
+        last_col = bisect.bisect_right(self.column_offsets, right - 1) - 1
+        first_row = bisect.bisect_right(self.row_offsets, upper) - 1
+        last_row = bisect.bisect_right(self.row_offsets, bottom - 1) - 1
+        covering = []
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                tile_left, tile_upper, tile_right, tile_bottom = self.tile_box(row, col)
+                covered_left, covered_upper = max(left, tile_left), max(upper, tile_upper)
+                covered_right, covered_bottom = min(right, tile_right), min(bottom, tile_bottom)
+                covering.append((row, col, (covered_left - tile_left, covered_upper - tile_upper,
+                                            covered_right - tile_left, covered_bottom - tile_upper),
+                                 (covered_left - left, covered_upper - upper)))
+        return covering
+
+    def extract_region(self, tiles, box):
+        """Assembles the region 'box' (left, upper, right, bottom) of the source from the tiles covering it.
+
+        Args:
+            tiles:
+                The full size tiles of the plan, a output of the slice functions (a list of list, or a list),
+                or a function called with (row, col) which returns the PIL image of a tile, like a tile file opened
+                from the disk. Only the tiles covering the region are taken.
+            box:
+                The region, on the source.
+
+        Returns:
+            A PIL Image of the region, in the mode of the tiles.
+
+        Raises:
+            ValueError:
+                If 'box' is empty or not inside the tiles, or a tile is not in it's planned size,
+                like a tile of a scaled preview.
+
+        """
+        if callable(tiles):
+            get_tile = tiles
+        elif tiles and isinstance(tiles[0], list):
+            def get_tile(row, col):
+                return tiles[row][col]
+        else:
+            # a list of slices of one direction, a single column or a single row.
+            def get_tile(row, col):
+                return tiles[row] if self.columns == 1 else tiles[col]
+
+        region = None
+        for row, col, covered_box, position in self.tiles_in_region(box):
+            tile = get_tile(row, col)
+            tile_box = self.tile_box(row, col)
+            if tile.size != (tile_box[2] - tile_box[0], tile_box[3] - tile_box[1]):
+                raise ValueError('Tile (' + str(row) + ', ' + str(col) + ') is ' + str(tile.size) + ', not it\'s '
+                                 'planned size, a region is only assembled from full size tiles.')
+            if region is None:
+                region = Image.new(tile.mode, (box[2] - box[0], box[3] - box[1]))
+                if tile.mode == 'P':
+                    region.putpalette(tile.getpalette())
+            region.paste(tile.crop(covered_box), position)
+        return region
+
+
+# plan the tile index of a spec, the same plan as the slice functions, without cropping.
+def plan_tile_index(image, spec):
+    """Returns the TileIndex of the tiles 'spec' (see slice_by_spec()) slices 'image' into.
+
+    Only the size of the image is needed, a path string is opened, but not decoded.
+    The index is on the full size image, a 'scale' in the spec is ignored.
+    A trimmed spec (see slice_by_spec()) needs the pixels, the image is decoded to find it's content box.
+
+    Args:
+        image:
+            a string to the image path, a PIL Image object, or the size of the image (width, height),
+            not the size for a trimmed spec.
+        spec:
+            a dict, how the image is sliced, see slice_by_spec().
+
+    Returns:
+        A TileIndex.
+
+    Raises:
+        TypeError, ValueError, IOError:
+            The same as slice_by_spec().
+
+    """
+    horizontal_spec, vertical_spec = _compile_spec_dict(spec)
+    if spec.get('trim'):
+        if isinstance(image, tuple):
+            raise ValueError('A trimmed spec is planned on the content of the image, not on it\'s size.')
+        return TileIndex(*_plan_content_offsets(_open_image(image), horizontal_spec, vertical_spec, True,
+                                                spec.get('trim_tolerance', 0)))
+    if isinstance(image, tuple):
+        width, height = image
+    elif isinstance(image, str):
+        # the header only, the size, the pixels are not decoded.
+        try:
+            with Image.open(image) as header:
+                width, height = header.size
+        except IOError:
+            raise IOError('PIL open file error, please check if the image path provided is a valid image file.')
+    else:
+        width, height = _open_image(image).size
+    if spec.get('mode') == 'auto':
+        raise ValueError("A 'auto' spec is detected from the pixels, plan it by TileIndex(*detect_grid(image)).")
+    column_offsets = _plan_offsets(width, horizontal_spec, 'horizontal') if horizontal_spec else (0, width)
+    row_offsets = _plan_offsets(height, vertical_spec, 'vertical') if vertical_spec else (0, height)
+    return TileIndex(column_offsets, row_offsets)
+
+
+# Public API: Tile ordering
+
+# The orders the tiles can be saved in, besides a explicit list of (row, col), see order_tiles().
+TILE_ORDERS = ('row-major', 'spiral', 'hilbert')
+
+
+def order_tiles(boxes, order='row-major', viewport=None):
+    """Returns the indexes of the tiles of a plan in the order they should be produced, like a viewer needs them.
+
+    The row and the column of each tile are found from it's box, so it works for any plan, a grid, a horizontal or a
+    vertical slice, a trimmed or a detected grid. The rows and columns are 0-based, like TileIndex.
+
+    The orders:
+        'row-major': row by row, the order of the file names.
+        'spiral': from the tile at the center of 'viewport' (or of the image) outwards, ring by ring, clockwise
+            from the top, so the tiles around the viewport are first, whatever the size of the grid.
+        'hilbert': along a Hilbert curve, the tiles close to each other on the image are close in the order.
+        a list of (row, col) or of indexes of 'boxes' (like the number - 1 of a horizontal or vertical slice):
+            these tiles first, in this order, then the others row by row.
+
+    For example:
+        boxes = [slice_box(tile) for row in grid for tile in row]
+        for index in order_tiles(boxes, 'spiral', viewport=(2048, 1024, 3968, 2104)):
+            ...
+
+    Args:
+        boxes:
+            a list of the boxes (left, upper, right, bottom) of the tiles on the full size image, in the row-major
+            order, like slice_box() of each slice returns.
+        order:
+            Optional, one of TILE_ORDERS, or a list of (row, col) tuples or indexes. None is 'row-major'.
+        viewport:
+            Optional, a box (left, upper, right, bottom) on the full size image, the tiles it overlaps come first,
+            in the order, and a spiral starts from it's center.
+
+    Returns:
+        A list of the indexes of 'boxes', in the order.
+
+    Raises:
+        ValueError: If 'order' is not one of TILE_ORDERS, or a (row, col) in it is not a tile of the plan.
+
+    """
+    uppers = sorted(set(box[1] for box in boxes))
+    lefts = sorted(set(box[0] for box in boxes))
+    row_of = dict((upper, row) for row, upper in enumerate(uppers))
+    col_of = dict((left, col) for col, left in enumerate(lefts))
+    positions = [(row_of[box[1]], col_of[box[0]]) for box in boxes]
+
+    order = order or 'row-major'
+    if isinstance(order, str) and order not in TILE_ORDERS:
+        raise ValueError("'order' should be one of " + ', '.join(TILE_ORDERS) + ', or a list of (row, col).')
+    if order == 'row-major':
+        def order_key(index):
+            return positions[index]
+    elif order == 'spiral':
+        import math
+
+        if viewport:
+            center_x, center_y = (viewport[0] + viewport[2]) / 2.0, (viewport[1] + viewport[3]) / 2.0
+        else:
+            center_x = (min(box[0] for box in boxes) + max(box[2] for box in boxes)) / 2.0
+            center_y = (min(box[1] for box in boxes) + max(box[3] for box in boxes)) / 2.0
+        center_row = min(max(bisect.bisect_right(uppers, center_y) - 1, 0), len(uppers) - 1)
+        center_col = min(max(bisect.bisect_right(lefts, center_x) - 1, 0), len(lefts) - 1)
+
+        def order_key(index):
+            row_offset, col_offset = positions[index][0] - center_row, positions[index][1] - center_col
+            # the ring, then the angle clockwise from the top.
+            return (max(abs(row_offset), abs(col_offset)),
+                    math.atan2(col_offset, -row_offset) % (2 * math.pi))
+    elif order == 'hilbert':
+        side = 1
+        while side < max(len(uppers), len(lefts)):
+            side *= 2
+
+        def order_key(index):
+            return _hilbert_distance(side, positions[index][1], positions[index][0])
+    else:
+        index_of = dict((position, index) for index, position in enumerate(positions))
+        priorities = {}
+        for tile in order:
+            index = tile if isinstance(tile, int) else index_of.get(tuple(tile))
+            if index is None or not 0 <= index < len(boxes):
+                raise ValueError('The tile ' + str(tile) + ' of the order is not in the plan, it has '
+                                 + str(len(uppers)) + ' rows and ' + str(len(lefts)) + ' columns.')
+            priorities.setdefault(index, len(priorities))
+
+        def order_key(index):
+            # the listed tiles first, in the order of the list, then the others row by row.
+            return (0, priorities[index]) if index in priorities else (1,) + positions[index]
+
+    if viewport:
+        def in_viewport(box):
+            return box[0] < viewport[2] and box[2] > viewport[0] and box[1] < viewport[3] and box[3] > viewport[1]
+
+        return sorted(range(len(boxes)), key=lambda index: (not in_viewport(boxes[index]), order_key(index)))
+    return sorted(range(len(boxes)), key=order_key)
+
+
+# helper function to tell the distance along a Hilbert curve of a point on a square of 'side' (a power of 2).
+def _hilbert_distance(side, x, y):
+    distance = 0
+    step = side // 2
+    while step > 0:
+        rx = 1 if x & step else 0
+        ry = 1 if y & step else 0
+        distance += step * step * ((3 * rx) ^ ry)
+        # rotate the quadrant, so the curve in it starts where the last one ended.
+        if ry == 0:
+            if rx == 1:
+                x, y = side - 1 - x, side - 1 - y
+            x, y = y, x
+        step //= 2
+    return distance
+
+
+# helper function to parse a tile order string of the command-line.
+def parse_tile_order(order_string):
+    """Parses a tile order like 'spiral', or a list of tiles first like '3_4,3_5,2_4' (1-based, like the file names).
+
+    Returns:
+        One of TILE_ORDERS, or a list of 0-based (row, col) tuples and slice indexes, for order_tiles().
+
+    Raises:
+        ValueError: If it's not a order nor a list of tiles. A horizontal or vertical slice 'N' is a tile too.
+
+    """
+    order_string = order_string.strip().lower()
+    if order_string in TILE_ORDERS:
+        return order_string
+    order = []
+    for tile in order_string.split(','):
+        try:
+            numbers = [int(number) for number in tile.strip().split('_')]
+        except ValueError:
+            numbers = []
+        if len(numbers) not in (1, 2) or min(numbers) < 1:
+            raise ValueError('The tile order should be one of ' + ', '.join(TILE_ORDERS)
+                             + ", or a list of tiles like '3_4,3_5,2_4', the row and the column from 1, "
+                               'like the file names.')
+        order.append((numbers[0] - 1, numbers[1] - 1) if len(numbers) == 2 else numbers[0] - 1)
+    return order
+
+
+# helper function to parse the viewport box of the command-line.
+def _parse_viewport_string(viewport_string):
+    try:
+        viewport = tuple(int(number) for number in viewport_string.split(','))
+    except ValueError:
+        viewport = ()
+    if len(viewport) != 4 or viewport[0] >= viewport[2] or viewport[1] >= viewport[3]:
+        raise ValueError('The viewport should be a box of 4 numbers, LEFT,UPPER,RIGHT,BOTTOM, '
+                         'like 2048,1024,3968,2104.')
+    return viewport
+
+
+def iter_tiles(image, spec, order='row-major', viewport=None):
+    """Slices a image by a spec lazily, it yields the tiles one by one in a order, like the ones of a viewport first.
+
+    Only the plan is computed up front, each tile is cropped when it's yielded, so the time to the first tile does
+    not depend on the size of the grid. Every tile knows it's box on the full size image, see slice_box().
+
+    For example:
+        for row, col, tile in iter_tiles('map.png', {'mode': 'grid', 'grid': '64x64'}, 'spiral',
+                                         viewport=(2048, 1024, 3968, 2104)):
+            send(row, col, tile)
+
+    Args:
+        image:
+            a string to the image path, bytes, a file object or a PIL Image object.
+        spec:
+            a dict, how to slice the image, see slice_by_spec().
+        order, viewport:
+            Optional, the order of the tiles, see order_tiles().
+
+    Yields:
+        A tuple (row, col, PIL Image), the row and the column 0-based, like the output of slice_to_grid().
+
+    Raises:
+        TypeError, ValueError, IOError:
+            The same as slice_by_spec() and order_tiles().
+
+    """
+    img, tiles = _plan_spec_tiles(image, spec, '')
+    plan_boxes = [plan_box for _, _, plan_box in tiles]
+    columns = len(set(box[0] for box in plan_boxes))
+    for index in order_tiles(plan_boxes, order, viewport):
+        _, box, plan_box = tiles[index]
+        tile = img.crop(box)
+        tile.info['slice_box'] = plan_box
+        yield index // columns, index % columns, tile
+
+
+# Public API: Grid detection
+
+# the modes without colors, a line uniform in the grayscale of the other modes is checked in every band too.
+_GRAYSCALE_MODES = ('1', 'L', 'LA', 'La', 'I', 'F', 'I;16', 'I;16L', 'I;16B', 'I;16N')
+
+
+# detect the grid of a sprite sheet or a contact sheet, from it's separator lines.
+def detect_grid(image, tolerance=0, min_gap=1):
+    """Detects the grid of a sprite sheet or a contact sheet, by the separator rows and columns between the cells.
+
+    A separator line is a row or a column of a uniform color (within 'tolerance'), or a fully transparent one.
+    The lines are found in one vectorized pass over the min and the max of every row and every column
+    (of the grayscale, and the alpha), NumPy is needed. A line uniform in the grayscale is checked in every band
+    of a color image too, so 2 colors of the same brightness are not taken as uniform. It takes a few hundred
+    milliseconds for a 10000*10000px sheet.
+
+    The cuts are in the middle of each run of separator lines, so the slices cover the whole image without gaps,
+    like every other slice, each with a half of the gutters around it. The margins are not cut off.
+
+    Args:
+        image:
+            a string to the image path, bytes, a file object or a PIL Image object.
+        tolerance:
+            optional, a int, how much a band of a separator line may vary, for scanned or lossy compressed sheets.
+        min_gap:
+            optional, a int, the least separator lines in a row to be a gutter, thin lines inside a cell are not.
+
+    Returns:
+        A tuple of (column offsets, row offsets), each a tuple of offsets from 0 to the width/height,
+        like the offsets of a TileIndex. A image with no separator is 1 cell.
+
+    Raises:
+        ImportError:
+            If NumPy is not installed.
+        ValueError:
+            If 'tolerance' or 'min_gap' is not valid, or the image is opened out-of-core, see MappedImage.
+
+    """
+    numpy = _import_numpy('grid detection')
+    if not isinstance(tolerance, int) or tolerance < 0 or not isinstance(min_gap, int) or min_gap < 1:
+        raise ValueError("'tolerance' should be a int of 0 or more, 'min_gap' a int of 1 or more.")
+    img = _open_image(image)
+    if isinstance(img, MappedImage):
+        raise ValueError('Grid detection needs the image in memory, it cannot detect a image opened out-of-core.')
+    grayscale = numpy.asarray(img if img.mode == 'L' else img.convert('L'))
+    alpha = None
+    if img.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La'):
+        alpha = numpy.asarray(img.getchannel('A'))
+    elif 'transparency' in img.info:
+        alpha = numpy.asarray(img.convert('RGBA').getchannel('A'))
+
+    offsets = []
+    for axis in (0, 1):
+        # axis 0 reduces the columns, axis 1 the rows.
+        uniform = (grayscale.max(axis=axis).astype(numpy.int32) - grayscale.min(axis=axis)) <= tolerance
+        transparent = numpy.zeros(uniform.shape, dtype=bool)
+        if alpha is not None:
+            transparent = alpha.max(axis=axis) == 0
+            uniform &= (alpha.max(axis=axis).astype(numpy.int32) - alpha.min(axis=axis)) <= tolerance
+        if img.mode not in _GRAYSCALE_MODES:
+            for index in numpy.flatnonzero(uniform & ~transparent).tolist():
+                line = (index, 0, index + 1, img.height) if axis == 0 else (0, index, img.width, index + 1)
+                extrema = img.crop(line).getextrema()
+                if not isinstance(extrema[0], tuple):
+                    extrema = (extrema,)
+                uniform[index] = all(high - low <= tolerance for low, high in extrema)
+        offsets.append(_separator_cuts(numpy, uniform | transparent, min_gap))
+    return offsets[0], offsets[1]
+
+
+# helper function to find the cuts of the runs of separator lines, see detect_grid().
+def _separator_cuts(numpy, separators, min_gap):
+    """Returns the offsets of the cells, from 0 to the length, cut in the middle of the runs of separators inside."""
+    length = len(separators)
+    padded = numpy.concatenate(([False], separators, [False]))
+    edges = numpy.flatnonzero(padded[1:] != padded[:-1]).tolist()
+    cuts = [0]
+    for start, end in zip(edges[0::2], edges[1::2]):
+        # a run touching a edge is a margin, not a gutter between 2 cells.
+        if start > 0 and end < length and end - start >= min_gap:
+            cuts.append((start + end) // 2)
+    cuts.append(length)
+    return tuple(cuts)
+
+
+# slice a sprite sheet or a contact sheet along the detected grid.
+def slice_by_detected_grid(image, tolerance=0, min_gap=1, scale=1.0, workers=None):
+    """Slices a sprite sheet or a contact sheet along the grid detected by it's separator lines, see detect_grid().
+
+    Args:
+        image:
+            a string to the image path, bytes, a file object or a PIL Image object.
+        tolerance, min_gap:
+            optional, how the separator lines are detected, see detect_grid().
+        scale:
+            optional, a number in (0, 1], slice a reduced preview, the grid is detected on the full size image.
+        workers:
+            optional, a int, crop the slices on this many threads, see slice_to_grid().
+
+    Returns:
+        A List of List of PIL Image objects, a list for each row, like slice_to_grid().
+
+    Raises:
+        ImportError, ValueError:
+            The same as detect_grid().
+
+    """
+    img = _open_image(image)
+    column_offsets, row_offsets = detect_grid(img, tolerance, min_gap)
+    plan_width, plan_height = img.size
+    return _crop_grid(_reduce_image(img, scale, img is not image), column_offsets, row_offsets, plan_width, plan_height,
+                      scale, workers)
+
+
+# Public API: Trim empty borders
+
+# find the box of the content of a image, inside it's empty borders.
+def content_box(image, background=None, tolerance=0):
+    """Returns the box (left, upper, right, bottom) of the content of a image, inside it's empty borders.
+
+    The borders are the color of 'background', by default the color of the top left pixel, like the blank margins
+    of a scan, or fully transparent. The box is found in one pass by PIL's getbbox() on the difference of the image
+    from the background, in C. It's compared in small bands of rows, so the difference image is a few MB,
+    cache friendly, not a copy of the whole image, about half a second for a 10000*10000px RGB image.
+    A image opened out-of-core is scanned the same way, only a band is in the memory at a time.
+
+    Args:
+        image:
+            a string to the image path, bytes, a file object or a PIL Image object.
+        background:
+            optional, the color of the borders, in the mode of the image, like (255, 255, 255) for RGB,
+            a palette image is compared in RGBA.
+        tolerance:
+            optional, a int, how much a pixel may differ from the background in each band and still be a border,
+            for scanned or lossy compressed images.
+
+    Returns:
+        The box on the image, or None if the whole image is the background.
+
+    Raises:
+        ValueError:
+            If 'tolerance' is not a int of 0 or more.
+        ImportError:
+            If the image is a 32-bit integer or float one and NumPy is not installed.
+
+    """
+    if not isinstance(tolerance, int) or tolerance < 0:
+        raise ValueError("'tolerance' should be a int of 0 or more.")
+    img = _open_image(image)
+    img.load()
+    if background is None:
+        background = _comparable_image(img.crop((0, 0, 1, 1))).getpixel((0, 0))
+
+    band_height = max(1, _TRIM_BAND_BYTES // (img.width * _image_memory_bytes(img.mode, (1, 1))))
+    background_band = None
+    box = None
+    for upper in range(0, img.height, band_height):
+        band = _comparable_image(img.crop((0, upper, img.width, min(img.height, upper + band_height))))
+        if background_band is None or background_band.size != band.size:
+            background_band = Image.new(band.mode, band.size, background)
+        band_box = _band_content_box(band, background_band, tolerance)
+        if band_box is None:
+            continue
+        if box is None:
+            box = (band_box[0], upper + band_box[1], band_box[2], upper + band_box[3])
+        else:
+            box = (min(box[0], band_box[0]), box[1], max(box[2], band_box[2]), upper + band_box[3])
+    return box
+
+
+# the bytes of a band of rows content_box() compares at a time, small enough for the CPU caches.
+_TRIM_BAND_BYTES = 2 * 1024 * 1024
+
+
+# helper function to convert the modes PIL cannot tell the difference of, see content_box().
+def _comparable_image(img):
+    if img.mode in ('P', 'PA'):
+        return img.convert('RGBA')
+    if img.mode == '1':
+        return img.convert('L')
+    if img.mode.startswith('I;16'):
+        return img.convert('I')
+    return img
+
+
+# helper function to find the box of the content of a band of a image, see content_box().
+def _band_content_box(img, background_band, tolerance):
+    """Returns the box where 'img' differs from 'background_band' by more than 'tolerance' in any band, or None."""
+    if img.mode in ('I', 'F'):
+        # PIL's ImageChops takes 8-bit bands only.
+        numpy = _import_numpy('trimming a 32-bit image')
+        content = numpy.abs(numpy.asarray(img).astype(numpy.float64) - numpy.asarray(background_band)) > tolerance
+        columns = numpy.flatnonzero(content.any(axis=0))
+        rows = numpy.flatnonzero(content.any(axis=1))
+        if not len(columns):
+            return None
+        return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+    if img.mode in ('RGBA', 'LA') and background_band.getpixel((0, 0))[-1] == 0:
+        # transparent borders, whatever the color of the transparent pixels is.
+        difference = img.getchannel('A')
+    else:
+        difference = ImageChops.difference(img, background_band)
+        if len(difference.getbands()) > 1:
+            # the largest difference of the bands, so a difference in any band is content.
+            difference = functools.reduce(ImageChops.lighter, difference.split())
+    if tolerance:
+        difference = difference.point(lambda value: 255 if value > tolerance else 0)
+    return difference.getbbox()
+
+
+# helper function to plan the offsets of a grid on a image, inside it's content box if it's trimmed.
+def _plan_content_offsets(img, horizontal_spec, vertical_spec, trim=False, trim_tolerance=0, plan_size=None):
+    """Returns (column offsets, row offsets) on the full size 'img', None for a direction means 1 slice.
+
+    Trimmed, the slices are planned on the content box (see content_box()), the offsets are still on the image,
+    from the left and the top of the content box to it's right and bottom. A image with no content is not trimmed.
+
+    'plan_size' is the full size, if 'img' is a JPEG decoded in a reduced size by draft mode (see reduce_image()),
+    the content box is found on it, and mapped out to the full size, it's accurate to a pixel of the reduced image.
+
+    """
+    plan_width, plan_height = plan_size or img.size
+    box = content_box(img, tolerance=trim_tolerance) if trim else None
+    if box and img.size != (plan_width, plan_height):
+        # rounded outwards, the content is never cut.
+        box = (box[0] * plan_width // img.width, box[1] * plan_height // img.height,
+               -(-box[2] * plan_width // img.width), -(-box[3] * plan_height // img.height))
+    left, upper, right, bottom = box or (0, 0, plan_width, plan_height)
+    column_offsets = (_plan_offsets(right - left, horizontal_spec, 'horizontal') if horizontal_spec
+                      else (0, right - left))
+    row_offsets = _plan_offsets(bottom - upper, vertical_spec, 'vertical') if vertical_spec else (0, bottom - upper)
+    return tuple(left + offset for offset in column_offsets), tuple(upper + offset for offset in row_offsets)
+
+
 # Public API: Image slice file I/O helper functions
 
 # helper function to save a list of PIL image to disk. Save to cwd, it's a default behaviour by most programs.
-def save_image_list(in_list, out_dir, out_name, out_ext):
+def save_image_list(in_list, out_dir, out_name, out_ext, out_format=None, skip_names=None, on_saved=None,
+                    tile_manifest=None, metadata=None, incremental=None, order=None, viewport=None):
     """saves a list of PIL image to a directory
 
     A helper function to save a image list more easily.
@@ -812,36 +1746,103 @@ def save_image_list(in_list, out_dir, out_name, out_ext):
             A list of PIL Image objects.
         out_dir:
             A valid path string, to where the files would be written to.
+            Or a sink, like a archive or a object storage, see open_sink(). The caller flushes and closes it.
         out_name:
             A String, the file name prefix you would like to save.
             The output file names will be: out_name_1, out_name_2, ...
         out_ext:
             The file extension name, like jpg, png, ...
+        out_format:
+            Optional, the PIL format name to encode the images with, like 'JPEG', 'WEBP', ...
+            If omitted, the format is determined from 'out_ext' by PIL.
+            The images should already be in a mode this format can store, see convert_image_for_format().
+        skip_names:
+            Optional, a container (like a set) of file names, like 'my_slice_2.jpg', which are already saved,
+            they are skipped, not encoded nor written again. It's how a interrupted job resumes.
+        on_saved:
+            Optional, a function called with the file name (like 'my_slice_2.jpg') after each file is saved.
+        tile_manifest:
+            Optional, a TileManifest, each saved file is recorded in it, with it's box, size and checksum.
+        metadata:
+            Optional, the metadata of the source to give every file, like the ICC profile and the DPI,
+            serialized once by image_metadata(). What the output format cannot store is left out.
+        incremental:
+            Optional, a IncrementalState of 'out_dir', the images whose pixels are the same as the last run
+            are not encoded nor written again. Close it after saving, to remove the stale files.
+        order, viewport:
+            Optional, the order the images are saved in, like the ones around a viewport first, see order_tiles(),
+            with 'on_saved' called as each one is written. The images are ordered by their boxes (see slice_box()),
+            so they should be slices of the slice functions. The file names do not change.
 
     Returns:
         All the images in 'in_list' will be saved to 'out_dir', one by one.
         The file names will be 'out_name_1.out_ext', 'out_name_2.out_ext', ...
         for example: my_slice_1.jpg, my_slice_2.jpg, ...
 
+        Each file is written to a temporary file first, then renamed to it's name, so a file is either complete
+        or not there at all, even if the program is interrupted.
+
     Raises:
-        KeyError:
-            If the output format could not be determined from the file name. (from PIL)
+        ValueError:
+            If the output format could not be determined from the 'out_ext'.
             The 'out_ext' may be a invalid value, which cannot be recognized by PIL. Check PIL's document for detail.
         IOError:
-            If the file could not be written. The file may have been created, and may contain partial data. (from PIL)
-
-        All the exceptions above is raised from PIL's image.save() method. Check PIL's document for details.
+            If the file could not be written. (from PIL)
 
     """
+    # determine the format once, the temporary file name tells PIL nothing about it.
+    pil_format = out_format or get_pil_format_from_ext_name(out_ext)
+    save_params = _metadata_save_params(metadata, pil_format)
+    named_slices = []
     count = 1
     for working_slice in in_list:
         assert isinstance(working_slice, Image.Image)
-        working_slice.save(os.path.join(out_dir, out_name + "_" + str(count) + '.' + out_ext))
+        named_slices.append((out_name + "_" + str(count) + '.' + out_ext, working_slice))
         count += 1
+    _save_named_slices(_ordered_slices(named_slices, order, viewport), out_dir, pil_format, skip_names, on_saved,
+                       tile_manifest, save_params, incremental)
+
+
+# helper function to save a list of (file name, image), see save_image_list().
+def _save_named_slices(named_slices, out_dir, pil_format, skip_names, on_saved, tile_manifest, save_params,
+                       incremental):
+    for file_name, working_slice in named_slices:
+        if skip_names and file_name in skip_names:
+            continue
+        if incremental is not None and incremental.is_unchanged(file_name, working_slice, pil_format, save_params):
+            continue
+        _save_to_output(out_dir, file_name, working_slice, pil_format, on_saved, tile_manifest, save_params)
+
+
+# helper function to put a list of (file name, slice) in the row-major order into a tile order, see order_tiles().
+def _ordered_slices(named_slices, order, viewport):
+    if (not order or order == 'row-major') and not viewport:
+        return named_slices
+    boxes = [slice_box(image_slice) for _, image_slice in named_slices]
+    if None in boxes:
+        raise ValueError('The images have no boxes to be ordered by, see slice_box(), '
+                         'only the slices of the slice functions can be saved in a tile order.')
+    return [named_slices[index] for index in order_tiles(boxes, order, viewport)]
+
+
+# helper function to save a image to a temporary file, then rename it, so a interrupted save leaves no partial file.
+def _save_image_atomic(image, path, pil_format, **params):
+    """Saves 'image' to 'path' atomically, by a temporary file in the same directory and a rename."""
+    temp_path = path + '.tmp'
+    # the directory is created if it does not exist, like the '-o' of the command-line.
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    try:
+        _save_image(image, temp_path, pil_format, params)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
 
 
 # helper function for image grid slice saving.
-def save_image_grid(in_list, out_dir, out_name, out_ext):
+def save_image_grid(in_list, out_dir, out_name, out_ext, out_format=None, skip_names=None, on_saved=None,
+                    tile_manifest=None, metadata=None, incremental=None, order=None, viewport=None):
     """saves a image grid in a form of 'List of List' of PIL image to file system.
 
     A helper function to save image grid or 'list of list' images to file system, with proper sequence number naming.
@@ -851,6 +1852,7 @@ def save_image_grid(in_list, out_dir, out_name, out_ext):
             A 'list of list', the content of each element list should be PIL image objects.
         out_dir:
             A valid path string, to where the files would be written to.
+            Or a sink, like a archive or a object storage, see open_sink(). The caller flushes and closes it.
         out_name:
             A string, the file name prefix you would like to save.
             The output file names will be:
@@ -860,6 +1862,22 @@ def save_image_grid(in_list, out_dir, out_name, out_ext):
                 out_name_M_1, out_name_M_2, ... , out_name_M_N
         out_ext:
             The file extension name, like jpg, png, ...
+        out_format:
+            Optional, the PIL format name to encode the images with, like 'JPEG', 'WEBP', ...
+            If omitted, the format is determined from 'out_ext' by PIL.
+        skip_names:
+            Optional, a container of file names which are already saved, they are skipped, see save_image_list().
+        on_saved:
+            Optional, a function called with the file name after each file is saved, see save_image_list().
+        tile_manifest:
+            Optional, a TileManifest, each saved file is recorded in it, see save_image_list().
+        metadata:
+            Optional, the metadata of the source to give every file, see save_image_list().
+        incremental:
+            Optional, a IncrementalState, only the changed images are saved, see save_image_list().
+        order, viewport:
+            Optional, the order the images are saved in, like a spiral from the viewport, see order_tiles().
+            The rows are not saved one after another then, the file names do not change.
 
     Returns:
         All the images in 'in_list' will be saved to 'out_dir', one by one.
@@ -874,21 +1892,20 @@ def save_image_grid(in_list, out_dir, out_name, out_ext):
             my_slice_M_1.jpg, my_slice_M_2.jpg, ... , my_slice_M_N.jpg
 
     Raises:
-        KeyError:
-            If the output format could not be determined from the file name. (from PIL)
-            The 'out_ext' may be a invalid value, which cannot be recognized by PIL. Check PIL's document for detail.
+        ValueError:
+            If the output format could not be determined from the 'out_ext'.
         IOError:
-            If the file could not be written. The file may have been created, and may contain partial data. (from PIL)
-
-        All the exceptions above is raised from PIL's image.save() method. Check PIL's document for details.
+            If the file could not be written. (from PIL)
 
     """
-    count = 1
     for sub_slice_list in in_list:
         assert sub_slice_list
         assert isinstance(sub_slice_list[0], Image.Image)
-        save_image_list(sub_slice_list, out_dir, out_name + '_' + str(count), out_ext)
-        count += 1
+    pil_format = out_format or get_pil_format_from_ext_name(out_ext)
+    save_params = _metadata_save_params(metadata, pil_format)
+    named_slices = [(name + '.' + out_ext, image_slice) for name, image_slice in _slice_file_names(in_list, out_name)]
+    _save_named_slices(_ordered_slices(named_slices, order, viewport), out_dir, pil_format, skip_names, on_saved,
+                       tile_manifest, save_params, incremental)
 
 
 # helper function to get current working directory
@@ -957,95 +1974,3504 @@ def split_pure_file_name_from_ext_name(file_name):
     return file_name_without_ext, file_name_ext
 
 
-# Standalone sub-command functions for argparse, so it can dispatch accordingly without extra work.
+# Public API: Storage sinks
 
-# standalone horizontal
-def _standalone_horizontal_slice(arguments):
-    print('[Horizontal slice]')
-    # equal slice case.
-    if getattr(arguments, 'slice_count', False):
-        print('Slice method: equal slice.  Slice count: ' + str(arguments.slice_count))
-        return slice_horizontal_in_equal(arguments.file_name, arguments.slice_count)
-    # step slice
-    elif getattr(arguments, 'step_size', False):
-        print('Slice method: step slice.  Slice step: every ' + str(arguments.step_size) + "px")
-        return slice_horizontal_by_step(arguments.file_name, arguments.step_size)
-    # ratio slice
-    elif getattr(arguments, 'ratio_string', False):
-        print('Slice method: ratio slice.  Slice ratio: ' + str(arguments.ratio_string))
-        return slice_horizontal_by_ratio(arguments.file_name, arguments.ratio_string)
-    # should never reach this.
-    else:
-        # this exception should never be raised.
-        raise ValueError('-e, -s or -r, one of which should be provided.')
+# A sink is where the save functions write the slices to, instead of a directory path string.
+# It's any object with these methods:
+#   write(name, data, on_written=None)  store the encoded bytes 'data' as 'name', a relative path like 'sub/a_1.jpg',
+#                                       call 'on_written(name)' once it's stored, it may be later, from another thread.
+#   flush()                             wait until everything written is stored, raise the first error, if any.
+#   close()                             flush and release the resources, like a file or the connections.
+# The sinks here are context managers, they are closed at the end of a 'with' block.
 
 
-# Standalone vertical
-def _standalone_vertical_slice(arguments):
-    print('[Vertical slice]')
-    # equal slice case.
-    if getattr(arguments, 'slice_count', False):
-        print('Slice method: equal slice.  Slice count: ' + str(arguments.slice_count))
-        return slice_vertical_in_equal(arguments.file_name, arguments.slice_count)
-    # step slice
-    elif getattr(arguments, 'step_size', False):
-        print('Slice method: step slice.  Slice step: every ' + str(arguments.step_size) + "px")
-        return slice_vertical_by_step(arguments.file_name, arguments.step_size)
-    # ratio slice
-    elif getattr(arguments, 'ratio_string', False):
-        print('Slice method: ratio slice.  Slice ratio: ' + str(arguments.ratio_string))
-        return slice_vertical_by_ratio(arguments.file_name, arguments.ratio_string)
-    # should never reach this.
-    else:
-        # this exception should never be raised.
-        raise ValueError('-e, -s or -r, one of which should be provided.')
+class DirectorySink(object):
+    """Writes the slices to files under a directory, atomically, the sub directories are created when needed."""
 
+    def __init__(self, path):
+        self.path = path
+        self._directories = set()
 
-# standalone grid
-def _standalone_grid_slice(arguments):
-    print('[Grid slice]')
-    # parse the input arguments, get the mode and mode_params for each direction.
-    if getattr(arguments, 'grid_string', False):
-        # It's the shortcut grid_string case, a grid is provide in a form or 3x2 or 3*2
-        grid_string = arguments.grid_string
+    def write(self, name, data, on_written=None):
+        path = os.path.join(self.path, name)
+        directory = os.path.dirname(path)
+        if directory not in self._directories:
+            os.makedirs(directory, exist_ok=True)
+            self._directories.add(directory)
+        _write_bytes_atomic(path, data)
+        if on_written:
+            on_written(name)
 
-        # A list for holding grid values
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MemorySink(DirectorySink):
+    """Keeps the slices in memory, in the dict 'files' of name -> encoded bytes. Handy for tests and for services."""
+
+    def __init__(self):
+        super(MemorySink, self).__init__('')
+        self.files = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def write(self, name, data, on_written=None):
+        with self._lock:
+            self.files[name] = data
+        if on_written:
+            on_written(name)
+
+
+class ArchiveSink(DirectorySink):
+    """Writes the slices to a zip or a tar archive, by the ext name of 'path': .zip, .tar, .tar.gz or .tgz.
+
+    The slices are already compressed images, so a zip stores them as they are, not compressed again.
+
+    With a 'fileobj', like sys.stdout.buffer, a tar stream is written to it instead, it's never seeked, so it can be
+    a pipe to another process, each slice is streamed as soon as it's written. It's gzipped if 'path' ends with gz.
+    The 'fileobj' is flushed, not closed, by close().
+
+    """
+
+    def __init__(self, path, fileobj=None):
+        super(ArchiveSink, self).__init__(path)
+        self._lock = threading.Lock()
+        self._fileobj = fileobj
+        if fileobj is not None:
+            import tarfile
+
+            self._zip = None
+            self._tar = tarfile.open(fileobj=fileobj, mode='w|gz' if path.lower().endswith('gz') else 'w|')
+        elif path.lower().endswith('.zip'):
+            import zipfile
+
+            self._zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED)
+            self._tar = None
+        elif path.lower().endswith(('.tar', '.tar.gz', '.tgz')):
+            import tarfile
+
+            self._zip = None
+            self._tar = tarfile.open(path, 'w:gz' if path.lower().endswith('gz') else 'w')
+        else:
+            raise ValueError("Archive '" + path + "' should be a .zip, .tar, .tar.gz or .tgz file.")
+
+    def write(self, name, data, on_written=None):
+        with self._lock:
+            if self._zip:
+                self._zip.writestr(name, data)
+            else:
+                import tarfile
+
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                self._tar.addfile(info, io.BytesIO(data))
+        if on_written:
+            on_written(name)
+
+    def close(self):
+        with self._lock:
+            if self._zip:
+                self._zip.close()
+            elif self._tar:
+                self._tar.close()
+            if self._fileobj is not None:
+                self._fileobj.flush()
+
+
+class S3Sink(object):
+    """Uploads the slices to a S3-compatible object storage, like AWS S3 or MinIO, by PUT object requests.
+
+    The uploads run on a pool of 'workers' threads, each keeps it's own HTTP connection open and reuses it,
+    so a batch of small slices does not pay a new connection for each of them. write() returns as soon as the
+    slice is queued, at most 'max_pending' slices are queued, write() waits when it's full.
+    The requests are signed by AWS Signature Version 4, the bucket is addressed in the path (path-style),
+    which every S3-compatible storage supports.
+
+    For example:
+        with S3Sink('http://127.0.0.1:9000', 'tiles', 'scans/', 'minio', 'minio-secret') as sink:
+            save_image_grid(slice_to_grid('a.jpg', 'step', 256, 'step', 256), sink, 'a', 'jpg')
+
+    Args:
+        endpoint:
+            a URL string of the storage, like 'https://s3.eu-west-1.amazonaws.com' or 'http://127.0.0.1:9000'.
+        bucket:
+            a string, the bucket name.
+        prefix:
+            Optional, a string put before every name, like 'tiles/'.
+        access_key, secret_key:
+            Optional, the credentials, the requests are not signed without them.
+        region:
+            Optional, the region in the signature, MinIO accepts the default 'us-east-1'.
+        workers:
+            Optional, the number of upload threads and connections.
+        max_pending:
+            Optional, the number of slices queued at most.
+        content_types:
+            Optional, a dict of ext name -> Content-Type, the default guesses by the ext name.
+
+    Raises:
+        IOError:
+            From write(), flush() or close(), if a upload failed, after one retry on a new connection.
+
+    """
+
+    def __init__(self, endpoint, bucket, prefix='', access_key='', secret_key='', region='us-east-1', workers=8,
+                 max_pending=64, content_types=None):
+        import urllib.parse
+        import concurrent.futures
+
+        parsed = urllib.parse.urlsplit(endpoint)
+        if parsed.scheme not in ['http', 'https'] or not parsed.hostname:
+            raise ValueError("S3 endpoint '" + endpoint + "' should be a URL like http://127.0.0.1:9000 .")
+        self.endpoint = endpoint
+        self.bucket = bucket
+        self.prefix = prefix
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.content_types = content_types or {}
+        self._scheme = parsed.scheme
+        self._host = parsed.hostname
+        self._port = parsed.port
+        self._host_header = parsed.netloc
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-slice-s3')
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._futures = set()
+        self._errors = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = []
+
+    def write(self, name, data, on_written=None):
+        self._raise_error()
+        self._pending.acquire()
+        try:
+            future = self._executor.submit(self._upload, name, data, on_written)
+        except BaseException:
+            self._pending.release()
+            raise
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._uploaded)
+
+    def flush(self):
+        import concurrent.futures
+
+        with self._lock:
+            futures = list(self._futures)
+        concurrent.futures.wait(futures)
+        self._raise_error()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+            with self._lock:
+                for connection in self._connections:
+                    connection.close()
+                self._connections = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _uploaded(self, future):
+        with self._lock:
+            self._futures.discard(future)
+            if future.exception() is not None:
+                self._errors.append(future.exception())
+        self._pending.release()
+
+    def _raise_error(self):
+        with self._lock:
+            if self._errors:
+                raise self._errors[0]
+
+    def _connection(self, new=False):
+        """Returns the HTTP connection of this thread, it's kept open and reused by every upload of the thread."""
+        import http.client
+
+        old_connection = getattr(self._local, 'connection', None)
+        if old_connection is not None and not new:
+            return old_connection
+        connection_class = http.client.HTTPSConnection if self._scheme == 'https' else http.client.HTTPConnection
+        connection = connection_class(self._host, self._port, timeout=60)
+        self._local.connection = connection
+        if old_connection is not None:
+            old_connection.close()
+        with self._lock:
+            # replace the closed connection, so the list keeps one connection per thread.
+            if old_connection in self._connections:
+                self._connections[self._connections.index(old_connection)] = connection
+            else:
+                self._connections.append(connection)
+        return connection
+
+    def _upload(self, name, data, on_written):
+        import http.client
+        import urllib.parse
+
+        key = self.prefix + name.replace(os.sep, '/')
+        path = '/' + urllib.parse.quote(self.bucket + '/' + key, safe='/-_.~')
+        ext_name = name.rpartition('.')[2].lower()
+        content_type = self.content_types.get(ext_name) or 'image/' + {'jpg': 'jpeg', 'tif': 'tiff'}.get(ext_name,
+                                                                                                          ext_name)
+        headers = self._signed_headers('PUT', path, data, {'Content-Type': content_type})
+        for attempt in range(2):
+            # the server may have closed a idle connection, retry once on a new one.
+            connection = self._connection(new=attempt > 0)
+            try:
+                connection.request('PUT', path, body=data, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, ConnectionError):
+                if attempt:
+                    raise
+                continue
+            if response.status not in (200, 201, 204):
+                raise IOError("S3 upload of '" + key + "' failed: HTTP " + str(response.status) + ' '
+                              + body[:200].decode('utf-8', 'replace'))
+            break
+        if on_written:
+            on_written(name)
+
+    def _signed_headers(self, method, path, data, headers, now=None):
+        """Returns the headers of a request signed by AWS Signature Version 4, unsigned without the credentials.
+
+        'now' is the time of the request, a time.struct_time in UTC, the current time by default.
+
+        """
+        import hmac
+        import hashlib
+
+        now = now or time.gmtime()
+        amz_date = time.strftime('%Y%m%dT%H%M%SZ', now)
+        payload_hash = hashlib.sha256(data).hexdigest()
+        headers = dict(headers, Host=self._host_header)
+        headers['x-amz-date'] = amz_date
+        headers['x-amz-content-sha256'] = payload_hash
+        if not (self.access_key and self.secret_key):
+            return headers
+
+        signed = sorted((header.lower(), str(value).strip()) for header, value in headers.items())
+        signed_header_names = ';'.join(header for header, value in signed)
+        canonical_headers = ''.join(header + ':' + value + '\n' for header, value in signed)
+        canonical_request = '\n'.join([method, path, '', canonical_headers, signed_header_names, payload_hash])
+        scope = amz_date[:8] + '/' + self.region + '/s3/aws4_request'
+        string_to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, scope,
+                                    hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()])
+        key = ('AWS4' + self.secret_key).encode('utf-8')
+        for part in [amz_date[:8], self.region, 's3', 'aws4_request']:
+            key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+        headers['Authorization'] = ('AWS4-HMAC-SHA256 Credential=' + self.access_key + '/' + scope
+                                    + ', SignedHeaders=' + signed_header_names + ', Signature=' + signature)
+        return headers
+
+
+def open_sink(target):
+    """Opens a sink for a output target string, the same strings the command-line '-o' accepts.
+
+    For example:
+        open_sink('tiles')                  a DirectorySink
+        open_sink('tiles.zip')              a ArchiveSink, also .tar, .tar.gz and .tgz
+        open_sink('s3://bucket/prefix/')    a S3Sink, the endpoint is from the environment variable
+                                            AWS_ENDPOINT_URL (default AWS S3 of the region), the credentials from
+                                            AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY, the region from AWS_REGION.
+        open_sink('memory:')                a MemorySink
+        open_sink('-')                      a ArchiveSink of a tar stream to stdout
+
+    Returns:
+        A sink, close it when it's done, or use it in a 'with' block.
+
+    """
+    if target.startswith('s3://'):
+        bucket, _, prefix = target[len('s3://'):].partition('/')
+        if not bucket:
+            raise ValueError("S3 target '" + target + "' should be like s3://bucket/prefix/ .")
+        region = os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION') or 'us-east-1'
+        endpoint = os.environ.get('AWS_ENDPOINT_URL') or 'https://s3.' + region + '.amazonaws.com'
+        return S3Sink(endpoint, bucket, prefix, os.environ.get('AWS_ACCESS_KEY_ID', ''),
+                      os.environ.get('AWS_SECRET_ACCESS_KEY', ''), region)
+    elif target == 'memory:':
+        return MemorySink()
+    elif target == '-':
+        return ArchiveSink(target, sys.stdout.buffer)
+    elif target.lower().endswith(('.zip', '.tar', '.tar.gz', '.tgz')):
+        return ArchiveSink(target)
+    return DirectorySink(target)
+
+
+# helper function to save a image to a output directory path string, or to a sink.
+def _save_to_output(out_dir, file_name, image, pil_format, on_saved=None, tile_manifest=None, save_params=None):
+    """Saves 'image' as 'file_name' to 'out_dir', a directory path string or a sink, 'on_saved(file_name)' after.
+
+    With a 'tile_manifest' (see TileManifest), the image is encoded in memory, so the encoded size and the checksum
+    of the saved file are recorded, after it's saved. 'save_params' are passed to PIL, like the metadata.
+
+    """
+    save_params = save_params or {}
+    if tile_manifest is not None:
+        _write_encoded_to_output(out_dir, file_name, _encode_image(image, pil_format, **save_params),
+                                 slice_box(image), image.size, on_saved, tile_manifest)
+    elif isinstance(out_dir, str):
+        _save_image_atomic(image, os.path.join(out_dir, file_name), pil_format, **save_params)
+        if on_saved:
+            on_saved(file_name)
+    else:
+        out_dir.write(file_name, _encode_image(image, pil_format, **save_params), on_saved)
+
+
+# helper function to write a encoded slice to a directory or a sink, it's recorded in the tile manifest if any.
+def _write_encoded_to_output(out_dir, file_name, data, box, size, on_saved=None, tile_manifest=None):
+    """Writes 'data', the encoded slice of 'box' and 'size', as 'file_name' to 'out_dir', see _save_to_output()."""
+    def saved(saved_name):
+        if tile_manifest is not None:
+            tile_manifest.add_tile(saved_name, data, box, size)
+        if on_saved:
+            on_saved(saved_name)
+
+    if isinstance(out_dir, str):
+        _write_bytes_atomic(os.path.join(out_dir, file_name), data)
+        saved(file_name)
+    else:
+        out_dir.write(file_name, data, saved)
+
+
+# Public API: Tile manifest
+
+class TileManifest(object):
+    """A manifest of the saved tiles, written while they are saved: where each tile is from, it's size and checksum.
+
+    It's for the consumers of the tiles, like a viewer or a training data loader, which would otherwise have to
+    open every tile, or guess the layout from the file names. Each source is recorded with it's size and
+    the slice spec, then each of it's tiles is recorded when it's saved, with it's box on the full size source
+    (left, upper, right, bottom), it's size in pixels, it's path, it's encoded size in bytes and it's sha256.
+
+    The format is chosen by the ext name of 'path':
+        .csv   one row for each tile, the source, it's size and spec are repeated on every row:
+               source,source_width,source_height,spec,path,left,upper,right,bottom,width,height,bytes,sha256
+        .json  a JSON list of records, it's completed (the closing ']') by close().
+        others JSON lines, a record on each line, readable even if the job is interrupted:
+               {"type": "source", "source": "a.tif", "width": 4000, "height": 3000, "spec": {...}}
+               {"type": "tile", "source": "a.tif", "path": "a_1_1.png", "bbox": [0, 0, 256, 256],
+                "width": 256, "height": 256, "bytes": 10240, "sha256": "..."}
+
+    The records are streamed to the file, nothing but the sources is held in memory, it's safe to call from
+    several threads. A tile which is not a slice (see slice_box()) has no box, it's empty in the CSV.
+    The manifest describes the tiles saved by one run, a resumed batch (see SliceJobManifest) records only the
+    tiles it saves.
+
+    For example:
+        with TileManifest('tiles.csv') as tile_manifest:
+            slice_batch(list_image_files('scans'), spec, 'tiles', 'png', tile_manifest=tile_manifest)
+
+    """
+
+    _CSV_COLUMNS = ('source', 'source_width', 'source_height', 'spec', 'path', 'left', 'upper', 'right', 'bottom',
+                    'width', 'height', 'bytes', 'sha256')
+
+    def __init__(self, path):
+        self.path = path
+        self.tile_count = 0
+        lower_path = path.lower()
+        self._format = 'csv' if lower_path.endswith('.csv') else 'json' if lower_path.endswith('.json') else 'jsonl'
+        self._sources = {}
+        self._current_source = None
+        self._record_count = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'w', encoding='utf-8', newline='')
+        if self._format == 'csv':
+            import csv
+
+            self._csv_writer = csv.writer(self._file)
+            self._csv_writer.writerow(self._CSV_COLUMNS)
+        elif self._format == 'json':
+            self._file.write('[')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_source(self, source, size, spec):
+        """Records a source, a path string (or any name), it's full size (width, height) and the slice spec.
+
+        The tiles added after it, without a 'source' of their own, are the tiles of this source.
+
+        """
+        with self._lock:
+            self._sources[source] = (size, spec)
+            self._current_source = source
+            if self._format != 'csv':
+                self._write_record({'type': 'source', 'source': source, 'width': size[0], 'height': size[1],
+                                    'spec': spec})
+
+    def add_tile(self, name, data, box, size, source=None):
+        """Records a saved tile, 'name' is it's path in the output, 'data' it's encoded bytes.
+
+        'box' is it's box on the full size source (or None), 'size' it's size in pixels,
+        'source' the source it's from, the last added source if omitted.
+
+        """
+        import hashlib
+
+        checksum = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            source = self._current_source if source is None else source
+            self.tile_count += 1
+            if self._format == 'csv':
+                source_size, spec = self._sources.get(source, (('', ''), None))
+                self._csv_writer.writerow(
+                    (source, source_size[0], source_size[1], json.dumps(spec, sort_keys=True) if spec else '', name)
+                    + (tuple(box) if box else ('', '', '', '')) + (size[0], size[1], len(data), checksum))
+                self._file.flush()
+            else:
+                self._write_record({'type': 'tile', 'source': source, 'path': name,
+                                    'bbox': list(box) if box else None, 'width': size[0], 'height': size[1],
+                                    'bytes': len(data), 'sha256': checksum})
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            if self._format == 'json':
+                self._file.write('\n]\n' if self._record_count else ']\n')
+            self._file.close()
+
+    def _write_record(self, record):
+        if self._format == 'json':
+            self._file.write((',\n' if self._record_count else '\n') + json.dumps(record))
+        else:
+            self._file.write(json.dumps(record) + '\n')
+        self._record_count += 1
+        self._file.flush()
+
+
+# Public API: Incremental re-slicing
+
+class IncrementalState(object):
+    """The pixel hashes of the tiles saved to a output directory, so a rerun only rewrites the tiles which changed.
+
+    When a source is updated in a corner, most of it's tiles are the same as the last run. Before a tile is encoded,
+    it's pixels are hashed (BLAKE2, with the mode, the size, the format and the save params), far cheaper than
+    encoding it. A tile with the same hash as the last run, whose file is still there, is not encoded nor written.
+    close() removes the tiles of the last run which are not produced any more, like the last column of a image
+    which got narrower, then writes the new hashes to the state file 'path', a JSON file, atomically.
+    A run which fails is not recorded, the state of the last run stays, so the next run redoes what changed.
+
+    The state is of the tiles of one output directory, slicing another image to it with the same state removes the
+    tiles of the first image, use a state file for each image. Only the tiles recorded in the state are removed.
+    Archives and object storages are written anew by every run, they are not incremental.
+
+    For example:
+        with IncrementalState('map.state.json', 'tiles') as state:
+            save_image_grid(slice_to_grid('map.png', 'step', 256, 'step', 256), 'tiles', 'map', 'png',
+                            incremental=state)
+
+    Args:
+        path:
+            a string, the path of the state file, it's created by the first run.
+        out_dir:
+            the output directory of the tiles, a path string or a DirectorySink, as given to the save functions.
+
+    """
+
+    def __init__(self, path, out_dir):
+        if not (isinstance(out_dir, str) or type(out_dir) is DirectorySink):
+            raise ValueError('Incremental re-slicing needs the tiles in a output directory, '
+                             'a archive or a object storage is written anew by every run.')
+        self.path = path
+        self.directory = out_dir if isinstance(out_dir, str) else out_dir.path
+        self.written = self.unchanged = self.removed = 0
+        self._previous = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as state_file:
+                self._previous = json.load(state_file).get('tiles', {})
+        self._current = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # a failed run is not recorded.
+        if exc_type is None:
+            self.close()
+
+    def is_unchanged(self, name, image, pil_format, save_params=None):
+        """Returns True if the tile 'name' is the same as the last run and it's file is there, so it's skipped.
+
+        The hash of 'image' is recorded for 'name' either way, the caller saves the tile if it's changed.
+
+        """
+        import hashlib
+
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((image.mode, image.size, pil_format, sorted((save_params or {}).items()),
+                            image.getpalette() if image.mode == 'P' else None)).encode('utf-8'))
+        # tobytes() copies the pixels, deliberately: PIL has no buffer of them to hash in place, numpy.asarray() copies
+        # by tobytes() too. The copy takes about half the time of the hash, both far less than encoding the tile.
+        digest.update(image.tobytes())
+        pixel_hash = digest.hexdigest()
+        unchanged = (self._previous.get(name) == pixel_hash
+                     and os.path.exists(os.path.join(self.directory, name)))
+        with self._lock:
+            self._current[name] = pixel_hash
+            if unchanged:
+                self.unchanged += 1
+            else:
+                self.written += 1
+        return unchanged
+
+    def close(self):
+        """Removes the tiles of the last run which are not produced by this run, writes the state file."""
+        with self._lock:
+            for name in set(self._previous) - set(self._current):
+                stale_path = os.path.join(self.directory, name)
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+                    self.removed += 1
+            _write_bytes_atomic(self.path, json.dumps({'tiles': self._current}, sort_keys=True).encode('utf-8'))
+            self._previous = self._current
+            self._current = {}
+
+
+# Public API: Decoded image cache
+
+def enable_image_cache(max_bytes=512 * 1024 * 1024):
+    """Enables the decoded image cache, so a path sliced several times is opened and decoded only once.
+
+    The cache is opt-in and shared by all the functions which accept a path, like slice_horizontal_in_equal(),
+    slice_to_grid() or slice_by_spec(). A cached image is keyed by it's path, modification time and size,
+    so a file changed on the disk is decoded again. When the decoded images take more than 'max_bytes',
+    the least recently used ones are evicted. A image bigger than 'max_bytes' is never cached.
+
+    The cached images are shared, they should not be modified in place (like by paste()),
+    all the slice functions only read them.
+
+    For example:
+        enable_image_cache(256 * 1024 * 1024)
+        grid = slice_to_grid('map.png', 'equal', 3, 'equal', 2)     # decoded
+        tiles = slice_to_grid('map.png', 'step', 256, 'step', 256)  # from the cache
+        get_image_cache_stats()  # {'hits': 1, 'misses': 1, ...}
+
+    Args:
+        max_bytes:
+            a int, the budget of the decoded pixel data in bytes, default to 512MB.
+            Enabling a enabled cache changes it's budget, the cached images are kept if they fit.
+
+    Raises:
+        ValueError:
+            If 'max_bytes' is not a positive int.
+
+    """
+    if not isinstance(max_bytes, int) or max_bytes <= 0:
+        raise ValueError("'max_bytes' should be a positive int, the budget of the cache in bytes.")
+    cache = _IMAGE_CACHE
+    with cache['lock']:
+        cache['enabled'] = True
+        cache['max_bytes'] = max_bytes
+        while cache['bytes'] > cache['max_bytes']:
+            _, (_, evicted_bytes) = cache['entries'].popitem(last=False)
+            cache['bytes'] -= evicted_bytes
+            cache['evictions'] += 1
+
+
+def disable_image_cache():
+    """Disables the decoded image cache and releases all the cached images, the counters are kept."""
+    cache = _IMAGE_CACHE
+    with cache['lock']:
+        cache['enabled'] = False
+        cache['entries'].clear()
+        cache['bytes'] = 0
+
+
+def clear_image_cache():
+    """Releases all the cached images and resets the counters, the cache stays enabled if it is."""
+    cache = _IMAGE_CACHE
+    with cache['lock']:
+        cache['entries'].clear()
+        cache['bytes'] = 0
+        cache['hits'] = 0
+        cache['misses'] = 0
+        cache['evictions'] = 0
+
+
+def get_image_cache_stats():
+    """Gets the counters of the decoded image cache, for tuning it's budget.
+
+    Returns:
+        A dict like this:
+            {'enabled': True, 'hits': 12, 'misses': 3, 'evictions': 1, 'hit_rate': 0.8,
+             'entries': 2, 'bytes': 96000000, 'max_bytes': 536870912}
+
+    """
+    cache = _IMAGE_CACHE
+    with cache['lock']:
+        lookups = cache['hits'] + cache['misses']
+        return {
+            'enabled': cache['enabled'],
+            'hits': cache['hits'],
+            'misses': cache['misses'],
+            'evictions': cache['evictions'],
+            'hit_rate': round(cache['hits'] / lookups, 4) if lookups else 0.0,
+            'entries': len(cache['entries']),
+            'bytes': cache['bytes'],
+            'max_bytes': cache['max_bytes'],
+        }
+
+
+# Public API: Out-of-core images
+
+# The out-of-core mode, a image which would take more memory than 'memory_ceiling' when it's decoded is decoded
+# in row bands of about 'band_bytes' into a memory-mapped temporary file instead, see enable_out_of_core().
+# 'band_bytes' of 0 is the one of the tuning profile, see tune(), or 64 MB without one.
+_OUT_OF_CORE = {
+    'enabled': True,
+    'memory_ceiling': 1024 * 1024 * 1024,
+    'band_bytes': 0,
+    'temp_dir': None,
+}
+
+# The bits per pixel of the PIL raw modes of uncompressed image data, such data is decoded band by band.
+_RAWMODE_BITS = {'1': 1, '1;I': 1, '1;R': 1, '1;IR': 1, 'L': 8, 'L;I': 8, 'P': 8, 'LA': 16, 'RGB': 24, 'BGR': 24,
+                 'RGBA': 32, 'RGBX': 32, 'BGRA': 32, 'BGRX': 32, 'CMYK': 32, 'I;16': 16, 'I;16B': 16, 'I;16L': 16,
+                 'I;16N': 16, 'I': 32, 'I;32': 32, 'F': 32, 'F;32F': 32}
+
+
+def enable_out_of_core(memory_ceiling=1024 * 1024 * 1024, band_bytes=0, max_pixels=0,
+                       temp_dir=None):
+    """Sets the out-of-core mode, which is on by default with a memory ceiling of 1 GB.
+
+    A image opened from a path, which would take more than 'memory_ceiling' bytes when it's decoded
+    (width * height * bytes per pixel), is decoded into a memory-mapped temporary file instead, see open_out_of_core().
+    The slices are cropped from the mapped file, only the slices themselves take memory.
+
+    Args:
+        memory_ceiling:
+            a int, the bytes of a decoded image, above which it's opened out-of-core.
+        band_bytes:
+            Optional, a int, about how many bytes of rows are decoded at a time.
+            0 means the band size of the tuning profile of the machine, see tune(), or 64 MB without one.
+        max_pixels:
+            Optional, a int, raise PIL's decompression bomb limit (Image.MAX_IMAGE_PIXELS) to this many pixels,
+            for trusted huge images, like gigapixel scans. 0 keeps PIL's limit.
+        temp_dir:
+            Optional, the directory of the temporary files, the default temporary directory if omitted.
+
+    Raises:
+        ValueError: If 'memory_ceiling' is not greater than 0, or 'band_bytes' is less than 0.
+
+    """
+    if not memory_ceiling > 0 or band_bytes < 0:
+        raise ValueError("'memory_ceiling' should be greater than 0 and 'band_bytes' should not be less than 0.")
+    _OUT_OF_CORE.update(enabled=True, memory_ceiling=memory_ceiling, band_bytes=band_bytes, temp_dir=temp_dir)
+    if max_pixels:
+        Image.MAX_IMAGE_PIXELS = max_pixels
+
+
+def disable_out_of_core():
+    """Turns the out-of-core mode off, every image is decoded in memory, like PIL does."""
+    _OUT_OF_CORE['enabled'] = False
+
+
+class MappedImage(object):
+    """A decoded image in a memory-mapped temporary file, the rows one after another, see open_out_of_core().
+
+    It has the few things of a PIL image the slice functions use: 'mode', 'size', 'width', 'height', 'info',
+    load() and crop(). crop() returns a ordinary PIL image, copied from the mapped rows,
+    the pages not used are left to the OS, so the memory it takes is the slices, not the image.
+
+    """
+
+    def __init__(self, mapped, mode, size, info, palette=None, convert_format=None):
+        self.mapped = mapped
+        self.mode = mode
+        self.size = size
+        self.width, self.height = size
+        self.info = info
+        self.palette = palette
+        self.convert_format = convert_format
+        # mode '1' is stored 1 byte a pixel, so a row can be sliced at any pixel.
+        self.storage_rawmode = '1;8' if mode == '1' else mode
+        self.pixel_bytes = len(mapped) // (self.width * self.height)
+
+    def load(self):
+        pass
+
+    def crop(self, box):
+        """Returns the 'box' (left, upper, right, bottom) of the image as a PIL image."""
+        left, upper, right, bottom = [int(value) for value in box]
+        row_bytes = self.width * self.pixel_bytes
+        if left == 0 and right == self.width:
+            data = self.mapped[upper * row_bytes:bottom * row_bytes]
+        else:
+            data = b''.join(self.mapped[row * row_bytes + left * self.pixel_bytes:
+                                        row * row_bytes + right * self.pixel_bytes] for row in range(upper, bottom))
+        tile = Image.frombytes(self.mode, (right - left, bottom - upper), data, 'raw', self.storage_rawmode)
+        if self.palette:
+            tile.putpalette(self.palette)
+        tile.info = dict(self.info)
+        if self.convert_format:
+            tile = convert_image_for_format(tile, self.convert_format)
+        return tile
+
+    def converted(self, out_format):
+        """Returns the image converted for 'out_format', each slice is converted when it's cropped."""
+        return MappedImage(self.mapped, self.mode, self.size, self.info, self.palette, out_format)
+
+    def reduced(self, target_size):
+        """Returns a reduced PIL image of 'target_size', it's reduced band by band, it's small enough for the memory.
+
+        The bands are reduced by a integer factor (the average of each block of pixels), then once more
+        to the exact size, like reduce_image() does.
+
+        """
+        factor = max(1, min(self.width // target_size[0], self.height // target_size[1]))
+        band_height = max(1, _band_bytes() // (self.width * self.pixel_bytes)) // factor * factor
+        band_height = max(band_height, factor)
+        reduced = None
+        for upper in range(0, self.height, band_height):
+            band = self.crop((0, upper, self.width, min(self.height, upper + band_height)))
+            band_size = ((band.width + factor - 1) // factor, (band.height + factor - 1) // factor)
+            if factor > 1 and band.mode in ('P', '1'):
+                # PIL resizes a palette or bilevel image by the nearest pixel only.
+                band = band.resize(band_size, Image.NEAREST)
+            elif factor > 1 and band.mode in _NO_REDUCE_MODES:
+                # the box filter of a integer factor is the average of each block, the same as reduce().
+                band = band.resize(band_size, Image.BOX)
+            elif factor > 1:
+                band = band.reduce(factor)
+            if reduced is None:
+                reduced = Image.new(band.mode, ((self.width + factor - 1) // factor,
+                                                (self.height + factor - 1) // factor))
+                if band.mode == 'P':
+                    reduced.putpalette(band.getpalette())
+            reduced.paste(band, (0, upper // factor))
+        if reduced.size != tuple(target_size):
+            reduced = reduced.resize(target_size, Image.LANCZOS)
+        return reduced
+
+
+def open_out_of_core(image, band_bytes=0, temp_dir=None):
+    """Decodes a image file into a memory-mapped temporary file, row band by row band, returns a MappedImage.
+
+    Uncompressed images (like uncompressed TIFF, BMP, PPM) are read and decoded one band of rows at a time,
+    so the whole image is never in memory. A compressed image is decoded by PIL as a whole, then spilled to the file
+    band by band and released, the memory is taken only while it's opened.
+
+    The temporary file is removed when the MappedImage is released.
+
+    For example:
+        enable_out_of_core(max_pixels=4 * 10 ** 9)
+        slice_to_grid(open_out_of_core('scan.tif'), 'step', 1024, 'step', 1024)
+
+    Args:
+        image:
+            a path string of the image file.
+        band_bytes:
+            Optional, about how many bytes of rows are decoded at a time, the default of enable_out_of_core().
+        temp_dir:
+            Optional, the directory of the temporary file, the default of enable_out_of_core().
+
+    Returns:
+        A MappedImage, which can be passed to the slice functions instead of a path or a PIL image.
+
+    Raises:
+        IOError: If PIL cannot open the image, or the temporary file cannot be written.
+
+    """
+    try:
+        img = Image.open(image)
+    except IOError:
+        raise IOError('PIL open file error, please check if the image path provided is a valid image file.')
+    return _map_image(img, band_bytes or _band_bytes(), temp_dir or _OUT_OF_CORE['temp_dir'])
+
+
+# helper function to tell the bytes of a band of rows decoded at a time, out-of-core.
+def _band_bytes():
+    return _OUT_OF_CORE['band_bytes'] or _tuned('band_bytes', 64 * 1024 * 1024)
+
+
+# helper function to tell if a image opened (not decoded yet) should be opened out-of-core.
+def _exceeds_memory_ceiling(img):
+    return _OUT_OF_CORE['enabled'] and _image_memory_bytes(img.mode, img.size) > _OUT_OF_CORE['memory_ceiling']
+
+
+# helper function to decode a opened image into a memory-mapped temporary file.
+def _map_image(img, band_bytes, temp_dir):
+    """Decodes 'img', a PIL image opened but not decoded yet, to a MappedImage, see open_out_of_core()."""
+    import mmap
+    import tempfile
+
+    width, height = img.size
+    storage_rawmode = 'L' if img.mode == '1' else img.mode
+    # the bytes of a row, from a 1px high image of the mode.
+    row_bytes = len(Image.new(img.mode, (width, 1)).tobytes('raw', storage_rawmode))
+    band_height = max(1, band_bytes // row_bytes)
+    read_band = _raw_band_reader(img)
+    palette = img.getpalette() if img.mode == 'P' else None
+    info = dict(img.info)
+
+    temp_file = tempfile.TemporaryFile(prefix='image-slice-', dir=temp_dir)
+    with temp_file:
+        for upper in range(0, height, band_height):
+            bottom = min(height, upper + band_height)
+            band = read_band(upper, bottom) if read_band else img.crop((0, upper, width, bottom))
+            temp_file.write(band.tobytes('raw', storage_rawmode))
+        temp_file.flush()
+        # the map keeps the file, it's removed when the map is closed.
+        mapped = mmap.mmap(temp_file.fileno(), 0, access=mmap.ACCESS_READ)
+    # the fully decoded image of a compressed file is released now.
+    img.close()
+    return MappedImage(mapped, img.mode, img.size, info, palette)
+
+
+# helper function to read the rows of uncompressed image data, without decoding the whole image.
+def _raw_band_reader(img):
+    """Returns a function read_band(upper, bottom), which decodes the rows in a PIL image, by PIL's tile descriptors.
+
+    It returns None if the image is not uncompressed data of a known raw mode, then it has to be decoded as a whole.
+
+    """
+    tiles = []
+    for tile in img.tile:
+        codec_name, extents, offset, args = tile[0], tile[1], tile[2], tile[3]
+        if codec_name != 'raw':
+            return None
+        if isinstance(args, str):
+            args = (args,)
+        rawmode = args[0]
+        stride = args[1] if len(args) > 1 else 0
+        orientation = args[2] if len(args) > 2 else 1
+        if rawmode not in _RAWMODE_BITS or orientation not in (1, -1):
+            return None
+        tile_width = extents[2] - extents[0]
+        stride = stride or (tile_width * _RAWMODE_BITS[rawmode] + 7) // 8
+        tiles.append((extents, offset, rawmode, stride, orientation))
+    if not tiles or not getattr(img, 'filename', ''):
+        return None
+    path = img.filename
+    mode = img.mode
+    width = img.width
+
+    def read_band(upper, bottom):
+        band = Image.new(mode, (width, bottom - upper))
+        with open(path, 'rb') as image_file:
+            for (left, tile_upper, right, tile_bottom), offset, rawmode, stride, orientation in tiles:
+                first, last = max(upper, tile_upper), min(bottom, tile_bottom)
+                if first >= last:
+                    continue
+                # the rows of a bottom-up tile are stored the last first, the band is still continuous in the file.
+                if orientation == 1:
+                    image_file.seek(offset + (first - tile_upper) * stride)
+                else:
+                    image_file.seek(offset + (tile_bottom - last) * stride)
+                data = image_file.read((last - first) * stride)
+                part = Image.frombytes(mode, (right - left, last - first), data, 'raw', rawmode, stride, orientation)
+                band.paste(part, (left, first - upper))
+        return band
+
+    return read_band
+
+
+# Public API: Image metadata
+
+# the EXIF tag of the orientation.
+_EXIF_ORIENTATION = 0x0112
+
+# the metadata each PIL format can store, by the save params of PIL, the others are not passed to it.
+_FORMAT_METADATA = {
+    'JPEG': ('icc_profile', 'dpi', 'exif'),
+    'PNG': ('icc_profile', 'dpi', 'exif'),
+    'WEBP': ('icc_profile', 'exif'),
+    'TIFF': ('icc_profile', 'dpi', 'exif'),
+    'BMP': ('dpi',),
+}
+
+
+# helper function to turn a image upright by it's EXIF orientation, once, before it's sliced.
+def orient_image(image):
+    """Returns the image upright, transposed by it's EXIF orientation, so the slices come out upright.
+
+    It's done once on the source before the slices are planned, then the slices are planned on the upright size,
+    no slice is transposed. The orientation is removed from the EXIF of the returned image.
+    A image with no orientation (or the normal one) is returned as it is, not decoded.
+    A image opened out-of-core (see MappedImage) is returned as it is.
+
+    Args:
+        image: a string to the image path, or a PIL Image object.
+
+    Returns:
+        A PIL Image object.
+
+    """
+    img = _open_image(image)
+    if isinstance(img, MappedImage) or img.getexif().get(_EXIF_ORIENTATION, 1) == 1:
+        return img
+    return ImageOps.exif_transpose(img)
+
+
+# helper function to serialize the metadata of a source once, so every slice reuses it.
+def image_metadata(image, exif=False):
+    """Returns the metadata of a source to give every slice of it: the ICC profile, the DPI, and the EXIF if asked.
+
+    The metadata is serialized once here, the same bytes are passed to the save functions for every slice
+    (see save_image_list()), instead of being read from the source again for each slice.
+
+    Args:
+        image:
+            a string to the image path, or a PIL Image object, usually upright already, see orient_image().
+        exif:
+            optional, True to keep the EXIF too, it's stripped: the orientation (the slices are upright)
+            and the thumbnail (of the whole image) are dropped.
+
+    Returns:
+        A dict of PIL save params, like {'icc_profile': b'...', 'dpi': (300, 300), 'exif': b'...'},
+        only the ones the source has.
+
+    """
+    img = _open_image(image)
+    metadata = {}
+    if img.info.get('icc_profile'):
+        metadata['icc_profile'] = img.info['icc_profile']
+    if img.info.get('dpi'):
+        metadata['dpi'] = tuple(img.info['dpi'])
+    if exif:
+        if isinstance(img, MappedImage):
+            source_exif = Image.Exif()
+            source_exif.load(img.info.get('exif', b''))
+        else:
+            source_exif = img.getexif()
+        source_exif.pop(_EXIF_ORIENTATION, None)
+        # only the main IFD and it's sub IFDs are serialized, the thumbnail IFD is not.
+        if source_exif:
+            metadata['exif'] = source_exif.tobytes()
+    return metadata
+
+
+# helper function to pick the metadata a output format can store, it's the save params of every slice.
+def _metadata_save_params(metadata, pil_format):
+    """Returns the items of 'metadata' (see image_metadata()) 'pil_format' can store, a empty dict for None."""
+    if not metadata:
+        return {}
+    return dict((key, value) for key, value in metadata.items()
+                if key in _FORMAT_METADATA.get(pil_format.upper(), ()))
+
+
+# Public API: Output format conversion helpers
+
+# the image modes each output format can store as it is, any other mode has to be converted before saving.
+# formats not listed here are trusted to handle the incoming mode by themselves (like TIFF).
+_OUTPUT_FORMAT_MODES = {
+    'JPEG': ('L', 'RGB', 'CMYK'),
+    'WEBP': ('RGB', 'RGBA'),
+    'PNG': ('1', 'L', 'LA', 'I', 'I;16', 'P', 'RGB', 'RGBA'),
+    'GIF': ('L', 'P'),
+    'BMP': ('1', 'L', 'P', 'RGB'),
+    'PPM': ('1', 'L', 'RGB'),
+}
+
+# high bit depth modes, they are scaled down to 8-bit when the output format cannot hold them.
+_HIGH_BIT_DEPTH_MODES = ('I', 'I;16', 'I;16L', 'I;16B', 'I;16N', 'F')
+
+
+# the PIL format and plugin module of the common ext names, so only the plugin needed is imported,
+# PIL.Image.registered_extensions() imports every PIL plugin to find it, which is slow for a single image.
+_PIL_PLUGINS_BY_EXT = {
+    'jpg': ('JPEG', 'JpegImagePlugin'),
+    'jpeg': ('JPEG', 'JpegImagePlugin'),
+    'jpe': ('JPEG', 'JpegImagePlugin'),
+    'png': ('PNG', 'PngImagePlugin'),
+    'webp': ('WEBP', 'WebPImagePlugin'),
+    'gif': ('GIF', 'GifImagePlugin'),
+    'bmp': ('BMP', 'BmpImagePlugin'),
+    'tif': ('TIFF', 'TiffImagePlugin'),
+    'tiff': ('TIFF', 'TiffImagePlugin'),
+    'ppm': ('PPM', 'PpmImagePlugin'),
+    'pgm': ('PPM', 'PpmImagePlugin'),
+}
+
+
+# helper function to find the PIL format name of a ext name, like 'jpg' -> 'JPEG'
+def get_pil_format_from_ext_name(ext_name):
+    """Gets the PIL format name (like 'JPEG', 'WEBP') of a given file ext name (like 'jpg', 'webp')
+
+    Args:
+        ext_name: a string, the ext name, with or without the leading dot, like 'jpg' or '.jpg'.
+
+    Returns:
+        A string, the PIL format name which PIL uses to encode a file with this ext name.
+
+    Raises:
+        ValueError:
+            If 'ext_name' is empty, or PIL does not know how to write a file with this ext name.
+        TypeError:
+            If 'ext_name' is not a string.
+
+    """
+    if not ext_name:
+        raise ValueError("'ext_name' is a mandatory field, it cannot be empty.")
+    if not isinstance(ext_name, str):
+        raise TypeError("'ext_name' should be a string, like 'jpg', 'png' or 'webp'.")
+    ext_name = ext_name.lower().lstrip('.')
+    # a common one, import only it's plugin.
+    if ext_name in _PIL_PLUGINS_BY_EXT:
+        pil_format, plugin_name = _PIL_PLUGINS_BY_EXT[ext_name]
+        importlib.import_module('PIL.' + plugin_name)
+        return pil_format
+    ext_name = '.' + ext_name
+    pil_format = Image.registered_extensions().get(ext_name)
+    if not pil_format:
+        raise ValueError("Output format '" + ext_name + "' is unknown to PIL, check if it's a typo.")
+    return pil_format
+
+
+# helper function to find a ext name of a PIL format name, like 'JPEG' -> 'jpg', the reverse of the one above.
+def _ext_name_of_format(pil_format):
+    for ext_name, (plugin_format, _) in _PIL_PLUGINS_BY_EXT.items():
+        if plugin_format == pil_format:
+            return ext_name
+    return (pil_format or 'png').lower()
+
+
+# helper function to convert the image mode once, so every slice can be encoded to the output format directly.
+def convert_image_for_format(image, out_format):
+    """Converts a image to a mode the output format can store, so the slices need no conversion on saving.
+
+    The conversion is done once on the source image, before it's sliced, rather than once for each slice.
+    If the image mode is already supported by the output format, the image is returned as it is.
+
+    The conversion rules are:
+        1. 16-bit or 32-bit images (I;16, I, F) are scaled down to 8-bit, if the output format cannot hold them.
+        2. Images with transparency (RGBA, LA, PA, P with transparency) are flattened onto a white background,
+           if the output format has no alpha channel (like JPEG, BMP).
+        3. Other images are converted to the most common mode of the output format, grayscale stays grayscale.
+
+    For example:
+        A RGBA PNG image with 'jpg' as 'out_format' will be flattened to a RGB image.
+        A 16-bit grayscale TIFF with 'webp' as 'out_format' will be scaled to 8-bit, then converted to RGB.
+
+    Args:
+        image:
+            a string to the image path, or a PIL Image object.
+        out_format:
+            a string, the output ext name or PIL format name, like 'jpg', 'webp', 'png', 'JPEG'.
+
+    Returns:
+        A PIL Image object, in a mode which can be saved to 'out_format' directly.
+
+    Raises:
+        TypeError:
+            If 'image' is not a string nor a PIL Image object.
+        IOError:
+            If PIL cannot open the image from the path in the 'image'.
+        ValueError:
+            If 'out_format' is not a format known to PIL.
+
+    """
+    img = _open_image(image)
+
+    # accept both 'jpg' and 'JPEG'
+    if out_format.upper() in _OUTPUT_FORMAT_MODES:
+        pil_format = out_format.upper()
+    else:
+        pil_format = get_pil_format_from_ext_name(out_format)
+    supported_modes = _OUTPUT_FORMAT_MODES.get(pil_format)
+
+    # the format can store this mode, or it's a format we trust to handle it, nothing to do.
+    if not supported_modes or img.mode in supported_modes:
+        return img
+
+    # a image opened out-of-core is converted slice by slice, when they are cropped.
+    if isinstance(img, MappedImage):
+        return img.converted(pil_format)
+
+    # high bit depth to 8-bit, scale the values rather than clip them.
+    if img.mode in _HIGH_BIT_DEPTH_MODES:
+        if img.mode == 'F':
+            img = img.convert('L')
+        else:
+            img = img.convert('I').point(lambda value: value * (1 / 256)).convert('L')
+        if img.mode in supported_modes:
+            return img
+
+    # transparency, keep it if the format can, or flatten it onto white.
+    has_alpha = img.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La') or 'transparency' in img.info
+    if has_alpha:
+        if 'RGBA' in supported_modes:
+            return img.convert('RGBA')
+        if 'LA' in supported_modes and img.mode in ('LA', 'La'):
+            return img.convert('LA')
+        rgba = img.convert('RGBA')
+        flattened = Image.new('RGB', rgba.size, (255, 255, 255))
+        flattened.paste(rgba, mask=rgba.getchannel('A'))
+        img = flattened
+        if img.mode in supported_modes:
+            return img
+
+    # everything else, grayscale stays grayscale if possible, or RGB, or the first mode the format supports.
+    if img.mode in ('1', 'L', 'LA', 'La') and 'L' in supported_modes:
+        return img.convert('L')
+    if 'RGB' in supported_modes:
+        return img.convert('RGB')
+    return img.convert(supported_modes[0])
+
+
+# The modes PIL cannot reduce() by a integer factor.
+_NO_REDUCE_MODES = ('P', '1', 'I;16', 'I;16L', 'I;16B', 'I;16N')
+
+
+# helper function to reduce a image to a smaller scale, decoding it in a smaller size in the first place if possible.
+def reduce_image(image, scale):
+    """Reduces a image to a given scale, for fast preview/thumbnail slicing.
+
+    If the image is a JPEG file, it's decoded directly in a reduced size by PIL's draft mode
+    (the JPEG DCT scaling, 1/2, 1/4 or 1/8), so the full size image is never decoded into the memory.
+    Then it's reduced once more to the exact scale. Other formats are decoded, then reduced once.
+    A PIL Image object is never changed, it's resized to a new one, even if it's a JPEG not loaded yet.
+
+    For example:
+        If the 'image' is a 4000*3000px JPEG file, 'scale' is 0.2, it's decoded in 1000*750px by draft mode,
+        then resized to 800*600px.
+
+    Args:
+        image:
+            a string to the image path, or a PIL Image object.
+        scale:
+            a number in (0, 1], the scale of the output image, 1 means the image is returned as it is.
+
+    Returns:
+        A PIL Image object, the size of which is the size of 'image' times 'scale', at least 1px.
+
+    Raises:
+        TypeError:
+            If 'image' is not a string nor a PIL Image object, or 'scale' is not a number.
+        IOError:
+            If PIL cannot open the image from the path in the 'image'.
+        ValueError:
+            If 'scale' is not in (0, 1].
+
+    """
+    return _reduce_image(image, scale, not isinstance(image, Image.Image))
+
+
+# helper function of reduce_image(), 'draft' is False for a PIL image of the caller's, which draft mode would shrink.
+def _reduce_image(image, scale, draft):
+    if not isinstance(scale, (int, float)) or isinstance(scale, bool):
+        raise TypeError("'scale' should be a number in (0, 1], like 0.25.")
+    if not 0 < scale <= 1:
+        raise ValueError("'scale' should be in (0, 1], like 0.25, check the function arguments.")
+    img = _open_image(image)
+    if scale == 1:
+        return img
+
+    target_size = (max(1, int(round(img.width * scale))), max(1, int(round(img.height * scale))))
+    if isinstance(img, MappedImage):
+        return img.reduced(target_size)
+    # JPEG only, it does nothing to other formats or to a image already loaded.
+    if draft:
+        img.draft(img.mode, target_size)
+    if img.size != target_size:
+        # reducing_gap reduces the image by a integer factor first, which is much faster than resample it all.
+        # PIL cannot reduce some modes, like 16-bit ones, they are resampled all.
+        img = img.resize(target_size, Image.LANCZOS, reducing_gap=2.0 if img.mode not in _NO_REDUCE_MODES else None)
+    return img
+
+
+# Public API: Parallel encoding of huge slices
+
+# A slice which takes more memory than this when it's decoded is encoded by several threads, band by band,
+# see save_parallel(). 0 turns it off.
+PARALLEL_ENCODE_MIN_BYTES = 32 * 1024 * 1024
+
+# About how many bytes of rows each thread encodes at a time.
+_PARALLEL_BAND_BYTES = 4 * 1024 * 1024
+
+# The PNG modes encoded in bands: the raw mode of the rows, the bit depth and the PNG color type.
+_PNG_BAND_MODES = {'1': ('1', 1, 0), 'L': ('L', 8, 0), 'LA': ('LA', 8, 4), 'P': ('P', 8, 3), 'RGB': ('RGB', 8, 2),
+                   'RGBA': ('RGBA', 8, 6), 'I;16': ('I;16B', 16, 0)}
+
+# The save params the bands are encoded with, by format, a image saved with any other is saved by PIL as usual.
+_PARALLEL_ENCODE_PARAMS = {
+    'PNG': ('compress_level', 'optimize', 'transparency', 'icc_profile', 'dpi', 'exif'),
+    'JPEG': ('quality', 'subsampling', 'qtables', 'optimize', 'progressive', 'icc_profile', 'dpi', 'exif'),
+}
+
+# The most MCUs of a JPEG restart interval, the DRI segment stores it in 16 bits.
+_JPEG_MAX_RESTART_INTERVAL = 65535
+
+
+def save_parallel(image, fp, pil_format, workers=0, **params):
+    """Encodes a image to PNG or JPEG on several threads, band by band, and writes it to 'fp'.
+
+    A huge slice, like a half of a 40000px tall scan, takes a core tens of seconds to encode as one piece.
+    Here the rows are cut into bands of about 4 MB, and the bands are encoded by 'workers' threads at the same time,
+    zlib and PIL's encoders do not hold the GIL, then they are written one after another, in order.
+
+    PNG: each band is deflated on it's own, with the last 32 KB of the band above as the dictionary, and ends on a
+    byte boundary (Z_FULL_FLUSH), so the pieces join to one zlib stream, whose checksum is combined from the Adler-32
+    of each band. The rows are filtered by the Up filter (None for 1-bit and palette images), instead of PIL's
+    adaptive filters, so a file may be a little bigger.
+    JPEG: each band is a multiple of the MCU rows, encoded as a JPEG of it's own, and the entropy-coded data of
+    the bands is joined by restart markers, a restart interval is a band. The pixels are the same as PIL's.
+
+    Every save of the slice functions encodes a slice bigger than PARALLEL_ENCODE_MIN_BYTES by it,
+    when there's more than 1 encode worker. The output does not depend on the number of threads.
+
+    A format, a mode or a save param the bands cannot be encoded with (like a progressive JPEG, or a optimized one,
+    which need the whole image) is saved by PIL as usual, on one thread.
+
+    For example:
+        save_parallel(slice_vertical_in_equal('scan.png', 2)[0], 'top.png', 'PNG', workers=8, compress_level=6)
+
+    Args:
+        image:
+            a PIL Image object.
+        fp:
+            a path string, or a file object opened for binary writing.
+        pil_format:
+            a PIL format name, 'PNG' or 'JPEG' are encoded in bands.
+        workers:
+            Optional, a int, the number of threads, 0 means the number of the tuning profile of the machine
+            (see tune()), or the number of CPUs.
+        **params:
+            Optional, the save params, like PIL's, like 'compress_level', 'quality' or the metadata.
+
+    Raises:
+        IOError, ValueError:
+            If the image cannot be encoded, or the file cannot be written.
+
+    """
+    pil_format = pil_format.upper()
+    workers = workers or _tuned('encode_workers', 0) or os.cpu_count() or 1
+    if isinstance(fp, str):
+        with open(fp, 'wb') as file_object:
+            return save_parallel(image, file_object, pil_format, workers, **params)
+    if pil_format == 'PNG' and _png_bands_encodable(image, params):
+        return _save_png_bands(image, fp, workers, params)
+    if pil_format == 'JPEG' and _jpeg_bands_encodable(image, params):
+        return _save_jpeg_bands(image, fp, workers, params)
+    image.save(fp, format=pil_format, **params)
+
+
+# helper function to save or encode a image, by PIL, or a huge one by several threads, see save_parallel().
+def _save_image(image, fp, pil_format, params):
+    params = _encoder_params(pil_format, params)
+    workers = _tuned('encode_workers', 0) or os.cpu_count() or 1
+    if PARALLEL_ENCODE_MIN_BYTES and workers > 1 and isinstance(image, Image.Image) \
+            and _image_memory_bytes(image.mode, image.size) > PARALLEL_ENCODE_MIN_BYTES:
+        save_parallel(image, fp, pil_format, workers, **params)
+    else:
+        image.save(fp, format=pil_format, **params)
+
+
+def _png_bands_encodable(image, params):
+    return (image.mode in _PNG_BAND_MODES and set(params) <= set(_PARALLEL_ENCODE_PARAMS['PNG'])
+            and not (image.mode == 'P' and image.palette and image.palette.mode != 'RGB'))
+
+
+def _jpeg_bands_encodable(image, params):
+    return (image.mode in ('L', 'RGB', 'CMYK') and set(params) <= set(_PARALLEL_ENCODE_PARAMS['JPEG'])
+            and not params.get('optimize') and not params.get('progressive') and params.get('quality') != 'keep')
+
+
+# helper function to run the band encoders on threads, and write what they return in the order of the bands.
+def _write_bands(fp, encode_band, band_count, workers):
+    """Writes encode_band(index) of every band to 'fp' in order, returns the list of their other results.
+
+    encode_band(index) returns a tuple (data, result), the bands ahead of the one being written are limited,
+    so the encoded bands waiting take a bounded memory.
+
+    """
+    import concurrent.futures
+
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-slice-encode') \
+            as executor:
+        futures = collections.deque()
+        next_band = 0
+        while next_band < band_count or futures:
+            while next_band < band_count and len(futures) < workers * 2:
+                futures.append(executor.submit(encode_band, next_band))
+                next_band += 1
+            data, result = futures.popleft().result()
+            fp.write(data)
+            results.append(result)
+    return results
+
+
+# helper function to make a PNG chunk.
+def _png_chunk(chunk_type, data):
+    import struct
+    import zlib
+
+    checksum = zlib.crc32(data, zlib.crc32(chunk_type))
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', checksum)
+
+
+# helper function to combine the Adler-32 of 2 pieces of data to the one of both, like zlib's adler32_combine().
+def _adler32_combine(adler1, adler2, length2):
+    base = 65521
+    remainder = length2 % base
+    sum1 = ((adler1 & 0xffff) + (adler2 & 0xffff) + base - 1) % base
+    sum2 = (remainder * (adler1 & 0xffff) + (adler1 >> 16) + (adler2 >> 16) + base - remainder) % base
+    return (sum2 << 16) | sum1
+
+
+# helper function to save a PNG, the rows deflated in bands on threads, see save_parallel().
+def _save_png_bands(image, fp, workers, params):
+    import struct
+    import zlib
+
+    rawmode, bit_depth, color_type = _PNG_BAND_MODES[image.mode]
+    width, height = image.size
+    # the bytes of a row, from a 1px high image of the mode.
+    row_bytes = len(Image.new(image.mode, (width, 1)).tobytes('raw', rawmode))
+    level = 9 if params.get('optimize') else params.get('compress_level', 6)
+    # the Up filter, the difference to the row above, suits a photo, not the indexes of a palette or packed bits.
+    filter_type = 2 if bit_depth >= 8 and image.mode != 'P' else 0
+    band_rows = max(1, _PARALLEL_BAND_BYTES // row_bytes)
+    # the rows above a band, whose filtered bytes are the dictionary of the band, the 32 KB window of deflate.
+    dictionary_rows = -(-32768 // (row_bytes + 1))
+    band_count = -(-height // band_rows)
+
+    def encode_band(index):
+        upper, bottom = index * band_rows, min(height, (index + 1) * band_rows)
+        dictionary_upper = max(0, upper - dictionary_rows)
+        # 1 more row above, for the Up filter of the first row.
+        first = max(0, dictionary_upper - 1) if filter_type else dictionary_upper
+        rows = Image.frombytes('L', (row_bytes, bottom - first),
+                               image.crop((0, first, width, bottom)).tobytes('raw', rawmode))
+        filtered = Image.new('L', (row_bytes + 1, bottom - dictionary_upper), filter_type)
+        if filter_type:
+            above = Image.new('L', rows.size)
+            above.paste(rows.crop((0, 0, row_bytes, rows.height - 1)), (0, 1))
+            rows = ImageChops.subtract_modulo(rows, above).crop((0, dictionary_upper - first, row_bytes, rows.height))
+        filtered.paste(rows, (1, 0))
+        filtered = filtered.tobytes()
+        split = (upper - dictionary_upper) * (row_bytes + 1)
+        data = filtered[split:]
+        options = {'zdict': filtered[max(0, split - 32768):split]} if split else {}
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, **options)
+        # every band but the last ends on a byte boundary, not the end of the stream, so they join.
+        deflated = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if bottom == height
+                                                                else zlib.Z_FULL_FLUSH)
+        return _png_chunk(b'IDAT', deflated), (zlib.adler32(data), len(data))
+
+    fp.write(b'\x89PNG\r\n\x1a\n')
+    fp.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, bit_depth, color_type, 0, 0, 0)))
+    icc_profile = params.get('icc_profile', image.info.get('icc_profile'))
+    if icc_profile:
+        fp.write(_png_chunk(b'iCCP', b'ICC Profile\x00\x00' + zlib.compress(icc_profile)))
+    transparency = params.get('transparency', image.info.get('transparency'))
+    if image.mode == 'P':
+        palette = bytes(image.getpalette('RGB') or [])
+        fp.write(_png_chunk(b'PLTE', palette))
+        if isinstance(transparency, int):
+            transparency = b'\xff' * transparency + b'\x00'
+        if isinstance(transparency, bytes):
+            fp.write(_png_chunk(b'tRNS', transparency[:len(palette) // 3]))
+    elif image.mode in ('L', 'I;16') and isinstance(transparency, int):
+        fp.write(_png_chunk(b'tRNS', struct.pack('>H', transparency)))
+    elif image.mode == 'RGB' and isinstance(transparency, tuple):
+        fp.write(_png_chunk(b'tRNS', struct.pack('>HHH', *transparency)))
+    dpi = params.get('dpi')
+    if dpi:
+        fp.write(_png_chunk(b'pHYs', struct.pack('>IIB', int(dpi[0] / 0.0254 + 0.5), int(dpi[1] / 0.0254 + 0.5), 1)))
+    exif = params.get('exif')
+    if exif:
+        exif = exif.tobytes() if isinstance(exif, Image.Exif) else exif
+        fp.write(_png_chunk(b'eXIf', exif[6:] if exif.startswith(b'Exif\x00\x00') else exif))
+
+    # the zlib header, the bands, and the checksum of all the bands, each in a IDAT chunk, they are continuous.
+    fp.write(_png_chunk(b'IDAT', b'\x78' + bytes([{0: 0x01, 1: 0x01, 2: 0x5e, 3: 0x5e, 4: 0x5e, 5: 0x5e}.get(
+        level, 0xda if level > 6 else 0x9c)])))
+    checksum = 1
+    for band_checksum, band_length in _write_bands(fp, encode_band, band_count, workers):
+        checksum = _adler32_combine(checksum, band_checksum, band_length)
+    fp.write(_png_chunk(b'IDAT', struct.pack('>I', checksum)))
+    fp.write(_png_chunk(b'IEND', b''))
+
+
+# helper function to save a JPEG, the bands encoded on threads and joined by restart markers, see save_parallel().
+def _save_jpeg_bands(image, fp, workers, params):
+    import struct
+
+    width, height = image.size
+    # a multiple of 16 rows, the tallest MCU of PIL's subsamplings, and a restart interval of at most 65535 MCUs,
+    # the MCUs are at least 8*8px.
+    max_rows = _JPEG_MAX_RESTART_INTERVAL // -(-width // 8) * 8 // 16 * 16
+    band_rows = min(max(16, _PARALLEL_BAND_BYTES // (width * len(image.getbands())) // 16 * 16), max_rows)
+    if not max_rows or band_rows >= height:
+        image.save(fp, format='JPEG', **params)
+        return
+    band_count = -(-height // band_rows)
+    band_params = dict((key, value) for key, value in params.items() if key not in ('icc_profile', 'dpi', 'exif'))
+
+    def encode_band(index):
+        band = image.crop((0, index * band_rows, width, min(height, (index + 1) * band_rows)))
+        buffer = io.BytesIO()
+        # the metadata goes to the header, the one of the first band.
+        band.save(buffer, format='JPEG', **(params if index == 0 else band_params))
+        data = buffer.getvalue()
+        scan_offset, sos_offset, sof_offset = _jpeg_segment_offsets(data)
+        # the entropy-coded data, without the EOI marker at the end, and the restart marker to the next band.
+        scan = data[scan_offset:-2]
+        if index < band_count - 1:
+            scan += bytes([0xff, 0xd0 + index % 8])
+        return scan, (data[:scan_offset], sos_offset, sof_offset)
+
+    # the first band first, it's header tells the MCU size, it's patched to the whole image and a restart interval.
+    first_scan, (header, sos_offset, sof_offset) = encode_band(0)
+    sampling = [header[sof_offset + 11 + 3 * component] for component in range(header[sof_offset + 9])]
+    mcu_width, mcu_height = 8 * max(factor >> 4 for factor in sampling), 8 * max(factor & 15 for factor in sampling)
+    if len(sampling) == 1:
+        # a scan of 1 component is not interleaved, it's MCU is 1 block whatever it's sampling factors.
+        mcu_width = mcu_height = 8
+    restart_interval = band_rows // mcu_height * -(-width // mcu_width)
+    fp.write(header[:sof_offset + 5] + struct.pack('>H', height) + header[sof_offset + 7:sos_offset]
+             + b'\xff\xdd\x00\x04' + struct.pack('>H', restart_interval) + header[sos_offset:])
+    fp.write(first_scan)
+    _write_bands(fp, lambda index: encode_band(index + 1), band_count - 1, workers)
+    fp.write(b'\xff\xd9')
+
+
+# helper function to find the segments of a JPEG PIL encoded.
+def _jpeg_segment_offsets(data):
+    """Returns the offsets of the entropy-coded data (after the SOS segment), the SOS marker and the SOF marker."""
+    import struct
+
+    offset = 2
+    sof_offset = None
+    while True:
+        marker = data[offset + 1]
+        length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+        if marker in (0xc0, 0xc1):
+            sof_offset = offset
+        if marker == 0xda:
+            return offset + 2 + length, offset, sof_offset
+        offset += 2 + length
+
+
+# Public API: Slice specs, slice jobs and the worker service
+
+# helper function to slice a image by a spec dict, so a slice can be described by data, like a JSON job.
+def slice_by_spec(image, spec):
+    """Slices a image by a spec, a dict which describes how to slice.
+
+    A spec is a dict like one of these:
+        {'mode': 'horizontal', 'method': 'equal', 'param': 3}
+        {'mode': 'vertical', 'method': 'ratio', 'param': '3:2:1'}
+        {'mode': 'grid', 'horizontal_mode': 'step', 'horizontal_param': 256,
+                         'vertical_mode': 'step', 'vertical_param': 256}
+        {'mode': 'grid', 'grid': '3x2'}
+        {'mode': 'auto', 'tolerance': 8, 'min_gap': 2}
+    'mode' can also be the short form 'h', 'v' or 'g', like the command-line.
+    'auto' slices a sprite sheet along the grid detected from it's separator lines, see slice_by_detected_grid(),
+    'tolerance' and 'min_gap' are optional.
+    A optional 'scale' key slices a reduced preview, see reduce_image().
+    A optional 'trim' key (True) slices only the content inside the empty borders, with a optional 'trim_tolerance',
+    see content_box(), it's not for 'auto'.
+
+    Args:
+        image:
+            a string to the image path, or a PIL Image object.
+        spec:
+            a dict, the spec described above.
+
+    Returns:
+        A list of PIL Image objects for 'horizontal' and 'vertical', a list of list of PIL Image objects for 'grid',
+        the same as the slice functions of the mode.
+
+    Raises:
+        TypeError:
+            If 'spec' is not a dict, or the params are not the required type of the method.
+        ValueError:
+            If 'mode' or 'method' is unknown, or the params are not valid.
+        IOError:
+            If PIL cannot open the image from the path in the 'image'.
+
+    """
+    if not isinstance(spec, dict):
+        raise TypeError("'spec' should be a dict, like {'mode': 'horizontal', 'method': 'equal', 'param': 3}.")
+    mode = spec.get('mode')
+    scale = spec.get('scale', 1.0)
+    trim = {'trim': bool(spec.get('trim')), 'trim_tolerance': spec.get('trim_tolerance', 0)}
+    if mode in ['horizontal', 'h', 'vertical', 'v']:
+        direction = 'horizontal' if mode in ['horizontal', 'h'] else 'vertical'
+        method = spec.get('method')
+        if method not in ['equal', 'step', 'ratio']:
+            raise ValueError("Spec 'method' should either be one of the 3 values: equal, step, ratio .")
+        return _slice_image_one_direction(image, scale=scale, **dict(
+            _one_direction_arguments(direction, method, spec.get('param')), **trim))
+    elif mode in ['grid', 'g'] and spec.get('grid'):
+        # the shortcut grid string, equal slice in both directions.
+        horizontal_count, vertical_count = parse_grid_string(spec['grid'])
+        return slice_to_grid(image, 'equal', horizontal_count, 'equal', vertical_count, scale=scale, **trim)
+    elif mode in ['grid', 'g']:
+        return slice_to_grid(image, spec.get('horizontal_mode'), spec.get('horizontal_param'),
+                             spec.get('vertical_mode'), spec.get('vertical_param'), scale=scale, **trim)
+    elif mode == 'auto':
+        _compile_spec_dict(spec)
+        return slice_by_detected_grid(image, spec.get('tolerance', 0), spec.get('min_gap', 1), scale=scale)
+    else:
+        raise ValueError("Spec 'mode' should either be one of the 4 values: horizontal, vertical, grid, auto .")
+
+
+# helper function to compile the directions of a spec dict, see slice_by_spec().
+def _compile_spec_dict(spec):
+    """Returns (horizontal SliceSpec, vertical SliceSpec) of a spec dict, None for a direction it does not slice.
+
+    A 'auto' spec is detected from the pixels, not planned by the size, it's validated and has no SliceSpec.
+
+    """
+    if not isinstance(spec, dict):
+        raise TypeError("'spec' should be a dict, like {'mode': 'horizontal', 'method': 'equal', 'param': 3}.")
+    mode = spec.get('mode')
+    if mode in ['horizontal', 'h', 'vertical', 'v']:
+        compiled = compile_slice_spec(spec.get('method'), spec.get('param'))
+        return (compiled, None) if mode in ['horizontal', 'h'] else (None, compiled)
+    elif mode in ['grid', 'g'] and spec.get('grid'):
+        horizontal_count, vertical_count = parse_grid_string(spec['grid'])
+        return compile_slice_spec('equal', horizontal_count), compile_slice_spec('equal', vertical_count)
+    elif mode in ['grid', 'g']:
+        return (compile_slice_spec(spec.get('horizontal_mode'), spec.get('horizontal_param')),
+                compile_slice_spec(spec.get('vertical_mode'), spec.get('vertical_param')))
+    elif mode == 'auto':
+        tolerance, min_gap = spec.get('tolerance', 0), spec.get('min_gap', 1)
+        if not isinstance(tolerance, int) or tolerance < 0 or not isinstance(min_gap, int) or min_gap < 1:
+            raise ValueError("'tolerance' should be a int of 0 or more, 'min_gap' a int of 1 or more.")
+        if spec.get('trim'):
+            raise ValueError("'trim' is not for a 'auto' spec, the gutters are detected on the whole image.")
+        return None, None
+    else:
+        raise ValueError("Spec 'mode' should either be one of the 4 values: horizontal, vertical, grid, auto .")
+
+
+# helper function to plan the tiles of a spec without cropping them, so they can be cropped one at a time.
+def _plan_spec_tiles(image, spec, out_name):
+    """Plans the tiles of 'spec' on 'image', returns (img, [(file name without ext, crop box, full size box), ...]).
+
+    'img' is the (maybe reduced) image the boxes are on, the file names are the same as the save functions give,
+    like 'out_name_2' or 'out_name_1_3', in the same sequence.
+
+    """
+    horizontal_spec, vertical_spec = _compile_spec_dict(spec)
+    scale = spec.get('scale', 1.0)
+    img = _open_image(image)
+    plan_width, plan_height = img.size
+    auto_grid = spec.get('mode') == 'auto'
+    # detected on the full size image, before it's reduced, trimmed on the reduced one, see _plan_content_offsets().
+    if auto_grid:
+        column_offsets, row_offsets = detect_grid(img, spec.get('tolerance', 0), spec.get('min_gap', 1))
+        img = _reduce_image(img, scale, img is not image)
+    else:
+        reduced = _reduce_image(img, scale, img is not image)
+        column_offsets, row_offsets = _plan_content_offsets(img, horizontal_spec, vertical_spec, spec.get('trim'),
+                                                            spec.get('trim_tolerance', 0), (plan_width, plan_height))
+        img = reduced
+    tiles = []
+    plan_boxes = _grid_boxes((plan_width, plan_height), column_offsets, row_offsets, plan_width, plan_height)
+    for row_index, row in enumerate(_grid_boxes(img.size, column_offsets, row_offsets, plan_width, plan_height,
+                                                scale), 1):
+        for col_index, box in enumerate(row, 1):
+            if auto_grid or (horizontal_spec and vertical_spec):
+                name = out_name + '_' + str(row_index) + '_' + str(col_index)
+            else:
+                name = out_name + '_' + str(col_index if horizontal_spec else row_index)
+            tiles.append((name, box, plan_boxes[row_index - 1][col_index - 1]))
+    return img, tiles
+
+
+# helper function to list the file names (without ext) the save functions give to a output of the slice functions.
+def _slice_file_names(output_slices, out_name):
+    """Returns a list of (file name without ext, PIL Image), in the same naming and sequence as the save functions."""
+    named_slices = []
+    for row_index, row in enumerate(output_slices, 1):
+        if isinstance(row, list):
+            for col_index, image_slice in enumerate(row, 1):
+                named_slices.append((out_name + '_' + str(row_index) + '_' + str(col_index), image_slice))
+        else:
+            named_slices.append((out_name + '_' + str(row_index), row))
+    return named_slices
+
+
+# helper function to convert the output slices to a output format, used when the source cannot be converted first.
+def _convert_slices_for_format(output_slices, out_format):
+    """Converts every slice in a output of the slice functions by convert_image_for_format(), keeps the structure."""
+    if isinstance(output_slices[0], list):
+        return [[convert_image_for_format(s, out_format) for s in row] for row in output_slices]
+    return [convert_image_for_format(s, out_format) for s in output_slices]
+
+
+# helper function to slice a image by a spec, for a output format, the mode conversion is done as few as possible.
+def _slice_for_format(image, spec, pil_format):
+    """Slices 'image' by 'spec' (see slice_by_spec()), converted for 'pil_format' (None means no conversion).
+
+    The mode conversion is done once on the source, or on the slices of a scaled preview,
+    so the source can still be decoded in a reduced size. They are small, it costs the same.
+
+    """
+    scale = spec.get('scale', 1.0)
+    if pil_format and scale == 1.0:
+        image = convert_image_for_format(image, pil_format)
+    output_slices = slice_by_spec(image, spec)
+    if pil_format and scale != 1.0:
+        output_slices = _convert_slices_for_format(output_slices, pil_format)
+    return output_slices
+
+
+# helper function to save a output of the slice functions, a list or a grid, with the proper save function.
+def _save_output_slices(output_slices, out_dir, out_name, out_ext, out_format=None, **options):
+    """Saves a list by save_image_list(), or a list of list by save_image_grid(), 'options' are passed to them."""
+    if isinstance(output_slices[0], list):
+        save_image_grid(output_slices, out_dir, out_name, out_ext, out_format, **options)
+    else:
+        save_image_list(output_slices, out_dir, out_name, out_ext, out_format, **options)
+
+
+# slice a image in several ways, decode it once.
+def slice_multi_spec(image, specs, out_format=None):
+    """Slices a image by several specs, like a 3x2 grid, 256px tiles and a 3:2:1 vertical split, decoding it once.
+
+    Each call of a slice function with a path opens and decodes the image again, this function decodes it once,
+    and all the specs are sliced from the same decoded image.
+
+    For example:
+        grid, tiles, strips = slice_multi_spec('photo.jpg', [
+            {'mode': 'grid', 'horizontal_mode': 'equal', 'horizontal_param': 3,
+                             'vertical_mode': 'equal', 'vertical_param': 2},
+            {'mode': 'grid', 'horizontal_mode': 'step', 'horizontal_param': 256,
+                             'vertical_mode': 'step', 'vertical_param': 256},
+            {'mode': 'vertical', 'method': 'ratio', 'param': '3:2:1'}])
+
+    Args:
+        image:
+            a string to the image path, or a PIL Image object.
+        specs:
+            a list of specs, each is a dict, see slice_by_spec().
+        out_format:
+            Optional, a ext name or PIL format name, the decoded image is converted once for this output format,
+            see convert_image_for_format().
+
+    Returns:
+        A list, the output of each spec, in the same sequence of 'specs'.
+        Each output is a list of PIL Image objects or a list of list of PIL Image objects, like the slice functions.
+
+    Raises:
+        TypeError, ValueError, IOError:
+            The same as slice_by_spec().
+
+    """
+    if not isinstance(specs, (list, tuple)) or not specs:
+        raise TypeError("'specs' should be a non-empty list of spec dicts, see slice_by_spec().")
+    img = _open_image(image)
+    # decode it once, here, every spec crops from the same decoded image.
+    if out_format:
+        img = convert_image_for_format(img, out_format)
+    img.load()
+    return [slice_by_spec(img, spec) for spec in specs]
+
+
+# helper function to get the name of a spec in a multi-spec output, it's a part of the output file names.
+def _spec_layout_name(spec, index):
+    """Returns the 'name' of 'spec', or it's 1-based index in the list of specs if it has no name."""
+    return str(spec.get('name') or index + 1)
+
+
+# save the outputs of several specs in one parallel pass.
+def save_multi_spec(outputs, specs, out_dir, out_name, out_ext, out_format=None, workers=0, skip_names=None,
+                    on_saved=None, tile_manifest=None, metadata=None, executor=None):
+    """Saves the outputs of slice_multi_spec(), encoding all the slices of all the specs in one parallel pass.
+
+    The slices of each spec are named like the save functions do, with the name of the spec after 'out_name',
+    like 'photo_tiles_1_2.jpg' for a spec named 'tiles'. A spec without a 'name' is named by it's 1-based index.
+
+    The slices are encoded and written by a pool of threads, PIL releases the GIL when it encodes,
+    so the slices are encoded in parallel. Or they are encoded by a pool of processes, and written here.
+
+    Args:
+        outputs:
+            a list, the output of slice_multi_spec().
+        specs:
+            a list of specs, the same as the one passed to slice_multi_spec().
+        out_dir:
+            A valid path string, to where the files would be written to.
+            Or a sink, like a archive or a object storage, see open_sink(). The caller flushes and closes it.
+        out_name:
+            A string, the file name prefix.
+        out_ext:
+            The file extension name, like jpg, png, ...
+        out_format:
+            Optional, the PIL format name to encode the images with, see save_image_list().
+        workers:
+            Optional, a int, the number of threads (or processes), 1 means no thread.
+            0 means the number of the tuning profile of the machine, see tune(), or the number of CPUs.
+        skip_names:
+            Optional, a container of file names which are already saved, see save_image_list().
+        on_saved:
+            Optional, a function called with the file name after each file is saved, see save_image_list().
+            It's called from the threads.
+        tile_manifest:
+            Optional, a TileManifest, each saved file is recorded in it, see save_image_list().
+        metadata:
+            Optional, the metadata of the source to give every file, see save_image_list().
+        executor:
+            Optional, 'thread' or 'process', what encodes the slices, the one of the tuning profile if omitted,
+            or 'thread' without one.
+
+    Returns:
+        All the slices of all the specs are saved to 'out_dir'.
+
+    Raises:
+        ValueError:
+            If the output format could not be determined from the 'out_ext'.
+        IOError:
+            If the file could not be written. (from PIL)
+
+    """
+    assert len(outputs) == len(specs)
+    pil_format = out_format or get_pil_format_from_ext_name(out_ext)
+    save_params = _metadata_save_params(metadata, pil_format)
+
+    # all the slices of all the specs, in one list.
+    named_slices = []
+    for index, output_slices in enumerate(outputs):
+        layout_name = out_name + '_' + _spec_layout_name(specs[index], index)
+        for name, image_slice in _slice_file_names(output_slices, layout_name):
+            file_name = name + '.' + out_ext
+            if not (skip_names and file_name in skip_names):
+                named_slices.append((file_name, image_slice))
+
+    def save_one(named_slice):
+        _save_to_output(out_dir, named_slice[0], named_slice[1], pil_format, on_saved, tile_manifest, save_params)
+
+    workers = workers or _tuned('encode_workers', 0) or os.cpu_count() or 1
+    executor = _executor_type(executor)
+    if workers == 1:
+        for named_slice in named_slices:
+            save_one(named_slice)
+    elif executor == 'process':
+        import concurrent.futures
+
+        # the slices are pickled to the processes, the encoded bytes come back and are written here, in order.
+        save_params = _encoder_params(pil_format, save_params)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_encode_image, image_slice, pil_format, **save_params)
+                       for _, image_slice in named_slices]
+            for (file_name, image_slice), future in zip(named_slices, futures):
+                _write_encoded_to_output(out_dir, file_name, future.result(), slice_box(image_slice),
+                                         image_slice.size, on_saved, tile_manifest)
+    else:
+        import concurrent.futures
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            # list() to raise the first error, if any.
+            list(pool.map(save_one, named_slices))
+
+
+# helper function to load a spec file, a JSON file of a list of specs.
+def load_spec_file(path):
+    """Loads a JSON spec file, which describes several ways to slice a image, for slice_multi_spec().
+
+    The file is a JSON list of specs (see slice_by_spec()), or a object with the list in a "specs" key, like this:
+        {"specs": [
+            {"name": "grid", "mode": "grid", "horizontal_mode": "equal", "horizontal_param": 3,
+                                             "vertical_mode": "equal", "vertical_param": 2},
+            {"name": "tiles", "mode": "grid", "horizontal_mode": "step", "horizontal_param": 256,
+                                              "vertical_mode": "step", "vertical_param": 256},
+            {"name": "strips", "mode": "vertical", "method": "ratio", "param": "3:2:1"}]}
+
+    Returns:
+        A list of spec dicts.
+
+    Raises:
+        IOError:
+            If the file cannot be read.
+        ValueError:
+            If it's not valid JSON, or not a non-empty list of specs.
+
+    """
+    with open(path, 'r', encoding='utf-8') as spec_file:
+        specs = json.load(spec_file)
+    if isinstance(specs, dict):
+        specs = specs.get('specs')
+    if not isinstance(specs, list) or not specs or not all(isinstance(spec, dict) for spec in specs):
+        raise ValueError("Spec file '" + path + "' should be a JSON list of specs, or a object with a 'specs' list.")
+    return specs
+
+
+# helper function to encode a image into bytes in memory.
+def _encode_image(image, pil_format, **params):
+    """Encodes a PIL image to 'pil_format' in memory, returns the encoded bytes."""
+    buffer = io.BytesIO()
+    _save_image(image, buffer, pil_format, params)
+    return buffer.getvalue()
+
+
+# helper function to add the encoder options of the tuning profile to the save params of a format.
+def _encoder_params(pil_format, params):
+    """Returns 'params' with the encoder options of 'pil_format' in the tuning profile (see tune()) under them."""
+    options = _tuned('encoder_options', {}).get(pil_format.upper())
+    if not options:
+        return params
+    merged = dict(options)
+    merged.update(params)
+    return merged
+
+
+# run one slice job, it's the unit of work of the worker service, it must be a module level function for the pool.
+def run_slice_job(job):
+    """Runs a slice job, a dict which describes the source, how to slice, and where the output goes.
+
+    A job is a slice spec (see slice_by_spec()) with a source and output options, like this:
+        {'source': '/data/map.tif',
+         'mode': 'grid', 'horizontal_mode': 'step', 'horizontal_param': 256,
+                         'vertical_mode': 'step', 'vertical_param': 256,
+         'output': {'dir': '/data/tiles', 'name': 'map', 'format': 'webp'}}
+
+    Source:
+        'source' is a path to the image, or 'source_base64' is the base64 encoded bytes of a image file.
+    Output:
+        'dir' is where the slices are written to, they are named like the command-line does.
+        'name' is the file name prefix, default to the source file name, or 'slice' for bytes.
+        'format' is the output format, default to the source format. The mode is converted once on the source.
+        If 'dir' is omitted, or 'return' is 'bytes', nothing is written, the encoded slices are returned instead.
+
+    Args:
+        job:
+            a dict, the job described above.
+
+    Returns:
+        A dict, like this:
+            {'tile_count': 6, 'seconds': 0.42, 'tiles': ['/data/tiles/map_1_1.webp', ...]}
+        If the slices are returned as bytes, each element of 'tiles' is a dict:
+            {'name': 'map_1_1.webp', 'data': '<base64 encoded bytes>'}
+
+    Raises:
+        TypeError, ValueError, IOError:
+            If the job is invalid, see slice_by_spec() and the slice functions.
+
+    """
+    started = time.time()
+    if not isinstance(job, dict):
+        raise TypeError("A slice job should be a dict (a JSON object).")
+
+    # open the source
+    if job.get('source'):
+        img = _open_image(job['source'])
+        default_name, source_ext = split_pure_file_name_from_ext_name(get_file_basename_without_path(job['source']))
+    elif job.get('source_base64'):
+        try:
+            img = Image.open(io.BytesIO(base64.b64decode(job['source_base64'])))
+        except IOError:
+            raise IOError("PIL open file error, 'source_base64' is not a valid image file.")
+        default_name, source_ext = 'slice', (img.format or 'png').lower()
+    else:
+        raise ValueError("A slice job should have a 'source' path or 'source_base64' bytes.")
+
+    output = job.get('output') or {}
+    out_name = output.get('name') or default_name
+    out_ext = (output.get('format') or source_ext).lower().lstrip('.')
+    pil_format = get_pil_format_from_ext_name(out_ext)
+
+    output_slices = _slice_for_format(img, job, pil_format if output.get('format') else None)
+
+    named_slices = _slice_file_names(output_slices, out_name)
+    if output.get('dir') and output.get('return') != 'bytes':
+        _save_output_slices(output_slices, output['dir'], out_name, out_ext, pil_format)
+        tiles = [os.path.join(output['dir'], name + '.' + out_ext) for name, image_slice in named_slices]
+    else:
+        tiles = [{'name': name + '.' + out_ext,
+                  'data': base64.b64encode(_encode_image(image_slice, pil_format)).decode('ascii')}
+                 for name, image_slice in named_slices]
+    return {'tile_count': len(tiles), 'seconds': round(time.time() - started, 4), 'tiles': tiles}
+
+
+# submit a job to the process pool of the service, wait for it, and keep the stats.
+def _submit_slice_job(service, job):
+    """Runs a job on the pool of a service (see serve()), returns a tuple of (http status, response dict)."""
+    with service['lock']:
+        service['submitted'] += 1
+    future = service['executor'].submit(run_slice_job, job)
+    try:
+        result = future.result()
+    except (TypeError, ValueError, IOError, KeyError) as e:
+        # a bad job, it's the client's fault.
+        with service['lock']:
+            service['failed'] += 1
+        return 400, {'error': str(e)}
+    except Exception as e:
+        with service['lock']:
+            service['failed'] += 1
+        return 500, {'error': repr(e)}
+    with service['lock']:
+        service['completed'] += 1
+        service['tiles'] += result['tile_count']
+        service['busy_seconds'] += result['seconds']
+    return 200, result
+
+
+# the stats of a service, for sizing the pool.
+def _slice_service_stats(service):
+    """Returns the queue depth and throughput stats of a service (see serve()) as a dict."""
+    with service['lock']:
+        uptime = max(time.time() - service['started'], 1e-9)
+        finished = service['completed'] + service['failed']
+        pending = service['submitted'] - finished
+        return {
+            'workers': service['workers'],
+            # jobs submitted but not finished, running ones included.
+            'pending': pending,
+            # jobs waiting for a free worker, if it keeps growing, the pool is too small.
+            'queue_depth': max(0, pending - service['workers']),
+            'submitted': service['submitted'],
+            'completed': service['completed'],
+            'failed': service['failed'],
+            'tiles': service['tiles'],
+            'uptime_seconds': round(uptime, 3),
+            'jobs_per_second': round(service['completed'] / uptime, 4),
+            'tiles_per_second': round(service['tiles'] / uptime, 4),
+            'average_job_seconds': round(service['busy_seconds'] / service['completed'], 4)
+            if service['completed'] else 0.0,
+            # how busy the pool is, 1.0 means every worker was busy all the time.
+            'utilization': round(service['busy_seconds'] / (uptime * service['workers']), 4),
+        }
+
+
+# build the HTTP server of the worker service, the http modules are imported here, only the service needs them.
+def _slice_service_server(host, port, unix_socket):
+    """Returns a threading HTTP server of the worker service, on 'unix_socket' if it's not empty, or 'host':'port'."""
+    import http.server
+    import socketserver
+
+    class _SliceJobRequestHandler(http.server.BaseHTTPRequestHandler):
+        """HTTP handler of the worker service: POST /jobs runs a job, GET /stats returns the stats."""
+
+        # HTTP/1.1, so a client can keep the connection alive between jobs.
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._send_json(200, _slice_service_stats(self.server.slice_service))
+            elif self.path == '/health':
+                self._send_json(200, {'status': 'ok'})
+            else:
+                self._send_json(404, {'error': 'Unknown path, use POST /jobs, GET /stats or GET /health.'})
+
+        def do_POST(self):
+            if self.path != '/jobs':
+                self._send_json(404, {'error': 'Unknown path, use POST /jobs, GET /stats or GET /health.'})
+                return
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            try:
+                job = json.loads(body.decode('utf-8'))
+            except ValueError:
+                self._send_json(400, {'error': 'The request body should be a JSON slice job.'})
+                return
+            status, response = _submit_slice_job(self.server.slice_service, job)
+            self._send_json(status, response)
+
+        def _send_json(self, status, response):
+            body = json.dumps(response).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def address_string(self):
+            # a unix socket client has no address.
+            return str(self.client_address[0]) if self.client_address else 'local'
+
+        def log_message(self, format, *args):
+            if not self.server.slice_service['quiet']:
+                http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        """The HTTP server of the worker service on a unix socket."""
+        daemon_threads = True
+
+    if unix_socket:
+        return _ThreadingUnixHTTPServer(unix_socket, _SliceJobRequestHandler)
+    return http.server.ThreadingHTTPServer((host, port), _SliceJobRequestHandler)
+
+
+# run the worker service.
+def serve(host='127.0.0.1', port=8765, unix_socket='', workers=0, quiet=False, image_cache_bytes=0):
+    """Runs a long-lived slicing service, until it's interrupted (Ctrl+C).
+
+    The service accepts slice jobs by HTTP, on a local port or a unix socket, and runs them on a process pool,
+    so the python startup, the argument parsing and the PIL imports are paid once, not once for every image.
+
+    API:
+        POST /jobs      the body is a JSON slice job (see run_slice_job()), the response is the JSON result of it.
+                        The request returns when the job is done, send concurrent requests to use all the workers.
+        GET /stats      queue depth and throughput stats, like the jobs waiting for a worker, jobs per second,
+                        tiles per second and the pool utilization, use them to size the pool.
+        GET /health     returns {"status": "ok"}
+
+    For example:
+        serve(unix_socket='/tmp/image-slice.sock', workers=4), then:
+        curl --unix-socket /tmp/image-slice.sock -d '{"source": "a.jpg", "mode": "v", "method": "equal",
+             "param": 3, "output": {"dir": "/tmp"}}' http://localhost/jobs
+
+    Args:
+        host:
+            a string, the host to listen on, default to localhost only.
+        port:
+            a int, the port to listen on.
+        unix_socket:
+            a path string, listen on this unix socket instead of 'host' and 'port' if it's not empty.
+        workers:
+            a int, how many worker processes in the pool, 0 means the number of CPUs.
+        quiet:
+            True to not log every request.
+        image_cache_bytes:
+            a int, enable the decoded image cache of this budget in each worker (see enable_image_cache()),
+            for jobs which slice the same source in several ways. 0 means disabled.
+
+    """
+    import concurrent.futures
+
+    workers = workers or os.cpu_count() or 1
+    service = {
+        'executor': concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=enable_image_cache if image_cache_bytes else None,
+            initargs=(image_cache_bytes,) if image_cache_bytes else ()),
+        'workers': workers,
+        'lock': threading.Lock(),
+        'quiet': quiet,
+        'started': time.time(),
+        'submitted': 0,
+        'completed': 0,
+        'failed': 0,
+        'tiles': 0,
+        'busy_seconds': 0.0,
+    }
+    if unix_socket and os.path.exists(unix_socket):
+        os.remove(unix_socket)
+    server = _slice_service_server(host, port, unix_socket)
+    if unix_socket:
+        print('Slice service listening on unix socket ' + unix_socket + ', ' + str(workers) + ' workers.')
+    else:
+        print('Slice service listening on http://' + host + ':' + str(port) + ', ' + str(workers) + ' workers.')
+    server.slice_service = service
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service['executor'].shutdown()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+    return 0
+
+
+# Public API: Batch slicing and the job manifest
+
+# the ext names of the files a batch slices in a directory.
+_BATCH_IMAGE_EXT_NAMES = ('jpg', 'jpeg', 'jpe', 'png', 'webp', 'gif', 'bmp', 'tif', 'tiff', 'ppm', 'pgm')
+
+
+# helper function to list the image files in a directory, in a stable order.
+def list_image_files(directory):
+    """Lists the image files in a directory and all it's sub directories, in a stable (sorted) order.
+
+    The files are yielded one by one while the directory is walked, so a directory of millions of images can be
+    processed without listing it all first. The images are recognized by their ext names, like jpg, png, ...
+
+    Args:
+        directory: a path string to a directory.
+
+    Returns:
+        A generator of path strings, like 'directory/sub_dir/image.jpg'.
+
+    """
+    for root, dir_names, file_names in os.walk(directory):
+        # sort in place, so os.walk walks the sub directories in order too.
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            if file_name.rsplit('.', 1)[-1].lower() in _BATCH_IMAGE_EXT_NAMES:
+                yield os.path.join(root, file_name)
+
+
+class SliceJobManifest(object):
+    """A append-only log of a batch slicing job, so a interrupted job is resumed instead of restarted.
+
+    Each line of the log is a JSON record, a source is recorded when it's started, each tile when it's saved,
+    and the source again when all of it's tiles are saved:
+        {"event": "source", "key": "...", "source": "scans/a.tif", "spec": {...}}
+        {"event": "tile", "key": "...", "tile": "a_1_1.webp"}
+        {"event": "done", "key": "...", "source": "scans/a.tif", "tiles": 6}
+
+    A source is identified by a key of it's path, modification time, size and the slice spec,
+    so a source which is changed, or sliced in another way, is not mistaken as done.
+
+    The records are flushed one by one, not synced, the tiles are written atomically and rewriting one is harmless,
+    so a record lost in a system crash only costs the tile to be saved again. A line torn by a interruption is ignored.
+
+    For example:
+        with SliceJobManifest('job.log') as manifest:
+            key = manifest.source_key('a.tif', spec)
+            if not manifest.is_done(key):
+                ...save the tiles not in manifest.completed_tiles(key), manifest.record_tile(key, name) each...
+                manifest.record_done(key, 'a.tif', tile_count)
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._done = set()
+        self._tiles = {}
+        self._lock = threading.Lock()
+        torn = False
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as log_file:
+                for line in log_file:
+                    torn = not line.endswith('\n')
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get('event') == 'tile':
+                        self._tiles.setdefault(record['key'], set()).add(record['tile'])
+                    elif record.get('event') == 'done':
+                        self._done.add(record['key'])
+                        self._tiles.pop(record['key'], None)
+        self._file = open(path, 'a', encoding='utf-8')
+        if torn:
+            # end the torn line, or the next record would be glued to it.
+            self._file.write('\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def source_key(source, spec, **output_options):
+        """Returns the key of a source file sliced by 'spec', 'output_options' (like the format) are a part of it."""
+        stat = os.stat(source)
+        identity = json.dumps({'source': os.path.abspath(source), 'mtime': stat.st_mtime_ns, 'size': stat.st_size,
+                               'spec': spec, 'output': output_options}, sort_keys=True)
+        return _hash_hex(identity.encode('utf-8'))
+
+    def is_done(self, key):
+        """True if all the tiles of the source of 'key' are saved."""
+        return key in self._done
+
+    def completed_tiles(self, key):
+        """Returns a set of the file names of the tiles of 'key' already saved, by a interrupted run."""
+        return set(self._tiles.get(key, ()))
+
+    def record_source(self, key, source, spec):
+        self._write({'event': 'source', 'key': key, 'source': source, 'spec': spec})
+
+    def record_tile(self, key, tile_name):
+        with self._lock:
+            self._tiles.setdefault(key, set()).add(tile_name)
+        self._write({'event': 'tile', 'key': key, 'tile': tile_name})
+
+    def record_done(self, key, source, tile_count):
+        with self._lock:
+            self._done.add(key)
+            self._tiles.pop(key, None)
+        self._write({'event': 'done', 'key': key, 'source': source, 'tiles': tile_count})
+
+    def close(self):
+        self._file.close()
+
+    def _write(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+
+
+# helper function to hash bytes to a short hex string, for keys and checksums.
+def _hash_hex(data):
+    import hashlib
+
+    return hashlib.sha1(data).hexdigest()
+
+
+# slice a batch of images the same way, resumable by a job manifest.
+def slice_batch(sources, spec, out_dir, out_format='', manifest_path='', source_root='', tile_manifest=None,
+                keep_metadata=False, keep_exif=False, tile_shard=None):
+    """Slices a batch of images by the same spec, saves the slices, and resumes a interrupted batch.
+
+    With a 'manifest_path', every saved tile and every finished source is recorded in a job manifest
+    (see SliceJobManifest), a rerun of the same batch skips the finished sources, and saves only the missing tiles
+    of a source interrupted halfway. The tiles are always written atomically (a temporary file and a rename),
+    so a interrupted tile is never left truncated.
+
+    For example:
+        slice_batch(list_image_files('scans'), {'mode': 'grid', 'horizontal_mode': 'step', 'horizontal_param': 256,
+                    'vertical_mode': 'step', 'vertical_param': 256}, 'tiles', 'webp', 'job.log', 'scans')
+
+    Args:
+        sources:
+            A iterable of image path strings, like list_image_files() returns.
+        spec:
+            A dict, how to slice each image, see slice_by_spec().
+            Or a list of specs, each image is decoded once and sliced in all these ways, see slice_multi_spec().
+        out_dir:
+            A path string, to where the slices are written, it's created if it does not exist.
+            Or a sink, see open_sink(), the caller closes it.
+        out_format:
+            Optional, a ext name like 'webp', save the slices in this format instead of the format of each source.
+        manifest_path:
+            Optional, a path string of the job manifest, it's created if it does not exist, or resumed if it does.
+        source_root:
+            Optional, a directory path string, the slices of a source under it are written to the same relative
+            sub directory under 'out_dir', so images of the same name in different directories do not collide.
+        tile_manifest:
+            Optional, a TileManifest, every source and every saved tile is recorded in it, the caller closes it.
+        keep_metadata:
+            Optional, True to turn each source upright by it's EXIF orientation before it's sliced
+            (see orient_image()), and give it's ICC profile and DPI to every slice, see image_metadata().
+        keep_exif:
+            Optional, True to give the stripped EXIF of each source to every slice too, it implies 'keep_metadata'.
+        tile_shard:
+            Optional, a tuple (index, count), save only the shard 'index' of the tiles of each source,
+            see shard_tile_range(), to split a huge image across machines. To split a batch of sources,
+            pass shard_sources() as 'sources'.
+
+    Returns:
+        A dict of the counts, like this: {'sliced': 10, 'skipped': 90, 'tiles': 60}
+        'skipped' is the number of sources finished by a previous run, 'tiles' the tiles of the shard.
+
+    Raises:
+        TypeError, ValueError, IOError:
+            If the spec is not valid, a source cannot be opened, or a slice cannot be written.
+            The batch stops, the manifest keeps what is done so far.
+
+    """
+    pil_format = get_pil_format_from_ext_name(out_format) if out_format else None
+    counts = {'sliced': 0, 'skipped': 0, 'tiles': 0}
+    output_options = {'format': out_format}
+    if keep_metadata or keep_exif:
+        # a part of the key, the slices saved without the metadata are not taken as done.
+        output_options['metadata'] = 'exif' if keep_exif else 'icc_profile, dpi'
+    if tile_shard:
+        # a part of the key too, a shard is done when it's own tiles are saved.
+        output_options['tile_shard'] = list(_validate_shard(tile_shard))
+    manifest = SliceJobManifest(manifest_path) if manifest_path else None
+    try:
+        for source in sources:
+            key = manifest.source_key(source, spec, **output_options) if manifest else ''
+            if manifest and manifest.is_done(key):
+                counts['skipped'] += 1
+                continue
+            counts['tiles'] += _slice_and_save_source(source, spec, out_dir, out_format, pil_format, manifest, key,
+                                                      source_root, tile_manifest, keep_metadata, keep_exif,
+                                                      tile_shard)
+            counts['sliced'] += 1
+    finally:
+        if manifest:
+            manifest.close()
+    return counts
+
+
+# helper function to slice a source of a batch, and save the tiles not saved yet.
+def _slice_and_save_source(source, spec, out_dir, out_format, pil_format, manifest, key, source_root,
+                           tile_manifest=None, keep_metadata=False, keep_exif=False, tile_shard=None):
+    """Slices and saves one source of slice_batch(), returns the number of tiles it has (in the shard)."""
+    out_name, out_ext = split_pure_file_name_from_ext_name(get_file_basename_without_path(source))
+    if out_format:
+        out_ext = out_format.lower().lstrip('.')
+    if source_root:
+        # the relative directory is a part of the names, a sink has no directories,
+        # and the names (in the manifests too) are relative to 'out_dir'.
+        relative_dir = os.path.relpath(os.path.dirname(source), source_root)
+        out_name = os.path.normpath(os.path.join(relative_dir, out_name))
+    if isinstance(out_dir, str):
+        os.makedirs(os.path.dirname(os.path.join(out_dir, out_name)) or '.', exist_ok=True)
+
+    options = {}
+    skip_names = set()
+    if manifest:
+        manifest.record_source(key, source, spec)
+        skip_names = manifest.completed_tiles(key)
+        options['on_saved'] = lambda tile_name: manifest.record_tile(key, tile_name)
+    img = _open_image(source)
+    if keep_metadata or keep_exif:
+        # upright first, the slices are planned on the upright image, the metadata is serialized once.
+        img = orient_image(img)
+        options['metadata'] = image_metadata(img, exif=keep_exif)
+    if tile_manifest is not None:
+        tile_manifest.add_source(source, img.size, spec)
+        options['tile_manifest'] = tile_manifest
+
+    if isinstance(spec, list):
+        # several specs, decode once, slice them all.
+        outputs = slice_multi_spec(img, spec, pil_format)
+        names = [name + '.' + out_ext for index, output_slices in enumerate(outputs)
+                 for name, _ in _slice_file_names(output_slices,
+                                                  out_name + '_' + _spec_layout_name(spec[index], index))]
+    else:
+        output_slices = _slice_for_format(img, spec, pil_format)
+        names = [name + '.' + out_ext for name, _ in _slice_file_names(output_slices, out_name)]
+    tile_count = len(names)
+    if tile_shard:
+        skip_names = skip_names | _names_outside_shard(names, tile_shard)
+        tile_count = len(shard_tile_range(len(names), tile_shard))
+    if skip_names:
+        options['skip_names'] = skip_names
+    if isinstance(spec, list):
+        save_multi_spec(outputs, spec, out_dir, out_name, out_ext, pil_format, **options)
+    else:
+        _save_output_slices(output_slices, out_dir, out_name, out_ext, pil_format, **options)
+    if manifest:
+        # a sink may still be uploading, the source is done when all it's tiles are stored.
+        if not isinstance(out_dir, str):
+            out_dir.flush()
+        manifest.record_done(key, source, tile_count)
+    return tile_count
+
+
+# Public API: Sharding, split a job across machines
+
+# parse a shard string of the command-line, like '2/8'.
+def parse_shard_string(shard_string):
+    """Parses a shard string 'INDEX/COUNT', like '2/8', to a tuple (index, count), the index is 0-based.
+
+    Raises:
+        ValueError: If it's not 2 numbers separated by '/', or the index is not in [0, COUNT).
+
+    """
+    index, separator, count = shard_string.partition('/')
+    if not (separator and index.strip().isdigit() and count.strip().isdigit()):
+        raise ValueError("Shard '" + shard_string + "' should be INDEX/COUNT, like 0/4, the INDEX is 0-based.")
+    return _validate_shard((int(index), int(count)))
+
+
+# helper function to validate a shard tuple (index, count).
+def _validate_shard(shard):
+    index, count = shard
+    if not (isinstance(index, int) and isinstance(count, int) and 0 <= index < count):
+        raise ValueError('Shard ' + str(tuple(shard)) + ' should be (index, count), 0 <= index < count.')
+    return index, count
+
+
+def shard_of(key, count):
+    """Returns the shard (0 to count - 1) of a key string, by it's SHA-1, the same on every machine and every run.
+
+    Python's hash() of a string is randomized for each process, so it cannot be used to agree between machines.
+
+    """
+    return int(_hash_hex(key.encode('utf-8'))[:16], 16) % count
+
+
+def shard_sources(sources, shard, source_root=''):
+    """Yields the sources of the shard 'shard' (index, count), so independent machines slice disjoint sources.
+
+    Each source is assigned by the hash of it's path relative to 'source_root' (with '/' separators), not by it's
+    position, so every machine agrees without a coordinator, even if they list the sources in different orders or
+    mount them at different places, and a source added to the batch does not move the other sources.
+    The shards of all the indexes of a count cover every source exactly once, their outputs merge without conflicts.
+
+    For example, on the machine 2 of 4:
+        slice_batch(shard_sources(list_image_files('scans'), (2, 4), 'scans'), spec, 'tiles', source_root='scans')
+
+    Args:
+        sources:
+            A iterable of image path strings, like list_image_files() returns.
+        shard:
+            a tuple (index, count), the index is 0-based, see parse_shard_string().
+        source_root:
+            Optional, a directory path string, the sources are keyed by their paths relative to it.
+
+    """
+    index, count = _validate_shard(shard)
+    for source in sources:
+        key = os.path.relpath(source, source_root) if source_root else source
+        if shard_of(key.replace(os.sep, '/'), count) == index:
+            yield source
+
+
+def shard_tile_range(tile_count, shard):
+    """Returns the range of the tiles (in the sequence they are saved) in the shard 'shard' (index, count).
+
+    It's for splitting a huge image across machines: each shard is a continuous range of the tiles, so a shard of
+    a grid is a band of rows, the shards differ in size by 1 tile at most, and cover every tile exactly once.
+
+    """
+    index, count = _validate_shard(shard)
+    return range(tile_count * index // count, tile_count * (index + 1) // count)
+
+
+# helper function to list the names of the tiles of the other shards, they are skipped by the save functions.
+def _names_outside_shard(names, shard):
+    """Returns a set of the 'names' (in the sequence they are saved) outside the range of 'shard'."""
+    shard_range = shard_tile_range(len(names), shard)
+    return set(names[:shard_range.start]) | set(names[shard_range.stop:])
+
+
+# Public API: Bounded-memory slicing pipeline
+
+# The default number of workers of each stage of slice_pipeline(), 0 means the number of CPUs.
+PIPELINE_STAGE_WORKERS = {'decode': 1, 'crop': 1, 'encode': 0, 'write': 1}
+
+# The end of the items of a pipeline queue, a worker of the next stage stops when it gets one.
+_PIPELINE_END = object()
+
+
+class _MemoryBudget(object):
+    """A budget of bytes shared by the stages of slice_pipeline(), reserve() blocks while it would be exceeded.
+
+    A reservation larger than the whole budget is still granted when nothing else is reserved,
+    so a huge image slows the pipeline down to one image at a time, instead of blocking it forever.
+
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.reserved = 0
+        self.peak = 0
+        self.aborted = False
+        self._condition = threading.Condition()
+
+    def reserve(self, size, wait=True):
+        with self._condition:
+            while wait and self.reserved and self.reserved + size > self.max_bytes and not self.aborted:
+                self._condition.wait()
+            self.reserved += size
+            self.peak = max(self.peak, self.reserved)
+
+    def release(self, size):
+        with self._condition:
+            self.reserved -= size
+            self._condition.notify_all()
+
+    def abort(self):
+        with self._condition:
+            self.aborted = True
+            self._condition.notify_all()
+
+
+def slice_pipeline(sources, spec, out_dir, out_format='', workers=None, queue_size=16,
+                   memory_budget=256 * 1024 * 1024, source_root='', on_saved=None, tile_manifest=None,
+                   keep_metadata=False, keep_exif=False, tile_shard=None, executor=None, tile_order=None,
+                   viewport=None):
+    """Slices and saves a batch of images in a staged pipeline, in a bounded memory.
+
+    The work runs in 4 stages: decode -> crop -> encode -> write, each stage has it's own threads,
+    and they are connected by bounded queues, so a fast stage waits for a slow one instead of piling up
+    the decoded images or the tiles in the memory. PIL releases the GIL when it decodes and encodes.
+
+    Every image reserves the memory of it's decoded pixels and it's tiles from 'memory_budget' before it's decoded,
+    the reservation is released as the image is cropped and it's tiles are written. When the budget is exceeded,
+    the decode stage waits, so the memory of the pipeline stays around 'memory_budget', however fast the images
+    are decoded and however slow the tiles are encoded.
+
+    The tiles are named like the save functions do, written atomically like slice_batch() does.
+
+    For example:
+        slice_pipeline(list_image_files('scans'), {'mode': 'grid', 'grid': '8x8'}, 'tiles', 'webp',
+                       workers={'encode': 8}, memory_budget=512 * 1024 * 1024)
+
+    Args:
+        sources:
+            A iterable of image path strings, like list_image_files() returns.
+        spec:
+            A dict, how to slice each image, see slice_by_spec().
+            Or a list of specs, each image is decoded once and sliced in all these ways, see slice_multi_spec().
+        out_dir:
+            A path string, to where the slices are written, it's created if it does not exist.
+            Or a sink, see open_sink(), it's flushed at the end, the caller closes it.
+        out_format:
+            Optional, a ext name like 'webp', save the slices in this format instead of the format of each source.
+        workers:
+            Optional, a dict of the number of threads of each stage, like {'encode': 8},
+            the stages not in it use PIPELINE_STAGE_WORKERS. 0 means the number of CPUs,
+            but the encode stage of 0 has the number of the tuning profile of the machine first, see tune().
+        queue_size:
+            Optional, a int, how many items each queue between 2 stages holds before the stage before it waits.
+        memory_budget:
+            Optional, a int, the bytes of decoded images and tiles the pipeline holds at most.
+        source_root:
+            Optional, a directory path string, the slices of a source under it are written to the same relative
+            sub directory under 'out_dir', see slice_batch().
+        on_saved:
+            Optional, a function called with the name of each tile (the path relative to 'out_dir') after it's
+            written. It's called from the threads.
+        tile_manifest:
+            Optional, a TileManifest, every source and every written tile is recorded in it, the caller closes it.
+        keep_metadata, keep_exif:
+            Optional, turn each source upright and give it's metadata to every tile, see slice_batch().
+        tile_shard:
+            Optional, a tuple (index, count), only the shard 'index' of the tiles of each source is cropped,
+            encoded and written, see shard_tile_range().
+        executor:
+            Optional, 'thread' or 'process', what encodes the tiles, the one of the tuning profile if omitted,
+            or 'thread' without one. With 'process', each thread of the encode stage hands it's tiles
+            to a pool of as many processes, for the formats which encode holding the GIL.
+        tile_order, viewport:
+            Optional, the order the tiles of each source are cropped in, like a spiral from the viewport of a viewer,
+            see order_tiles(). They are written in about this order, 'on_saved' is called as each one is written.
 
-        # Check if it's separated by 'x'
-        if 'x' in grid_string:
-            # temp list for value check
-            temp_grid_values = [int(i) for i in grid_string.split('x') if i.isdigit() and int(i) != 0]
-        # or '*' as separator
-        elif '*' in grid_string:
-            temp_grid_values = [int(i) for i in grid_string.split('*') if i.isdigit() and int(i) != 0]
+    Returns:
+        A dict of the counts, like this: {'sliced': 10, 'tiles': 640, 'bytes': 52428800, 'peak_memory': 268435456}
+        'bytes' is the size of the written tiles, 'peak_memory' is the most memory reserved at the same time.
+
+    Raises:
+        TypeError, ValueError, IOError:
+            If the spec is not valid, a source cannot be opened, or a slice cannot be written.
+            The pipeline stops at the first error, the tiles already written are kept.
+
+    """
+    import queue
+
+    stage_workers = dict(PIPELINE_STAGE_WORKERS)
+    if not stage_workers['encode']:
+        stage_workers['encode'] = _tuned('encode_workers', 0)
+    stage_workers.update(workers or {})
+    unknown_stages = set(stage_workers) - set(PIPELINE_STAGE_WORKERS)
+    if unknown_stages:
+        raise ValueError('Unknown pipeline stages: ' + ', '.join(sorted(unknown_stages))
+                         + ', the stages are decode, crop, encode and write.')
+    stage_workers = dict((stage, count or os.cpu_count() or 1) for stage, count in stage_workers.items())
+    specs = spec if isinstance(spec, list) else [spec]
+    # validate the specs and the format now, not in the threads.
+    for each_spec in specs:
+        _compile_spec_dict(each_spec)
+    pil_format = get_pil_format_from_ext_name(out_format) if out_format else None
+    sink = DirectorySink(out_dir) if isinstance(out_dir, str) else out_dir
+    if tile_shard:
+        _validate_shard(tile_shard)
+    if isinstance(tile_order, str) and tile_order not in TILE_ORDERS:
+        raise ValueError("'tile_order' should be one of " + ', '.join(TILE_ORDERS) + ', or a list of (row, col).')
+    encode_pool = None
+    if _executor_type(executor) == 'process':
+        import concurrent.futures
+
+        encode_pool = concurrent.futures.ProcessPoolExecutor(max_workers=stage_workers['encode'])
+
+    budget = _MemoryBudget(memory_budget)
+    crop_queue = queue.Queue(maxsize=queue_size)
+    encode_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+    state = {'sliced': 0, 'tiles': 0, 'bytes': 0, 'errors': [], 'lock': threading.Lock(),
+             'sources': iter(sources)}
+
+    def decode(source, emit):
+        out_name, out_ext = split_pure_file_name_from_ext_name(get_file_basename_without_path(source))
+        if out_format:
+            out_ext = out_format.lower().lstrip('.')
+        source_pil_format = pil_format or get_pil_format_from_ext_name(out_ext)
+        relative_dir = os.path.relpath(os.path.dirname(source), source_root) if source_root else ''
+
+        # the header only, the size and the mode, reserve the memory before the pixels are decoded.
+        # a image opened out-of-core is decoded already, but into a mapped file, only it's tiles take memory.
+        img = _open_image(source)
+        estimate = _image_memory_bytes(img.mode, img.size) * (len(specs) + (not isinstance(img, MappedImage)))
+        budget.reserve(estimate)
+        save_params = {}
+        if keep_metadata or keep_exif:
+            # upright first, the tiles are planned on the upright image, the metadata is serialized once.
+            img = orient_image(img)
+            save_params = _metadata_save_params(image_metadata(img, exif=keep_exif), source_pil_format)
+        if tile_manifest is not None:
+            tile_manifest.add_source(source, img.size, spec)
+        # a single scaled spec keeps the image not decoded, so a JPEG is decoded in the reduced size.
+        # the source is converted for the format once, or the reduced tiles are converted after they are cropped.
+        held_images = []
+        source_converted = len(specs) > 1 or specs[0].get('scale', 1.0) == 1.0
+        if source_converted:
+            if pil_format:
+                img = convert_image_for_format(img, pil_format)
+            img.load()
+            held_images.append(img)
+        convert_format = pil_format if not source_converted else None
+        tiles = []
+        # the place of each tile in the tile order, the spec, then the order of the tiles of the spec.
+        tile_ranks = []
+        for index, each_spec in enumerate(specs):
+            layout_name = out_name + ('_' + _spec_layout_name(each_spec, index) if len(specs) > 1 else '')
+            spec_img, spec_tiles = _plan_spec_tiles(img, each_spec, layout_name)
+            spec_img.load()
+            if not any(spec_img is held_image for held_image in held_images):
+                held_images.append(spec_img)
+            for name, box, plan_box in spec_tiles:
+                tile_bytes = _image_memory_bytes(spec_img.mode, (box[2] - box[0], box[3] - box[1]))
+                tiles.append((spec_img, os.path.normpath(os.path.join(relative_dir, name + '.' + out_ext)), box,
+                              plan_box, tile_bytes, convert_format))
+            if tile_order or viewport:
+                spec_ranks = [None] * len(spec_tiles)
+                for rank, tile_index in enumerate(order_tiles([plan_box for _, _, plan_box in spec_tiles],
+                                                              tile_order, viewport)):
+                    spec_ranks[tile_index] = (index, rank)
+                tile_ranks.extend(spec_ranks)
+        if tile_shard:
+            # the other shards of the tiles are for the other machines, a band of rows of the image each.
+            shard_range = shard_tile_range(len(tiles), tile_shard)
+            tiles = tiles[shard_range.start:shard_range.stop]
+            tile_ranks = tile_ranks[shard_range.start:shard_range.stop]
+        if tile_order or viewport:
+            tiles = [tile for _, tile in sorted(zip(tile_ranks, tiles), key=lambda ranked: ranked[0])]
+        images_bytes = sum(_image_memory_bytes(held_image.mode, held_image.size) for held_image in held_images
+                           if not isinstance(held_image, MappedImage))
+        # now it's known exactly, correct the estimate.
+        actual = images_bytes + sum(tile[4] for tile in tiles)
+        if actual > estimate:
+            budget.reserve(actual - estimate, wait=False)
         else:
-            raise ValueError('Grid String invalid. '
-                             'A valid grid string should be either "3x2" or "3*2", use "x" or "*" for separator.')
-        # a valid grid string should be either 3x2 or 3*2, use x or * for separator.
-        # this case, it's a 3x2 style input.
-
-        # there should not be any empty element,
-        # this check eliminates the case of multiple 'x' or leading or trailing 'x'
-        if all(temp_grid_values):
-            pass
+            budget.release(estimate - actual)
+        emit((source, tiles, images_bytes, source_pil_format, save_params))
+        with state['lock']:
+            state['sliced'] += 1
+
+    def crop(item, emit):
+        source, tiles, images_bytes, source_pil_format, save_params = item
+        for spec_img, path, box, plan_box, tile_bytes, convert_format in tiles:
+            tile = spec_img.crop(box)
+            if convert_format:
+                tile = convert_image_for_format(tile, convert_format)
+            emit((path, tile, tile_bytes, source_pil_format, save_params, (source, plan_box)))
+        # all the tiles are cropped, the decoded images are not needed any more.
+        budget.release(images_bytes)
+
+    def encode(item, emit):
+        path, tile, tile_bytes, source_pil_format, save_params, origin = item
+        if encode_pool:
+            data = encode_pool.submit(_encode_image, tile, source_pil_format,
+                                      **_encoder_params(source_pil_format, save_params)).result()
         else:
-            raise ValueError('Grid String invalid. A valid grid string should be 2 numbers separated by '
-                             'either "x" or "*" as separator, like "3x2" or "3*2", check if it\'s a typo.')
+            data = _encode_image(tile, source_pil_format, **save_params)
+        emit((path, data, tile_bytes, origin + (tile.size,)))
+
+    def write(item, emit):
+        name, data, tile_bytes, (source, plan_box, tile_size) = item
+
+        # a sink may store it later, from another thread, like a upload.
+        def written(written_name):
+            budget.release(tile_bytes)
+            with state['lock']:
+                state['tiles'] += 1
+                state['bytes'] += len(data)
+            if tile_manifest is not None:
+                tile_manifest.add_tile(written_name, data, plan_box, tile_size, source)
+            if on_saved:
+                on_saved(written_name)
+
+        sink.write(name, data, written)
+
+    stages = [('decode', decode, None, crop_queue), ('crop', crop, crop_queue, encode_queue),
+              ('encode', encode, encode_queue, write_queue), ('write', write, write_queue, None)]
+    threads = []
+    for index, (stage, work, in_queue, out_queue) in enumerate(stages):
+        next_workers = stage_workers[stages[index + 1][0]] if out_queue else 0
+        remaining = [stage_workers[stage]]
+        for _ in range(stage_workers[stage]):
+            thread = threading.Thread(target=_pipeline_stage_worker,
+                                      args=(work, in_queue, out_queue, next_workers, remaining, state, budget),
+                                      name='image-slice-' + stage, daemon=True)
+            thread.start()
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
+    if encode_pool:
+        encode_pool.shutdown()
+
+    if state['errors']:
+        raise state['errors'][0]
+    sink.flush()
+    return {'sliced': state['sliced'], 'tiles': state['tiles'], 'bytes': state['bytes'], 'peak_memory': budget.peak}
+
+
+# the loop of a worker thread of a pipeline stage, see slice_pipeline().
+def _pipeline_stage_worker(work, in_queue, out_queue, next_workers, remaining, state, budget):
+    """Runs 'work' on the items of 'in_queue' (or the sources, for the first stage) until the end of it.
+
+    After a error, the items are taken but not worked on, so the stages before it never wait on a full queue.
+    The last worker of a stage to finish tells every worker of the next stage to stop.
 
-        # The length of the list should be 2, all the elements should be a int, the value should not be 0
-        if len(temp_grid_values) == 2:
-            pass
+    """
+    while True:
+        if in_queue is None:
+            # the first stage, it takes the sources directly, a iterable is not thread safe.
+            with state['lock']:
+                item = next(state['sources'], _PIPELINE_END) if not state['errors'] else _PIPELINE_END
         else:
-            raise ValueError('Grid String invalid. A valid grid string should be 2 numbers separated by '
-                             'either "x" or "*" as separator, like "3x2" or "3*2", check if it\'s a typo.')
+            item = in_queue.get()
+        if item is _PIPELINE_END:
+            break
+        if state['errors']:
+            continue
+        try:
+            work(item, out_queue.put if out_queue else None)
+        except Exception as error:
+            with state['lock']:
+                state['errors'].append(error)
+            budget.abort()
+    with state['lock']:
+        remaining[0] -= 1
+        last_worker = remaining[0] == 0
+    if last_worker and out_queue:
+        for _ in range(next_workers):
+            out_queue.put(_PIPELINE_END)
+
+
+# helper function to write bytes to a temporary file, then rename it, like _save_image_atomic().
+def _write_bytes_atomic(path, data):
+    """Writes 'data' to 'path' atomically, by a temporary file in the same directory and a rename."""
+    temp_path = path + '.tmp'
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    try:
+        with open(temp_path, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+# Public API: Dry run, plan the slices without decoding
+
+# the rough encoded size of the formats: (bytes for a byte of raw pixels of a photo, bytes of the headers of a file).
+# the ratio is corrected by how well the source compresses in it's own format, see plan_slices().
+_ESTIMATED_ENCODING = {
+    'JPEG': (0.08, 600),
+    'WEBP': (0.06, 40),
+    'PNG': (0.5, 60),
+    'GIF': (0.3, 800),
+    'TIFF': (1.0, 200),
+    'BMP': (1.0, 54),
+    'PPM': (1.0, 15),
+}
+
+
+# plan the slices of a image, the header only, no pixel is decoded.
+def plan_slices(image, spec, out_format=''):
+    """Plans how 'image' is sliced by 'spec', reading it's header only, for a dry run before a large job.
+
+    The slices are planned exactly as the slice functions do, no pixel is decoded nor cropped, so it takes a
+    fraction of a millisecond for a image, even a huge one.
+
+    The memory is what slicing the image holds at most: the decoded image (in a reduced size by JPEG draft mode
+    for a scaled spec, or just a band of it out-of-core, see enable_out_of_core()), it's copy converted for the
+    output format if needed, it's reduced copy for a scaled spec, and all the slices.
+
+    The encoded sizes are rough estimates, from the typical compression of each format, corrected by how well
+    the source compresses in it's own format (it's file size), plus the headers of each file.
+
+    A trimmed spec is planned on the whole image, the content box needs the pixels, so the plan is the most it takes.
+
+    Args:
+        image:
+            a string to the image path, or a PIL Image object.
+        spec:
+            a dict, how the image is sliced, see slice_by_spec(). Or a list of specs, see slice_multi_spec().
+        out_format:
+            Optional, a ext name like 'webp', the format of the slices, the format of the source if omitted.
+
+    Returns:
+        A dict of the plan, like this:
+            {'source': 'photo.jpg', 'size': (4000, 3000), 'mode': 'RGB', 'format': 'JPEG', 'tiles': 12,
+             'boxes': [(0, 0, 1000, 1000), ...], 'out_of_core': False, 'decoded_bytes': 48000000,
+             'tiles_bytes': 48000000, 'peak_memory': 96000000,
+             'estimated_bytes': {'JPEG': 2887200, 'PNG': 18000720, ...}}
+        'boxes' are the boxes of the slices on the full size image, of all the specs, in the order they are saved.
+        'estimated_bytes' is the estimated size of all the slices encoded in each format.
+
+    Raises:
+        TypeError, ValueError, IOError:
+            The same as slice_by_spec().
+
+    """
+    specs = spec if isinstance(spec, list) else [spec]
+    if isinstance(image, str):
+        try:
+            header = Image.open(image)
+        except IOError:
+            raise IOError('PIL open file error, please check if the image path provided is a valid image file.')
+        with header:
+            return _plan_header(header, image, os.path.getsize(image), specs, out_format)
+    return _plan_header(_open_image(image), '', 0, specs, out_format)
+
+
+# helper function to plan the slices of a opened (not decoded) image, see plan_slices().
+def _plan_header(img, source, file_bytes, specs, out_format):
+    width, height = img.size
+    ext_name = out_format or (split_pure_file_name_from_ext_name(get_file_basename_without_path(source))[1]
+                              if source else '')
+    pil_format = get_pil_format_from_ext_name(ext_name) if ext_name else (img.format or 'PNG')
+    out_mode = _output_mode(img.mode, pil_format)
+    out_of_core = isinstance(img, MappedImage) or _exceeds_memory_ceiling(img)
+
+    boxes = []
+    tiles_bytes = tiles_raw_bytes = reduced_bytes = 0
+    smallest_scale = 1.0
+    for each_spec in specs:
+        horizontal_spec, vertical_spec = _compile_spec_dict(each_spec)
+        if each_spec.get('mode') == 'auto':
+            raise ValueError("A 'auto' spec is detected from the pixels, it cannot be planned from the header.")
+        scale = each_spec.get('scale', 1.0)
+        smallest_scale = min(smallest_scale, scale)
+        reduced_size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+        column_offsets = _plan_offsets(width, horizontal_spec, 'horizontal') if horizontal_spec else (0, width)
+        row_offsets = _plan_offsets(height, vertical_spec, 'vertical') if vertical_spec else (0, height)
+        for row in _grid_boxes(img.size, column_offsets, row_offsets, width, height):
+            boxes.extend(row)
+        for row in _grid_boxes(reduced_size, column_offsets, row_offsets, width, height, scale):
+            for box in row:
+                tile_size = (box[2] - box[0], box[3] - box[1])
+                tiles_bytes += _image_memory_bytes(out_mode, tile_size)
+                tiles_raw_bytes += _raw_pixel_bytes(out_mode, tile_size)
+        if scale != 1.0:
+            reduced_bytes += _image_memory_bytes(out_mode, reduced_size)
+
+    # the decoded image, a JPEG of a single scaled spec is decoded in a reduced size, see reduce_image().
+    decoded_size = img.size
+    if len(specs) == 1 and smallest_scale < 1.0 and img.format == 'JPEG':
+        # PIL picks the largest DCT scale (1/2, 1/4 or 1/8) not smaller than the reduced size.
+        largest_factor = min(width // reduced_size[0], height // reduced_size[1])
+        draft_factor = 1
+        while draft_factor < 8 and draft_factor * 2 <= largest_factor:
+            draft_factor *= 2
+        decoded_size = (-(-width // draft_factor), -(-height // draft_factor))
+    if out_of_core:
+        decoded_bytes = min(_band_bytes(), _image_memory_bytes(img.mode, img.size))
+    else:
+        decoded_bytes = _image_memory_bytes(img.mode, decoded_size)
+        if out_mode != img.mode:
+            decoded_bytes += _image_memory_bytes(out_mode, decoded_size)
+
+    # how well the source compresses in it's own format, compared to a typical photo.
+    compression = 1.0
+    if file_bytes and img.format in _ESTIMATED_ENCODING:
+        source_ratio = _ESTIMATED_ENCODING[img.format][0]
+        compression = min(4.0, max(0.02, file_bytes / float(_raw_pixel_bytes(img.mode, img.size)) / source_ratio))
+    estimated_bytes = dict((encoding_format, int(tiles_raw_bytes * min(1.0, ratio * compression)
+                                                 + header_bytes * len(boxes)))
+                           for encoding_format, (ratio, header_bytes) in _ESTIMATED_ENCODING.items())
+    return {'source': source, 'size': img.size, 'mode': img.mode, 'format': pil_format, 'tiles': len(boxes),
+            'boxes': boxes, 'out_of_core': out_of_core, 'decoded_bytes': decoded_bytes, 'tiles_bytes': tiles_bytes,
+            'peak_memory': decoded_bytes + reduced_bytes + tiles_bytes, 'estimated_bytes': estimated_bytes}
+
+
+# helper function to tell the mode a image is saved in, for a format, like convert_image_for_format() converts it.
+def _output_mode(mode, pil_format):
+    supported_modes = _OUTPUT_FORMAT_MODES.get(pil_format)
+    if not supported_modes or mode in supported_modes:
+        return mode
+    if mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La') and 'RGBA' in supported_modes:
+        return 'RGBA'
+    if mode in ('1', 'L', 'LA', 'La') + _HIGH_BIT_DEPTH_MODES and 'L' in supported_modes:
+        return 'L'
+    return 'RGB' if 'RGB' in supported_modes else supported_modes[0]
+
+
+# helper function to tell the bytes of the raw pixels of a image, the samples, not how PIL stores them.
+def _raw_pixel_bytes(mode, size):
+    if mode == '1':
+        return -(-size[0] // 8) * size[1]
+    sample_bytes = 2 if mode.startswith('I;16') else 4 if mode in ('I', 'F') else 1
+    return size[0] * size[1] * Image.getmodebands(mode) * sample_bytes
+
+
+# plan a batch of images, for a dry run of slice_batch() or slice_pipeline().
+def plan_batch(sources, spec, out_format='', memory_budget=256 * 1024 * 1024, on_plan=None):
+    """Plans a batch of images by plan_slices(), reading their headers only, and sums the plans up.
+
+    A directory of thousands of images is planned in seconds, like this:
+        totals = plan_batch(list_image_files('scans'), spec, 'webp')
+
+    Args:
+        sources:
+            A iterable of image path strings, like list_image_files() returns.
+        spec:
+            A dict, or a list of specs, see slice_batch().
+        out_format:
+            Optional, a ext name like 'webp', see plan_slices().
+        memory_budget:
+            Optional, a int, the memory budget of slice_pipeline(), for it's peak memory.
+        on_plan:
+            Optional, a function called with the plan of each image (see plan_slices()), the plans are not kept.
+
+    Returns:
+        A dict of the totals, like this:
+            {'images': 1000, 'tiles': 64000, 'peak_memory': 96000000, 'pipeline_memory': 268435456,
+             'estimated_bytes': {'JPEG': 2887200000, ...}}
+        'peak_memory' is the most memory slice_batch() holds, it slices one image at a time,
+        'pipeline_memory' is the most memory slice_pipeline() holds, the images overlap within it's budget.
+
+    """
+    totals = {'images': 0, 'tiles': 0, 'peak_memory': 0, 'pipeline_memory': 0, 'estimated_bytes': {}}
+    reserved_bytes = 0
+    for source in sources:
+        plan = plan_slices(source, spec, out_format)
+        totals['images'] += 1
+        totals['tiles'] += plan['tiles']
+        totals['peak_memory'] = max(totals['peak_memory'], plan['peak_memory'])
+        reserved_bytes += plan['peak_memory']
+        for encoding_format, estimated_bytes in plan['estimated_bytes'].items():
+            totals['estimated_bytes'][encoding_format] = (totals['estimated_bytes'].get(encoding_format, 0)
+                                                          + estimated_bytes)
+        if on_plan:
+            on_plan(plan)
+    # a image larger than the budget still runs, alone.
+    totals['pipeline_memory'] = max(totals['peak_memory'], min(memory_budget, reserved_bytes))
+    return totals
+
+
+# Public API: Batched tensors, for training data loaders
+
+# the NumPy dtypes of the modes of a tensor, the other modes are converted, see _tensor_mode().
+_TENSOR_DTYPES = {'L': 'uint8', 'LA': 'uint8', 'RGB': 'uint8', 'RGBA': 'uint8', 'CMYK': 'uint8', 'YCbCr': 'uint8',
+                  'I;16': 'uint16', 'I': 'int32', 'F': 'float32'}
+
+
+def slice_to_tensor(images, spec, mode=None, pad=False, workers=0, out=None):
+    """Slices N images of the same size by one plan, into one NumPy array of shape (N, tiles, H, W, C).
+
+    It's for data loaders which slice many same size images the same way and stack the tiles: the plan is made
+    once, the array is allocated once, and the images are decoded on 'workers' threads (PIL releases the GIL),
+    each copies it's tiles straight into it's own slot of the array, no tile image is created.
+
+    The tiles are in the order the save functions save them, row by row, see plan_tile_index() for their boxes.
+    H and W are the size of the largest tile, all the tiles should be the same size, like 'step' slices
+    of a image a multiple of the step, or 'pad' them: a smaller tile is at the top left of it's slot, the rest
+    is 0, and the mask tells which pixels are real.
+
+    For example:
+        tensor, mask = slice_to_tensor(paths, {'mode': 'grid', 'grid': '4x4'}, mode='RGB')
+        tensor.shape  # (len(paths), 16, 256, 256, 3) for 1024*1024px images
+
+    Args:
+        images:
+            a list of the images, each a string to the image path, bytes, a file object or a PIL Image object.
+        spec:
+            a dict, how to slice every image, see slice_by_spec(). Not 'auto' nor 'trim', they differ by image.
+        mode:
+            optional, the PIL mode of the tensor, like 'RGB' or 'L', every image is converted to it.
+            By default the mode of the first image, a palette image is RGB (RGBA if it has transparency).
+            The dtype is uint8, or uint16 for 'I;16', int32 for 'I', float32 for 'F'.
+        pad:
+            optional, True to pad the smaller tiles with 0 to the largest tile, instead of raising ValueError.
+        workers:
+            optional, a int, the number of decoding threads, 0 means the number of CPUs.
+        out:
+            optional, a NumPy array of the exact shape and dtype to write into, like the buffer of the last batch.
+
+    Returns:
+        A tuple (tensor, mask). 'mask' is a bool array of shape (tiles, H, W), True for the pixels of the tiles,
+        the same for every image, or None if every tile is the full H * W.
+
+    Raises:
+        ImportError:
+            If NumPy is not installed.
+        ValueError:
+            If the images are not the same size, the tiles are not the same size and not 'pad',
+            the spec is 'auto' or 'trim', or 'out' is not the shape and dtype of the tensor.
+        TypeError, IOError:
+            The same as slice_by_spec().
+
+    """
+    import concurrent.futures
+
+    numpy = _import_numpy('slicing to a tensor')
+    images = list(images)
+    if not images:
+        raise ValueError("'images' should not be empty, it's a list of images of the same size.")
+    horizontal_spec, vertical_spec = _compile_spec_dict(spec)
+    if spec.get('mode') == 'auto' or spec.get('trim'):
+        raise ValueError("A tensor is sliced by one plan for all the images, 'auto' and 'trim' differ by image.")
+    scale = spec.get('scale', 1.0)
+
+    # the plan, once, on the size of the first image, it's header only if it's a path.
+    first = _open_image(images[0])
+    plan_width, plan_height = first.size
+    mode = mode or _tensor_mode(first)
+    if mode not in _TENSOR_DTYPES:
+        raise ValueError("Mode '" + mode + "' is not a tensor mode, use one of: " + ', '.join(_TENSOR_DTYPES) + '.')
+    reduced_size = (max(1, int(round(plan_width * scale))), max(1, int(round(plan_height * scale))))
+    column_offsets = _plan_offsets(plan_width, horizontal_spec, 'horizontal') if horizontal_spec else (0, plan_width)
+    row_offsets = _plan_offsets(plan_height, vertical_spec, 'vertical') if vertical_spec else (0, plan_height)
+    boxes = [box for row in _grid_boxes(reduced_size, column_offsets, row_offsets, plan_width, plan_height, scale)
+             for box in row]
+    tile_width = max(box[2] - box[0] for box in boxes)
+    tile_height = max(box[3] - box[1] for box in boxes)
+    mask = None
+    if any((box[2] - box[0], box[3] - box[1]) != (tile_width, tile_height) for box in boxes):
+        if not pad:
+            raise ValueError('The tiles are not the same size, the largest is ' + str((tile_width, tile_height))
+                             + ', slice them equally, or pad them with pad=True.')
+        mask = numpy.zeros((len(boxes), tile_height, tile_width), dtype=bool)
+        for index, box in enumerate(boxes):
+            mask[index, :box[3] - box[1], :box[2] - box[0]] = True
+
+    shape = (len(images), len(boxes), tile_height, tile_width, Image.getmodebands(mode))
+    dtype = numpy.dtype(_TENSOR_DTYPES[mode])
+    if out is None:
+        # zeros, the padding of the smaller tiles is 0.
+        out = numpy.zeros(shape, dtype=dtype)
+    elif out.shape != shape or out.dtype != dtype:
+        raise ValueError("'out' should be a array of shape " + str(shape) + ' and dtype ' + str(dtype) + '.')
+    elif mask is not None:
+        out[...] = 0
+
+    def fill(index):
+        img = first if index == 0 else _open_image(images[index])
+        if img.size != (plan_width, plan_height):
+            raise ValueError('Image ' + str(index) + ' is ' + str(img.size) + ', not ' + str((plan_width, plan_height))
+                             + ' like the first image, the images of a tensor should be the same size.')
+        img = _reduce_image(img, scale, img is not images[index])
+        if isinstance(img, MappedImage):
+            # out-of-core, it's never in memory as a whole, the tiles are copied one by one.
+            for tile_index, box in enumerate(boxes):
+                tile = img.crop(box)
+                tile = numpy.asarray(tile if tile.mode == mode else tile.convert(mode))
+                out[index, tile_index, :tile.shape[0], :tile.shape[1]] = tile.reshape(tile.shape[0], tile.shape[1], -1)
+            return
+        if img.mode != mode:
+            img = img.convert(mode)
+        pixels = numpy.asarray(img)
+        pixels = pixels.reshape(pixels.shape[0], pixels.shape[1], -1)
+        for tile_index, (left, upper, right, bottom) in enumerate(boxes):
+            out[index, tile_index, :bottom - upper, :right - left] = pixels[upper:bottom, left:right]
+
+    workers = min(workers or os.cpu_count() or 1, len(images))
+    if workers == 1:
+        for index in range(len(images)):
+            fill(index)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            # list() to raise the first error, if any.
+            list(executor.map(fill, range(len(images))))
+    return out, mask
+
+
+# helper function to choose the mode of a tensor by a image, see slice_to_tensor().
+def _tensor_mode(img):
+    if img.mode in _TENSOR_DTYPES:
+        return img.mode
+    if img.mode in ('P', 'PA'):
+        return 'RGBA' if img.mode == 'PA' or 'transparency' in img.info else 'RGB'
+    if img.mode == '1':
+        return 'L'
+    if img.mode.startswith('I;16'):
+        return 'I;16'
+    return 'RGB'
+
+
+# Public API: Benchmarks
+
+def benchmark_grid_threads(image=None, tile_size=256, max_workers=0, crop_method='pillow', repeat=3):
+    """Measures how threaded grid slicing (see slice_to_grid()) scales from 1 to 'max_workers' threads.
+
+    The image is decoded once, before it's timed, then it's cropped to 'tile_size' tiles by 1, 2, ... threads,
+    the best of 'repeat' runs is taken, so what's measured is the cropping only.
+
+    For example:
+        for result in benchmark_grid_threads('scan.tif', max_workers=8):
+            print(result['workers'], result['tiles_per_second'], result['speedup'])
+
+    Args:
+        image:
+            Optional, a path string or a PIL Image, a 8000*8000px RGB noise image is made up if omitted.
+        tile_size:
+            Optional, a int, the width and height of the tiles.
+        max_workers:
+            Optional, a int, the most threads to measure, 0 means the number of CPUs.
+        crop_method:
+            Optional, 'pillow' or 'numpy', see slice_to_grid().
+        repeat:
+            Optional, a int, how many times each number of threads is measured.
+
+    Returns:
+        A list of dicts, one for each number of threads, like this:
+            {'workers': 4, 'seconds': 0.05, 'tiles': 961, 'tiles_per_second': 19220.0, 'speedup': 3.6}
+        'speedup' is compared to 1 thread.
+
+    """
+    if image is None:
+        image = Image.effect_noise((8000, 8000), 64).convert('RGB')
+    img = _open_image(image)
+    img.load()
+    max_workers = max_workers or os.cpu_count() or 1
+    results = []
+    for workers in range(1, max_workers + 1):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            grid_slices = slice_to_grid(img, 'step', tile_size, 'step', tile_size, workers=workers,
+                                        crop_method=crop_method)
+            seconds = time.perf_counter() - started
+            best = seconds if best is None else min(best, seconds)
+        tiles = sum(len(row) for row in grid_slices)
+        results.append({'workers': workers, 'seconds': best, 'tiles': tiles, 'tiles_per_second': tiles / best,
+                        'speedup': results[0]['seconds'] / best if results else 1.0})
+    return results
+
+
+# Public API: Tuning profile, the defaults measured on this machine
+
+# The version of the tuning profile files, a profile of another version is not loaded.
+_TUNING_PROFILE_VERSION = 1
+
+# The tuning profile in use, it's loaded the first time a default is needed, see load_tuning_profile().
+_TUNING = {
+    'loaded': False,
+    'path': '',
+    'profile': {},
+}
+
+# The encoder option tune() measures for each format, it's values up to PIL's default, and the default,
+# the size the others are compared to. The values above the default are slower for about the same size.
+_TUNE_ENCODER_OPTIONS = {
+    'PNG': ('compress_level', [1, 2, 3, 4, 5, 6], 6),
+    'WEBP': ('method', [0, 1, 2, 3, 4], 4),
+}
+
+
+# helper function to tell where the tuning profile of the machine is.
+def _default_profile_path():
+    """Returns the path of the tuning profile of the machine, IMAGE_SLICE_PROFILE if it's set, a empty string turns
+    the profile off, or 'image-slice/profile.json' in the config directory of the user ($XDG_CONFIG_HOME or ~/.config).
+    """
+    if 'IMAGE_SLICE_PROFILE' in os.environ:
+        return os.environ['IMAGE_SLICE_PROFILE']
+    config_dir = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    return os.path.join(config_dir, 'image-slice', 'profile.json')
+
+
+def load_tuning_profile(path=None):
+    """Loads a tuning profile written by tune(), the library and the app take their defaults from it.
+
+    The profile of the machine is loaded by itself, the first time a default is needed, so this is only called
+    to use another profile, or the profile of the machine again after it's changed.
+    A profile tuned on a machine with another number of CPUs is not loaded by itself, like a profile baked into
+    a container image built elsewhere.
+
+    The defaults it sets are the threads of slice_to_grid() and the crop method, the band size of enable_out_of_core(),
+    the encode workers and the executor (threads or processes) of slice_pipeline() and save_multi_spec(),
+    and the encoder options (like the PNG compression level) of every slice saved. The arguments passed explicitly
+    are always used instead.
+
+    Args:
+        path:
+            Optional, a path string of a profile, the profile of the machine if omitted (see tune()).
+            A empty string uses no profile, the built-in defaults.
+
+    Returns:
+        The profile, a dict like tune() returns, a empty dict if there's no profile file,
+        or the profile of the machine is of another number of CPUs.
 
-        # now we have a valid grid.
-        grid_values = temp_grid_values
+    Raises:
+        IOError: If the profile 'path' cannot be read.
+        ValueError: If the file is not a tuning profile.
+
+    """
+    explicit = path is not None
+    if path is None:
+        path = _default_profile_path()
+    profile = {}
+    if path and (explicit or os.path.isfile(path)):
+        with open(path, encoding='utf-8') as profile_file:
+            profile = json.load(profile_file)
+        if not isinstance(profile, dict) or profile.get('version') != _TUNING_PROFILE_VERSION:
+            raise ValueError('Not a tuning profile of version ' + str(_TUNING_PROFILE_VERSION) + ': ' + path
+                             + ', run the tune command again.')
+        # the profile of the machine, measured on another machine, is not used.
+        if not explicit and profile.get('machine', {}).get('cpus') != os.cpu_count():
+            profile = {}
+    _TUNING.update(loaded=True, path=path, profile=profile)
+    return profile
+
+
+# helper function to get a default from the tuning profile, it's loaded the first time.
+def _tuned(key, default):
+    """Returns the value of 'key' in the tuning profile, or 'default' if it's not in it, or there's no profile."""
+    if not _TUNING['loaded']:
+        try:
+            profile = load_tuning_profile()
+        except (IOError, ValueError):
+            # a broken profile file must not break the slicing, the built-in defaults are used.
+            profile = {}
+        _TUNING.update(loaded=True, profile=profile)
+    return _TUNING['profile'].get(key, default)
+
+
+# helper function to validate a executor type, the one of the tuning profile if it's omitted.
+def _executor_type(executor):
+    executor = executor or _tuned('executor', 'thread')
+    if executor not in ['thread', 'process']:
+        raise ValueError("'executor' should either be 'thread' or 'process'.")
+    return executor
+
+
+def tune(sources=None, sample=4, profile_path=None, max_size_increase=0.05, tile_size=256):
+    """Runs a short benchmark of the slicing and saving on this machine, and writes the tuning profile of it.
+
+    It measures, on a sample of the images, how many threads crop a grid fastest and by which crop method,
+    the fastest encoder option of each format (PNG compression level, WebP method) whose output is at most
+    'max_size_increase' bigger than PIL's default, how many workers encode the tiles fastest, threads or processes,
+    and which band size decodes a image out-of-core fastest (the smallest of the fast ones, it takes less memory).
+
+    The profile is loaded by the library and the app, see load_tuning_profile(), so re-tune after the machine
+    changes, like at deploy time, it takes a few seconds.
+
+    For example:
+        profile = tune(list_image_files('scans'), sample=8)
+        print(profile['crop_workers'], profile['executor'], profile['encoder_options'])
+
+    Args:
+        sources:
+            Optional, a list of image path strings, like list_image_files() returns, or PIL images.
+            A 2048*2048px synthetic image is made up if omitted.
+        sample:
+            Optional, a int, how many of 'sources' are measured, spread over the list.
+        profile_path:
+            Optional, a path string to write the profile to, the profile of the machine if omitted
+            (IMAGE_SLICE_PROFILE, or ~/.config/image-slice/profile.json).
+        max_size_increase:
+            Optional, a number, how much bigger (0.05 is 5%) a faster encoder option may make the files.
+        tile_size:
+            Optional, a int, the width and height of the tiles measured.
+
+    Returns:
+        The profile, a dict like this:
+            {'version': 1, 'tuned': '2026-10-19T09:30:00', 'seconds': 4.2,
+             'machine': {'cpus': 8, 'platform': 'Linux-6.1-x86_64', 'python': '3.11.4', 'pillow': '10.0.0'},
+             'samples': 4, 'crop_workers': 4, 'crop_method': 'pillow', 'encode_workers': 8, 'executor': 'thread',
+             'band_bytes': 16777216, 'encoder_options': {'PNG': {'compress_level': 3}, 'WEBP': {'method': 2}}}
+
+    Raises:
+        ValueError: If there's no profile path to write to, IMAGE_SLICE_PROFILE is empty.
+        IOError: If a source cannot be opened, or the profile cannot be written.
+
+    """
+    import platform
+    import PIL
+
+    started = time.perf_counter()
+    profile_path = _default_profile_path() if profile_path is None else profile_path
+    if not profile_path:
+        raise ValueError('There is no tuning profile path to write to, IMAGE_SLICE_PROFILE is empty.')
+    images = _tune_sample_images(sources, sample)
+    cpus = os.cpu_count() or 1
+    # 1, 2, 4, ... threads and the number of CPUs.
+    worker_counts = sorted(set([2 ** power for power in range(cpus.bit_length()) if 2 ** power <= cpus] + [cpus]))
+
+    # the crop threads and method, the best of 2 runs of each.
+    crop_methods = ['pillow']
+    try:
+        _import_numpy('the numpy crop method')
+        crop_methods.append('numpy')
+    except ImportError:
+        pass
+    crop_results = []
+    for crop_method in crop_methods:
+        for workers in worker_counts:
+            seconds = min(_measure_seconds(lambda: [
+                slice_to_grid(img, 'step', tile_size, 'step', tile_size, workers=workers, crop_method=crop_method)
+                for img in images]) for _ in range(2))
+            crop_results.append(((workers, crop_method), seconds))
+    crop_workers, crop_method = _fastest(crop_results)
+
+    # the tiles to encode, up to 128 of them from all the samples.
+    tiles = [tile for img in images for row in slice_to_grid(img, 'step', tile_size, 'step', tile_size,
+                                                              workers=crop_workers, crop_method=crop_method)
+             for tile in row][:128]
+
+    # the encoder option of each format, the fastest one with a output not much bigger than PIL's default.
+    encoder_options = {}
+    # the format plugins register their encoders when they are loaded.
+    Image.init()
+    for pil_format, (option, values, default_value) in sorted(_TUNE_ENCODER_OPTIONS.items()):
+        if pil_format not in Image.SAVE:
+            continue
+        format_tiles = [convert_image_for_format(tile, pil_format) for tile in tiles[:32]]
+        results = []
+        for value in values:
+            sizes = []
+            seconds = _measure_seconds(lambda: sizes.extend(
+                len(_encode_image(tile, pil_format, **{option: value})) for tile in format_tiles))
+            results.append((value, seconds, sum(sizes)))
+        size_limit = [size for value, _, size in results if value == default_value][0] * (1 + max_size_increase)
+        encoder_options[pil_format] = {option: _fastest([(value, seconds) for value, seconds, size in results
+                                                         if size <= size_limit])}
+
+    # the encode workers, threads or processes, the tiles encoded to PNG by the option just tuned.
+    encode_params = encoder_options.get('PNG', {})
+    encode_results = []
+    for executor in ['thread', 'process']:
+        for workers in worker_counts:
+            if executor == 'process' and workers == 1:
+                continue
+            encode_results.append(((workers, executor), _measure_encode_pool(tiles, encode_params, workers,
+                                                                              executor)))
+    encode_workers, executor = _fastest(encode_results)
+
+    # the band size of a image decoded out-of-core.
+    band_bytes = _fastest(_measure_band_sizes(), tolerance=0.1)
+
+    profile = {
+        'version': _TUNING_PROFILE_VERSION,
+        'tuned': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seconds': round(time.perf_counter() - started, 2),
+        'machine': {'cpus': os.cpu_count(), 'platform': platform.platform(), 'python': platform.python_version(),
+                    'pillow': PIL.__version__},
+        'samples': len(images),
+        'crop_workers': crop_workers,
+        'crop_method': crop_method,
+        'encode_workers': encode_workers,
+        'executor': executor,
+        'band_bytes': band_bytes,
+        'encoder_options': encoder_options,
+    }
+    profile_dir = os.path.dirname(profile_path)
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+    _write_bytes_atomic(profile_path, (json.dumps(profile, indent=2, sort_keys=True) + '\n').encode('utf-8'))
+    # this process uses it too, from now on.
+    _TUNING.update(loaded=True, path=profile_path, profile=profile)
+    return profile
+
+
+# helper function to pick and decode the sample images of tune().
+def _tune_sample_images(sources, sample):
+    """Returns up to 'sample' of 'sources' decoded, spread over the list, each at most 4096*4096px."""
+    if not sources:
+        # a photo-like image, smooth gradients and some noise, so the encoder options make a difference.
+        gradient = Image.linear_gradient('L').resize((2048, 2048))
+        return [Image.merge('RGB', (gradient, Image.effect_noise((2048, 2048), 24),
+                                    gradient.transpose(Image.Transpose.ROTATE_90)))]
+    sources = list(sources)
+    step = max(1, len(sources) // max(1, sample))
+    images = []
+    for source in sources[::step][:sample]:
+        img = _open_image(source)
+        # a huge image is measured by a part of it, it's the same work for each tile.
+        img = img.crop((0, 0, min(img.width, 4096), min(img.height, 4096)))
+        img.load()
+        images.append(img)
+    return images
+
+
+# helper function to measure a run of a function.
+def _measure_seconds(function):
+    started = time.perf_counter()
+    function()
+    return time.perf_counter() - started
+
+
+# helper function to pick the fastest of the measured choices, a simpler one of the nearly fastest.
+def _fastest(results, tolerance=0.05):
+    """Returns the first choice of 'results', a list of (choice, seconds) from the simplest to the most expensive,
+    which takes at most 'tolerance' longer than the fastest one. Fewer threads do the same work with less overhead.
+    """
+    best = min(seconds for _, seconds in results)
+    return [choice for choice, seconds in results if seconds <= best * (1 + tolerance)][0]
+
+
+# helper function to measure how fast a pool of workers encodes tiles to PNG.
+def _measure_encode_pool(tiles, params, workers, executor):
+    """Returns the seconds a pool of 'workers' threads or processes takes to encode 'tiles', not starting the pool."""
+    import concurrent.futures
+
+    if workers == 1:
+        return _measure_seconds(lambda: [_encode_image(tile, 'PNG', **params) for tile in tiles])
+    pool_class = concurrent.futures.ProcessPoolExecutor if executor == 'process' else \
+        concurrent.futures.ThreadPoolExecutor
+    with pool_class(max_workers=workers) as pool:
+        # the processes are started before it's measured, a pipeline starts them once for a whole batch.
+        list(pool.map(abs, range(workers * 4)))
+        return _measure_seconds(lambda: [future.result() for future in
+                                         [pool.submit(_encode_image, tile, 'PNG', **params) for tile in tiles]])
+
+
+# helper function to measure how fast a image is decoded out-of-core, by a few band sizes.
+def _measure_band_sizes():
+    """Returns a list of (band_bytes, seconds) of decoding a 32 MB uncompressed image to a memory-mapped file."""
+    import tempfile
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='image-slice-tune-', dir=_OUT_OF_CORE['temp_dir']) as temp_dir:
+        path = os.path.join(temp_dir, 'band.bmp')
+        Image.new('RGB', (4096, 2731), (128, 128, 128)).save(path)
+        for band_megabytes in [4, 8, 16, 32]:
+            band_bytes = band_megabytes * 1024 * 1024
+            seconds = _measure_seconds(lambda: _map_image(Image.open(path), band_bytes, temp_dir).mapped.close())
+            results.append((band_bytes, seconds))
+    return results
+
+
+# Standalone sub-command functions for argparse, so it can dispatch accordingly without extra work.
+
+# standalone horizontal
+def _standalone_horizontal_slice(arguments):
+    print('[Horizontal slice]')
+    # equal slice case.
+    if getattr(arguments, 'slice_count', False):
+        print('Slice method: equal slice.  Slice count: ' + str(arguments.slice_count))
+        return slice_horizontal_in_equal(arguments.source, arguments.slice_count, scale=arguments.scale)
+    # step slice
+    elif getattr(arguments, 'step_size', False):
+        print('Slice method: step slice.  Slice step: every ' + str(arguments.step_size) + "px")
+        return slice_horizontal_by_step(arguments.source, arguments.step_size, scale=arguments.scale)
+    # ratio slice
+    elif getattr(arguments, 'ratio_string', False):
+        print('Slice method: ratio slice.  Slice ratio: ' + str(arguments.ratio_string))
+        return slice_horizontal_by_ratio(arguments.source, arguments.ratio_string, scale=arguments.scale)
+    # should never reach this.
+    else:
+        # this exception should never be raised.
+        raise ValueError('-e, -s or -r, one of which should be provided.')
+
+
+# Standalone vertical
+def _standalone_vertical_slice(arguments):
+    print('[Vertical slice]')
+    # equal slice case.
+    if getattr(arguments, 'slice_count', False):
+        print('Slice method: equal slice.  Slice count: ' + str(arguments.slice_count))
+        return slice_vertical_in_equal(arguments.source, arguments.slice_count, scale=arguments.scale)
+    # step slice
+    elif getattr(arguments, 'step_size', False):
+        print('Slice method: step slice.  Slice step: every ' + str(arguments.step_size) + "px")
+        return slice_vertical_by_step(arguments.source, arguments.step_size, scale=arguments.scale)
+    # ratio slice
+    elif getattr(arguments, 'ratio_string', False):
+        print('Slice method: ratio slice.  Slice ratio: ' + str(arguments.ratio_string))
+        return slice_vertical_by_ratio(arguments.source, arguments.ratio_string, scale=arguments.scale)
+    # should never reach this.
+    else:
+        # this exception should never be raised.
+        raise ValueError('-e, -s or -r, one of which should be provided.')
+
+
+# standalone grid
+def _standalone_grid_slice(arguments):
+    print('[Grid slice]')
+    # parse the input arguments, get the mode and mode_params for each direction.
+    if getattr(arguments, 'grid_string', False):
+        # It's the shortcut grid_string case, a grid is provide in a form or 3x2 or 3*2
+        horizontal_param, vertical_param = parse_grid_string(arguments.grid_string)
         # set the arguments for grid slice.
         horizontal_mode = 'equal'
-        horizontal_param = grid_values[0]
         vertical_mode = 'equal'
-        vertical_param = grid_values[1]
 
     else:
         # horizontal
@@ -1085,13 +5511,307 @@ def _standalone_grid_slice(arguments):
                              'something went very wrong, check the code, fire a issue.')
 
     # do the grid slice.
-    return slice_to_grid(arguments.file_name, horizontal_mode=horizontal_mode, horizontal_param=horizontal_param,
-                         vertical_mode=vertical_mode, vertical_param=vertical_param)
+    return slice_to_grid(arguments.source, horizontal_mode=horizontal_mode, horizontal_param=horizontal_param,
+                         vertical_mode=vertical_mode, vertical_param=vertical_param, scale=arguments.scale,
+                         workers=arguments.crop_threads, trim=arguments.trim, trim_tolerance=arguments.trim_tolerance)
+
+
+# standalone auto grid, the grid of a sprite sheet is detected.
+def _standalone_auto_slice(arguments):
+    print('[Auto grid slice]')
+    print('Separator tolerance: ' + str(arguments.tolerance) + '.  Min gap: ' + str(arguments.min_gap) + 'px')
+    return slice_by_detected_grid(arguments.source, arguments.tolerance, arguments.min_gap, scale=arguments.scale,
+                                  workers=arguments.crop_threads)
+
+
+# standalone batch, FILE_NAME is a directory, every image in it is sliced the same way.
+def _standalone_batch(arguments):
+    print('[Batch slice]')
+    spec = load_spec_file(arguments.spec_file) if arguments.spec_file else _spec_from_arguments(arguments)
+    if os.path.isdir(arguments.file_name):
+        sources = list_image_files(arguments.file_name)
+        source_root = arguments.file_name
+    else:
+        sources = [arguments.file_name]
+        source_root = ''
+    if arguments.shard:
+        print('Shard ' + str(arguments.shard[0]) + ' of ' + str(arguments.shard[1])
+              + (', by the source paths.' if source_root else ', by the slices of the image.'))
+        if source_root:
+            sources = shard_sources(sources, arguments.shard, source_root)
+    if arguments.manifest:
+        print('Job manifest: ' + arguments.manifest)
+    out_dir = arguments.output_dir or get_current_cwd()
+    output = _output_from_arguments(arguments)
+    tile_manifest = _tile_manifest_from_arguments(arguments)
+    try:
+        counts = slice_batch(sources, spec, output, out_format=arguments.output_format,
+                             manifest_path=arguments.manifest, source_root=source_root, tile_manifest=tile_manifest,
+                             keep_metadata=arguments.keep_metadata, keep_exif=arguments.keep_exif,
+                             tile_shard=arguments.shard if not source_root else None)
+    finally:
+        _close_output(output, tile_manifest)
+    print('Batch completed, ' + str(counts['sliced']) + ' images sliced to ' + str(counts['tiles']) + ' slices, '
+          + str(counts['skipped']) + ' images already done are skipped. Check \'' + out_dir + '\'.')
+    return 0
 
 
-# main function when used as a standalone app.
-# mostly it's the argument declarations and parsings. It's like a dispatcher.
-def main(argv):
+# standalone pipeline, slice a image or a directory in the staged pipeline.
+def _standalone_pipeline(arguments):
+    print('[Pipeline slice]')
+    if arguments.manifest:
+        raise ValueError('--manifest is not supported by --pipeline, use one of them.')
+    spec = load_spec_file(arguments.spec_file) if arguments.spec_file else _spec_from_arguments(arguments)
+    if os.path.isdir(arguments.file_name):
+        sources = list_image_files(arguments.file_name)
+        source_root = arguments.file_name
+    else:
+        sources = [arguments.file_name]
+        source_root = ''
+    workers = {}
+    if arguments.stage_workers:
+        counts = arguments.stage_workers.split(',')
+        if len(counts) != 4 or not all(count.isdigit() for count in counts):
+            raise ValueError("--stage-workers should be 4 numbers separated by ',', like 1,1,8,2 .")
+        workers = dict(zip(['decode', 'crop', 'encode', 'write'], [int(count) for count in counts]))
+    if arguments.shard and source_root:
+        sources = shard_sources(sources, arguments.shard, source_root)
+    out_dir = arguments.output_dir or get_current_cwd()
+    output = _output_from_arguments(arguments)
+    tile_manifest = _tile_manifest_from_arguments(arguments)
+    try:
+        counts = slice_pipeline(sources, spec, output, out_format=arguments.output_format, workers=workers,
+                                memory_budget=arguments.memory_budget * 1024 * 1024, source_root=source_root,
+                                tile_manifest=tile_manifest, keep_metadata=arguments.keep_metadata,
+                                keep_exif=arguments.keep_exif,
+                                tile_shard=arguments.shard if not source_root else None,
+                                tile_order=arguments.tile_order, viewport=arguments.viewport)
+    finally:
+        _close_output(output, tile_manifest)
+    print('Pipeline completed, ' + str(counts['sliced']) + ' images sliced to ' + str(counts['tiles'])
+          + ' slices, peak memory ' + str(counts['peak_memory'] // (1024 * 1024)) + ' MB. Check \'' + out_dir + '\'.')
+    return 0
+
+
+# standalone dry run, plan a image or a directory, report the tiles, the memory and the output size, write nothing.
+def _standalone_dry_run(arguments):
+    print('[Dry run]')
+    spec = load_spec_file(arguments.spec_file) if arguments.spec_file else _spec_from_arguments(arguments)
+    single_image = not os.path.isdir(arguments.file_name)
+    sources = [arguments.source] if single_image else list_image_files(arguments.file_name)
+    if arguments.shard and not single_image:
+        sources = shard_sources(sources, arguments.shard, arguments.file_name)
+
+    def report(plan):
+        print((plan['source'] or arguments.file_name) + ': ' + str(plan['size'][0]) + 'x' + str(plan['size'][1])
+              + ' ' + plan['mode'] + ', ' + str(plan['tiles']) + ' slices, memory '
+              + _format_megabytes(plan['peak_memory']) + (' (out-of-core)' if plan['out_of_core'] else '') + ', about '
+              + _format_megabytes(plan['estimated_bytes'].get(plan['format'], 0)) + ' in ' + plan['format'])
+        if single_image:
+            for box in plan['boxes']:
+                print('    ' + str(box))
+
+    totals = plan_batch(sources, spec, out_format=arguments.output_format,
+                        memory_budget=arguments.memory_budget * 1024 * 1024, on_plan=report)
+    print(str(totals['images']) + ' images, ' + str(totals['tiles']) + ' slices, peak memory '
+          + _format_megabytes(totals['pipeline_memory'] if arguments.pipeline else totals['peak_memory'])
+          + (' with --pipeline' if arguments.pipeline else '') + '.')
+    print('Estimated output size: ' + ', '.join(encoding_format + ' ' + _format_megabytes(estimated_bytes)
+                                                 for encoding_format, estimated_bytes
+                                                 in sorted(totals['estimated_bytes'].items())))
+    if arguments.trim:
+        print('--trim needs the pixels, the slices are planned on the whole images, it\'s the most they take.')
+    return 0
+
+
+# helper function to open the output of '-o', a directory path string, or a sink of a archive or a object storage.
+def _output_from_arguments(arguments):
+    target = arguments.output_dir or get_current_cwd()
+    if target == '-':
+        return ArchiveSink(target, arguments.output_stream)
+    if target.startswith('s3://') or target.lower().endswith(('.zip', '.tar', '.tar.gz', '.tgz')):
+        return open_sink(target)
+    return target
+
+
+# helper function to close the output of '-o', a sink is closed, so the archive is complete, the uploads are done.
+def _close_output(output, tile_manifest=None):
+    if not isinstance(output, str):
+        output.close()
+    # after the sink, the uploads still running record their tiles.
+    if tile_manifest is not None:
+        tile_manifest.close()
+
+
+# helper function to open the tile manifest of '--tile-manifest', None if there's no such option.
+def _tile_manifest_from_arguments(arguments):
+    if not arguments.tile_manifest:
+        return None
+    print('Tile manifest: ' + arguments.tile_manifest)
+    return TileManifest(arguments.tile_manifest)
+
+
+# standalone multi-spec, slice the image in every way of the spec file.
+def _standalone_multi_spec(arguments):
+    specs = load_spec_file(arguments.spec_file)
+    print('[Multi-spec slice]  ' + str(len(specs)) + ' specs from ' + arguments.spec_file)
+    out_name, out_ext = split_pure_file_name_from_ext_name(get_file_basename_without_path(arguments.source_name))
+    pil_format = None
+    if arguments.output_format:
+        out_ext = arguments.output_format.lower().lstrip('.')
+        pil_format = get_pil_format_from_ext_name(out_ext)
+    out_dir = arguments.output_dir or get_current_cwd()
+    img = _open_image(arguments.source)
+    metadata = None
+    if arguments.keep_metadata or arguments.keep_exif:
+        img = orient_image(img)
+        metadata = image_metadata(img, exif=arguments.keep_exif)
+    outputs = slice_multi_spec(img, specs, pil_format)
+    output = _output_from_arguments(arguments)
+    tile_manifest = _tile_manifest_from_arguments(arguments)
+    try:
+        if tile_manifest is not None:
+            tile_manifest.add_source(arguments.file_name, img.size, specs)
+        skip_names = None
+        if arguments.shard:
+            names = [name + '.' + out_ext for index, output_slices in enumerate(outputs)
+                     for name, _ in _slice_file_names(output_slices,
+                                                      out_name + '_' + _spec_layout_name(specs[index], index))]
+            skip_names = _names_outside_shard(names, arguments.shard)
+        save_multi_spec(outputs, specs, output, out_name, out_ext, pil_format, skip_names=skip_names,
+                        tile_manifest=tile_manifest, metadata=metadata)
+    finally:
+        _close_output(output, tile_manifest)
+    print('Slice completed, check \'' + out_dir + '\', slices should already be there.')
+    return 0
+
+
+# helper function to describe the slice of the parsed arguments as a spec, see slice_by_spec().
+def _spec_from_arguments(arguments):
+    spec = _slice_spec_from_arguments(arguments)
+    if getattr(arguments, 'trim', False):
+        spec.update(trim=True, trim_tolerance=arguments.trim_tolerance)
+    return spec
+
+
+# helper function to describe the slice mode of the parsed arguments, see _spec_from_arguments().
+def _slice_spec_from_arguments(arguments):
+    mode = getattr(arguments, 'mode', None)
+    if mode in ['horizontal', 'h', 'vertical', 'v']:
+        if arguments.slice_count:
+            method, param = 'equal', arguments.slice_count
+        elif arguments.step_size:
+            method, param = 'step', arguments.step_size
+        else:
+            method, param = 'ratio', arguments.ratio_string
+        return {'mode': 'horizontal' if mode in ['horizontal', 'h'] else 'vertical', 'method': method,
+                'param': param, 'scale': arguments.scale}
+    elif mode in ['grid', 'g']:
+        spec = {'mode': 'grid', 'scale': arguments.scale}
+        for direction in ['horizontal', 'vertical']:
+            if getattr(arguments, 'grid_' + direction + '_slice_count'):
+                spec[direction + '_mode'] = 'equal'
+                spec[direction + '_param'] = getattr(arguments, 'grid_' + direction + '_slice_count')
+            elif getattr(arguments, 'grid_' + direction + '_step_size'):
+                spec[direction + '_mode'] = 'step'
+                spec[direction + '_param'] = getattr(arguments, 'grid_' + direction + '_step_size')
+            else:
+                spec[direction + '_mode'] = 'ratio'
+                spec[direction + '_param'] = getattr(arguments, 'grid_' + direction + '_ratio_string')
+        return spec
+    elif mode == 'auto':
+        return {'mode': 'auto', 'tolerance': arguments.tolerance, 'min_gap': arguments.min_gap,
+                'scale': arguments.scale}
+    else:
+        raise ValueError('A slice mode should be provided: vertical, horizontal, grid or auto.')
+
+
+# standalone worker service, it's a command of it's own, there's no FILE_NAME to slice.
+def _standalone_serve(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='image-slice serve',
+        description='Run a long-lived slicing service, it accepts JSON slice jobs by HTTP on a local port '
+                    'or a unix socket, and runs them on a process pool.'
+                    ' POST /jobs to run a job, GET /stats for queue depth and throughput.')
+    parser.add_argument('--host', default='127.0.0.1', help='Host to listen on, default to 127.0.0.1.')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on, default to 8765.')
+    parser.add_argument('--socket', metavar='PATH', dest='unix_socket', default='',
+                        help='Listen on the unix socket PATH instead of a port.')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Number of worker processes, default to the number of CPUs.')
+    parser.add_argument('--quiet', action='store_true', help='Do not log every request.')
+    parser.add_argument('--image-cache', type=int, metavar='MB', dest='image_cache', default=0,
+                        help='Cache up to MB of decoded images in each worker, for sources sliced several times.')
+    arguments = parser.parse_args(argv)
+    return serve(host=arguments.host, port=arguments.port, unix_socket=arguments.unix_socket,
+                 workers=arguments.workers, quiet=arguments.quiet,
+                 image_cache_bytes=arguments.image_cache * 1024 * 1024)
+
+
+# standalone benchmark of threaded grid slicing, it's a command of it's own.
+def _standalone_benchmark(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='image-slice benchmark',
+        description='Measure how threaded grid slicing scales from 1 to N threads on this machine.')
+    parser.add_argument('image', metavar='FILE_NAME', nargs='?', default=None,
+                        help='The image to slice, a 8000*8000px noise image if omitted.')
+    parser.add_argument('--tile', type=int, default=256, help='The tile size in pixels, default to 256.')
+    parser.add_argument('--max-threads', type=int, dest='max_threads', default=0,
+                        help='The most threads to measure, default to the number of CPUs.')
+    parser.add_argument('--crop-method', choices=['pillow', 'numpy'], dest='crop_method', default='pillow',
+                        help='Crop by PIL or by NumPy slices, default to pillow.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each number of threads, the best is taken.')
+    arguments = parser.parse_args(argv)
+    print('[Grid slice benchmark]  ' + (arguments.image or '8000*8000px noise') + ', ' + str(arguments.tile)
+          + 'px tiles, ' + arguments.crop_method + ' crop')
+    print('threads      seconds    tiles/s  speedup')
+    for result in benchmark_grid_threads(arguments.image, arguments.tile, arguments.max_threads,
+                                         arguments.crop_method, arguments.repeat):
+        print('%7d %12.4f %10.0f %8.2f' % (result['workers'], result['seconds'], result['tiles_per_second'],
+                                          result['speedup']))
+    return 0
+
+
+# standalone tuning of the defaults to this machine, it's a command of it's own.
+def _standalone_tune(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='image-slice tune',
+        description='Measure the crop threads, the encoder options, the encode workers and the band size '
+                    'on a sample of your images, and write the tuning profile the library and the app load.')
+    parser.add_argument('sources', metavar='FILE_NAME', nargs='*',
+                        help='The images or the directories of images to sample, a synthetic image if omitted.')
+    parser.add_argument('--sample', type=int, default=4, help='How many of the images to measure, default to 4.')
+    parser.add_argument('--profile', metavar='PATH', default=None,
+                        help='Write the profile to PATH, default to IMAGE_SLICE_PROFILE, '
+                             'or ~/.config/image-slice/profile.json.')
+    parser.add_argument('--max-size-increase', type=float, metavar='PERCENT', dest='max_size_increase', default=5,
+                        help='How much bigger a faster encoder option may make the files, default to 5 percent.')
+    arguments = parser.parse_args(argv)
+    sources = []
+    for source in arguments.sources:
+        sources.extend(list_image_files(source) if os.path.isdir(source) else [source])
+    print('[Tune]  ' + (str(min(len(sources), arguments.sample)) + ' of ' + str(len(sources)) + ' images'
+                        if sources else '2048*2048px synthetic image') + ', ' + str(os.cpu_count()) + ' CPUs')
+    profile = tune(sources, arguments.sample, arguments.profile, arguments.max_size_increase / 100)
+    print('crop:      ' + str(profile['crop_workers']) + ' thread(s), ' + profile['crop_method'])
+    print('encode:    ' + str(profile['encode_workers']) + ' ' + profile['executor'] + '(s)')
+    for pil_format, options in sorted(profile['encoder_options'].items()):
+        print('%-11s' % (pil_format + ':') + ', '.join(key + '=' + str(value) for key, value in options.items()))
+    print('band:      ' + _format_megabytes(profile['band_bytes']))
+    print('Profile written to ' + _TUNING['path'] + ' in ' + str(profile['seconds']) + 's')
+    return 0
+
+
+# build the argument parser of the standalone app, argparse is only imported when the app runs.
+def _build_argument_parser():
+    import argparse
+
     # Instantiate the parser
     parser = argparse.ArgumentParser(
         description='\'image-slice\' is a tool for easy image slicing:'
@@ -1108,6 +5828,14 @@ def main(argv):
                '\n    %(prog)s horizontal your_image.jpg -r 3:2:1'
                '\n* Slice to a 3*2 grid equally in both direction:'
                '\n    %(prog)s grid your_image.jpg -he 3 -ve 2'
+               '\n* Slice a sprite sheet along the gutters between the sprites:'
+               '\n    %(prog)s sprites.png auto'
+               '\n* Run a slicing service on a unix socket, for help use \'%(prog)s serve --help\':'
+               '\n    %(prog)s serve --socket /tmp/image-slice.sock'
+               '\n* Measure how threaded grid slicing scales on this machine:'
+               '\n    %(prog)s benchmark --max-threads 8'
+               '\n* Tune the threads and the encoder options to this machine, on a sample of your images:'
+               '\n    %(prog)s tune scans/'
                '\n'
                '\nUsage explained:'
                '\n* Slice mode: '
@@ -1149,6 +5877,109 @@ def main(argv):
     # The only global argument to hold the file_name.
     parser.add_argument('file_name', metavar='FILE_NAME', help='File path of the image to be sliced.')
 
+    # Output format, encode the slices straight to this format, instead of the format of the source image.
+    parser.add_argument('-f', '--output-format', metavar='FORMAT', dest='output_format', default='',
+                        help='Save the slices in FORMAT (like webp, png, jpg) instead of the source format.')
+
+    # Spec file, slice the image in several ways described in a JSON file, decode it once.
+    parser.add_argument('--spec-file', metavar='PATH', dest='spec_file', default='',
+                        help='Slice in every way described in the JSON spec file PATH (see load_spec_file()), '
+                             'the image is decoded once. No slice mode is needed then.')
+
+    # Output directory, default to the current working directory.
+    parser.add_argument('-o', '--output-dir', metavar='DIR', dest='output_dir', default='',
+                        help='Write the slices to DIR instead of the current working directory. '
+                             'Or to a archive (.zip, .tar, .tar.gz), or to a S3-compatible storage by '
+                             's3://bucket/prefix/, see open_sink() for the environment variables. '
+                             '\'-\' streams a tar of the slices to stdout.')
+
+    # Job manifest, a log of the finished work, so a interrupted batch resumes instead of restarting from zero.
+    parser.add_argument('--manifest', metavar='PATH', dest='manifest', default='',
+                        help='Record the finished images and slices in the job manifest PATH, '
+                             'rerun with the same PATH to skip them and resume a interrupted job.')
+
+    # Metadata, give the ICC profile, the DPI (and the EXIF) of the source to every slice, upright.
+    parser.add_argument('--keep-metadata', action='store_true', dest='keep_metadata',
+                        help='Turn the image upright by it\'s EXIF orientation before slicing, and give it\'s ICC '
+                             'profile and DPI to every slice, as far as the output format can store them.')
+    parser.add_argument('--keep-exif', action='store_true', dest='keep_exif',
+                        help='Like --keep-metadata, and give the EXIF to every slice too, without the orientation '
+                             'and the thumbnail.')
+
+    # Tile manifest, where each slice is from, it's size and checksum, for the consumers of the slices.
+    parser.add_argument('--tile-manifest', metavar='PATH', dest='tile_manifest', default='',
+                        help='Write a manifest of the slices to PATH: the source size and spec, and the box, size, '
+                             'path, bytes and sha256 of each slice. CSV for a .csv PATH, a JSON list for .json, '
+                             'JSON lines otherwise. See TileManifest.')
+
+    # Incremental, only the tiles whose pixels changed since the last run are rewritten.
+    parser.add_argument('--incremental', metavar='PATH', dest='incremental', default='',
+                        help='Keep the pixel hashes of the slices in the state file PATH, a rerun only encodes and '
+                             'writes the slices which changed, and removes the ones which are not produced any more. '
+                             'For a single image to a output directory.')
+
+    # Tile order, the tiles a viewer needs first are written first.
+    parser.add_argument('--tile-order', metavar='ORDER', dest='tile_order', default='',
+                        help='Write the slices in this order: row-major, spiral (from the center of the viewport, '
+                             'or of the image), hilbert, or a list of slices first, like 3_4,3_5,2_4 (the numbers of '
+                             'the file names). For a single image, or --pipeline. Default: row-major')
+    parser.add_argument('--viewport', metavar='LEFT,UPPER,RIGHT,BOTTOM', dest='viewport', default='',
+                        help='The box of a viewport on the image, the slices it overlaps are written first, '
+                             'in the --tile-order.')
+
+    # Profile the startup, how long the imports and the argument parsing take, compared to the slicing.
+    parser.add_argument('--profile-startup', action='store_true', dest='profile_startup',
+                        help='Print how long the module import, argument parsing, PIL import and the slicing take.')
+
+    # Scale, slice a reduced preview of the image, like thumbnails of every slice.
+    parser.add_argument('--scale', type=float, metavar='SCALE', dest='scale', default=1.0,
+                        help='Slice a reduced preview at SCALE (0 to 1, like 0.25), the slices cover the same areas '
+                             'as in full size. JPEG files are decoded directly in the reduced size.')
+
+    # Trim, slice only the content inside the empty borders, like the blank margins of a scan.
+    parser.add_argument('--trim', action='store_true', dest='trim',
+                        help='Slice only the content inside the empty borders of the image (the color of the top '
+                             'left pixel, or transparent), the borders are not sliced nor written. The boxes in '
+                             'the tile manifest are still on the whole image. With --scale, the borders are found '
+                             'on the reduced image.')
+    parser.add_argument('--trim-tolerance', type=int, metavar='TOLERANCE', dest='trim_tolerance', default=0,
+                        help='How much a border pixel may differ from the background, for scans. Default: 0')
+
+    # Dry run, plan the slices from the image headers, report the tiles, the memory and the output size.
+    parser.add_argument('--dry-run', action='store_true', dest='dry_run',
+                        help='Plan the slices without decoding nor writing anything: report the slices, their '
+                             'boxes, the peak memory and the estimated output size. Fast for a directory too.')
+
+    # Shard, split a job across machines, each runs the same command with it's own INDEX.
+    parser.add_argument('--shard', metavar='INDEX/COUNT', dest='shard', default='',
+                        help='Do only the shard INDEX (0-based) of COUNT of the job, like 0/4 ... 3/4 on 4 machines: '
+                             'the images of a directory are assigned by a stable hash of their relative paths, '
+                             'the slices of a single image by ranges (bands of rows). The shards cover everything '
+                             'exactly once, their outputs merge without conflicts.')
+
+    # Pipeline, decode, crop, encode and write in stages of their own threads, in a bounded memory.
+    parser.add_argument('--pipeline', action='store_true', dest='pipeline',
+                        help='Slice in a staged pipeline (decode, crop, encode, write), each stage has it\'s own '
+                             'threads, the memory is bounded by --memory-budget. See slice_pipeline().')
+    parser.add_argument('--stage-workers', metavar='D,C,E,W', dest='stage_workers', default='',
+                        help='The threads of the decode, crop, encode and write stages of --pipeline, like 1,1,8,2, '
+                             '0 means the number of CPUs. Default: 1,1,0,1')
+    parser.add_argument('--memory-budget', type=int, metavar='MB', dest='memory_budget', default=256,
+                        help='The memory in MB the decoded images and tiles of --pipeline take at most. Default: 256')
+
+    # Out-of-core, a image too big for the memory is decoded into a memory-mapped temporary file.
+    parser.add_argument('--memory-ceiling', type=int, metavar='MB', dest='memory_ceiling', default=0,
+                        help='Decode a image which would take more than MB of memory into a memory-mapped temporary '
+                             'file, band by band, and slice it from there. Default: 1024')
+    parser.add_argument('--max-pixels', type=int, metavar='PIXELS', dest='max_pixels', default=0,
+                        help='Raise PIL\'s decompression bomb limit to PIXELS, for trusted huge images, '
+                             'like gigapixel scans.')
+
+    # Threads, crop the tiles of a grid on several threads.
+    parser.add_argument('--crop-threads', type=int, metavar='N', dest='crop_threads', default=None,
+                        help='Crop the tiles of a grid on N threads, each crops a band of rows, 0 means the number '
+                             'of CPUs. See the benchmark and the tune command. Default: the tuning profile, or 1')
+
     # Enable the sub command feature.
     subparsers = parser.add_subparsers(dest='mode')
 
@@ -1192,6 +6023,17 @@ def main(argv):
     horizontal_mode_group.add_argument('-r', metavar='RATIO_STRING', dest='ratio_string', default='',
                                        help='Slice by a RATIO_STRING like 3:2:1')
 
+    # Auto case:
+
+    # Define a auto sub command parser, the grid of a sprite sheet is detected from it's separator lines.
+    auto_sub_parser = subparsers.add_parser(
+        'auto', help='Auto grid mode, detect the grid of a sprite sheet or a contact sheet from it\'s uniform or '
+                     'transparent separator lines, for help use \'image-slice auto --help\'')
+    auto_sub_parser.add_argument('-t', '--tolerance', type=int, metavar='TOLERANCE', dest='tolerance', default=0,
+                                 help='How much a separator line may vary in each band, for scans. Default: 0')
+    auto_sub_parser.add_argument('--min-gap', type=int, metavar='PIXELS', dest='min_gap', default=1,
+                                 help='The narrowest gutter between 2 cells, in pixels. Default: 1')
+
     # Grid case:
 
     # Grid slice has a totally different argument rule.
@@ -1261,6 +6103,26 @@ def main(argv):
     vertical_sub_parser.set_defaults(func=_standalone_vertical_slice)
     horizontal_sub_parser.set_defaults(func=_standalone_horizontal_slice)
     grid_parser.set_defaults(func=_standalone_grid_slice)
+    auto_sub_parser.set_defaults(func=_standalone_auto_slice)
+
+    return parser
+
+
+# main function when used as a standalone app.
+# mostly it's the argument declarations and parsings. It's like a dispatcher.
+def main(argv):
+    # Commands of their own, they don't slice a FILE_NAME, dispatch them before the slice arguments are parsed.
+    command_argv = argv if argv else sys.argv[1:]
+    if command_argv and command_argv[0] == 'serve':
+        return _standalone_serve(command_argv[1:])
+    if command_argv and command_argv[0] == 'benchmark':
+        return _standalone_benchmark(command_argv[1:])
+    if command_argv and command_argv[0] == 'tune':
+        return _standalone_tune(command_argv[1:])
+
+    # the argument parser, it's built only when the app runs, not when the module is imported as a library.
+    parser_build_started = time.perf_counter()
+    parser = _build_argument_parser()
 
     # Argument parsing begins
 
@@ -1274,39 +6136,191 @@ def main(argv):
         # parse call with no args will handle the 2 command situation properly, like python image_slice.py
         # otherwise the second command, in this case it's the script name, will be recognized to first real argument.
         arguments = parser.parse_args()
+    arguments_parsed = time.perf_counter()
     # print(arguments)
     # arguments should not be empty.
     assert arguments
+    # '-o -' streams the slices to stdout as a tar, so the messages of the app go to stderr.
+    try:
+        if arguments.output_dir == '-':
+            import contextlib
+
+            arguments.output_stream = sys.stdout.buffer
+            with contextlib.redirect_stdout(sys.stderr):
+                return _standalone_slice(arguments)
+        return _standalone_slice(arguments)
+    finally:
+        # every way of slicing reports it, like a dry run, a batch or the pipeline.
+        if arguments.profile_startup:
+            _print_startup_profile(parser_build_started, arguments_parsed)
+
+
+# helper function to print the time of the startup of the app and of the slicing, see '--profile-startup'.
+def _print_startup_profile(parser_build_started, arguments_parsed):
+    finished = time.perf_counter()
+    # to stderr, so it does not mix with the output of the app.
+    sys.stderr.write('[Startup profile]'
+                     + '\n    module import:      '
+                     + _format_milliseconds(_MODULE_IMPORTED - _MODULE_IMPORT_STARTED)
+                     + '\n      of which PIL:     ' + _format_milliseconds(_PIL_IMPORTED - _PIL_IMPORT_STARTED)
+                     + '\n    argument parsing:   ' + _format_milliseconds(arguments_parsed - parser_build_started)
+                     + '\n    slicing and saving: ' + _format_milliseconds(finished - arguments_parsed)
+                     + '\n    total in python:    ' + _format_milliseconds(finished - _MODULE_IMPORT_STARTED)
+                     + '\n')
+
+
+# the app after the arguments are parsed, see main().
+def _standalone_slice(arguments):
     # the name of image file to be sliced, should not be empty.
     assert arguments.file_name
     print("[Image File Name]: " + arguments.file_name)
 
+    # the out-of-core mode, for images too big for the memory.
+    if arguments.memory_ceiling or arguments.max_pixels:
+        enable_out_of_core(memory_ceiling=(arguments.memory_ceiling or 1024) * 1024 * 1024,
+                           max_pixels=arguments.max_pixels)
+
+    # the source to be sliced, by default the file name, the sub functions open it themselves.
+    # '-' reads the image from stdin, it's opened once here, the sub functions take it as a image.
+    if arguments.file_name == '-':
+        if arguments.pipeline or arguments.manifest:
+            raise ValueError("Reading the image from stdin ('-') is not supported by --pipeline or --manifest.")
+        arguments.source = _open_image(sys.stdin.buffer)
+        # there's no file name, the slices are named 'stdin', with the ext name of the image format.
+        arguments.source_name = 'stdin.' + _ext_name_of_format(arguments.source.format)
+    else:
+        arguments.source = arguments.source_name = arguments.file_name
+
+    # a shard of the job, parsed once here.
+    arguments.shard = parse_shard_string(arguments.shard) if arguments.shard else None
+
+    # the tile order, parsed once here.
+    arguments.tile_order = parse_tile_order(arguments.tile_order) if arguments.tile_order else None
+    arguments.viewport = _parse_viewport_string(arguments.viewport) if arguments.viewport else None
+    if (arguments.tile_order or arguments.viewport) and not arguments.pipeline \
+            and (arguments.manifest or arguments.spec_file or os.path.isdir(arguments.file_name)):
+        raise ValueError('--tile-order and --viewport are for a single image, or --pipeline, not with --manifest, '
+                         '--spec-file or a directory.')
+
+    # incremental re-slicing keeps the state of the slices of one image.
+    if arguments.incremental and (arguments.pipeline or arguments.manifest or arguments.spec_file
+                                  or os.path.isdir(arguments.file_name)):
+        raise ValueError('--incremental is for slicing a single image, not with --pipeline, --manifest, '
+                         '--spec-file or a directory.')
+
+    # a dry run, plan the slices, nothing is decoded nor written.
+    if arguments.dry_run:
+        return _standalone_dry_run(arguments)
+
+    # the staged pipeline, for a image or a directory.
+    if arguments.pipeline:
+        return _standalone_pipeline(arguments)
+
+    # a directory, slice every image in it the same way. Or a job manifest, to resume a interrupted job.
+    if os.path.isdir(arguments.file_name) or arguments.manifest:
+        return _standalone_batch(arguments)
+
+    # a spec file, several ways to slice the image.
+    if arguments.spec_file:
+        return _standalone_multi_spec(arguments)
+
+    # keep the metadata, the source is turned upright once, and it's metadata serialized once for all the slices.
+    metadata = None
+    if arguments.keep_metadata or arguments.keep_exif:
+        arguments.source = orient_image(arguments.source)
+        metadata = image_metadata(arguments.source, exif=arguments.keep_exif)
+    # converting to another format, the mode conversion (like RGBA->RGB) is done once here, not for every slice.
+    if arguments.output_format:
+        output_pil_format = get_pil_format_from_ext_name(arguments.output_format)
+        print("[Output Format]: " + output_pil_format)
+        # a scaled preview is converted after it's sliced, so the source can still be decoded in a reduced size.
+        if arguments.scale == 1.0:
+            arguments.source = convert_image_for_format(arguments.source, output_pil_format)
+    else:
+        output_pil_format = None
+
     # dispatch the execution to the sub functions accordingly.
-    output_slices = arguments.func(arguments)
+    # trimmed, the grid slice trims itself, the other modes are sliced by their spec, see slice_by_spec().
+    if arguments.trim and arguments.func is not _standalone_grid_slice:
+        output_slices = slice_by_spec(arguments.source, _spec_from_arguments(arguments))
+    else:
+        output_slices = arguments.func(arguments)
 
     # make sure output_slices is not empty.
     assert output_slices
 
+    # the reduced slices of a scaled preview, convert them to the output format now, they are small.
+    if output_pil_format and arguments.scale != 1.0:
+        output_slices = _convert_slices_for_format(output_slices, output_pil_format)
+
     # get current working directory as the output dir. later we will pass the it to the file saving functions.
-    working_dir = get_current_cwd()
+    working_dir = arguments.output_dir or get_current_cwd()
     # get the pure file name of the input file, input may be a path, so we have to make sure path part not there.
-    file_name_original = get_file_basename_without_path(arguments.file_name)
+    file_name_original = get_file_basename_without_path(arguments.source_name)
     file_name_without_ext, file_name_ext = split_pure_file_name_from_ext_name(file_name_original)
-
-    # save the output slices to current working directory
-    if isinstance(output_slices[0], Image.Image):
-        # it's a list of Images, save this list.
-        save_image_list(output_slices, working_dir, file_name_without_ext, file_name_ext)
-    else:
-        # it should be a list of list, confirm it, save the list of list.
-        assert isinstance(output_slices[0], list)
-        save_image_grid(output_slices, working_dir, file_name_without_ext, file_name_ext)
+    if arguments.output_format:
+        file_name_ext = arguments.output_format.lower().lstrip('.')
+
+    # save the output slices to current working directory, or the archive, or the object storage of '-o'.
+    output = _output_from_arguments(arguments)
+    tile_manifest = _tile_manifest_from_arguments(arguments)
+    try:
+        incremental = IncrementalState(arguments.incremental, output) if arguments.incremental else None
+        if tile_manifest is not None:
+            # the size of the full size (upright) source, the header only if it's not opened yet.
+            if isinstance(arguments.source, str):
+                with Image.open(arguments.source) as source_header:
+                    source_size = source_header.size
+            else:
+                source_size = arguments.source.size
+            tile_manifest.add_source(arguments.file_name, source_size, _spec_from_arguments(arguments))
+        # a shard saves only it's range of the slices, the other shards save the others.
+        skip_names = None
+        if arguments.shard:
+            skip_names = _names_outside_shard([name + '.' + file_name_ext for name, _ in
+                                               _slice_file_names(output_slices, file_name_without_ext)],
+                                              arguments.shard)
+        if isinstance(output_slices[0], Image.Image):
+            # it's a list of Images, save this list.
+            save_image_list(output_slices, output, file_name_without_ext, file_name_ext, output_pil_format,
+                            skip_names=skip_names, tile_manifest=tile_manifest, metadata=metadata,
+                            incremental=incremental, order=arguments.tile_order, viewport=arguments.viewport)
+        else:
+            # it should be a list of list, confirm it, save the list of list.
+            assert isinstance(output_slices[0], list)
+            save_image_grid(output_slices, output, file_name_without_ext, file_name_ext, output_pil_format,
+                            skip_names=skip_names, tile_manifest=tile_manifest, metadata=metadata,
+                            incremental=incremental, order=arguments.tile_order, viewport=arguments.viewport)
+        if incremental is not None:
+            incremental.close()
+            print('[Incremental] ' + str(incremental.written) + ' slices written, ' + str(incremental.unchanged)
+                  + ' unchanged, ' + str(incremental.removed) + ' removed.')
+    finally:
+        _close_output(output, tile_manifest)
 
     # everything's done, print success message, return 0.
-    print('Slice completed, check current working directory, slices should already be there.')
+    if arguments.output_dir == '-':
+        print('Slice completed, the slices are streamed to stdout as a tar.')
+    else:
+        print('Slice completed, check ' + ('\'' + working_dir + '\'' if arguments.output_dir
+                                           else 'current working directory') + ', slices should already be there.')
     return 0
 
 
+# helper function to format seconds in milliseconds for the startup profile.
+def _format_milliseconds(seconds):
+    return '%8.1f ms' % (seconds * 1000)
+
+
+# helper function to format bytes in megabytes for the dry run.
+def _format_megabytes(size):
+    return '%.1f MB' % (size / (1024.0 * 1024.0))
+
+
+# when the module import ends, for --profile-startup.
+_MODULE_IMPORTED = time.perf_counter()
+
+
 if __name__ == "__main__":
     # When image_slice.py is called directly from the command line, argparse should fetch the args directly.
     # That is because if a command is a 2-word combination, like 'python image_slice.py',
@@ -1314,4 +6328,4 @@ if __name__ == "__main__":
     # But if it's fetched directly, this case will be fine.
     # 'python image_slice.py' will be treated as a whole command in the argv[0],
     # not 'python' in argv[0], 'image_slice.py' in argv[1] as the first argument.
-    main(argv=None)
+    sys.exit(main(argv=None))